@@ -1,35 +1,257 @@
-import subprocess
+#!/usr/bin/env python3
+"""
+HTTP API for the Covid-19 poly-encoder.
+
+The model is loaded once inside the API process. Requests are handed to a single
+inference worker thread through a queue, so concurrent requests never share any
+agent state, and the answer is read straight from the agent's reply instead of
+being scraped from a subprocess' stdout.
+
+.. code-block:: shell
+
+  uvicorn fastapi_covid:app --host 0.0.0.0 --port 8000
+  curl 'localhost:8000/?question=What%20is%20Covid-19%3F&topk=3'
+  curl 'localhost:8000/stats'
+  curl -X POST 'localhost:8000/reload'
+
+Set ``PARLAI_ARGS`` to pass extra command line flags to the agent, e.g.
+``PARLAI_ARGS='-mf model/other/model --rank-top-k 50'``.
+
+After the candidate set was changed with
+``parlai/scripts/update_fixed_candidates.py``, ``POST /reload`` makes the server
+pick it up without a restart.
+"""
+
+import asyncio
+import os
+import queue
+import shlex
+import threading
+import time
+from collections import deque
+from typing import Optional
+
 from fastapi import FastAPI
 
+from parlai.core.agents import create_agent
+from parlai.core.params import ParlaiParser
+
+MODEL_FILE = 'model/covid19_scraped_ver6/poly_encoder_covid19'
+# number of recent requests used for the latency percentiles
+LATENCY_WINDOW = 10000
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Serve a ranking model over HTTP')
+    parser.add_argument(
+        '--api-topk',
+        type=int,
+        default=5,
+        help='Default number of ranked candidates returned per request',
+    )
+    parser.set_defaults(model_file=MODEL_FILE, interactive_mode=True, task=None)
+    parser.set_params(
+        model='transformer/polyencoder',
+        no_cuda=True,
+        interactive_mode=True,
+        single_turn=True,
+        encode_candidate_vecs=True,
+        return_cand_scores=True,
+        # each request is its own one-turn episode: the only thing in the history
+        # is the question itself, so repeat blocking would only drop candidates
+        # and misalign them with their scores.
+        repeat_blocking_heuristic=False,
+    )
+    return parser
+
+
+class LatencyTracker(object):
+    """
+    Keep a rolling window of request latencies and report percentiles.
+    """
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._count = 0
+
+    def add(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._count += 1
+
+    def report(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+            count = self._count
+        report = {'requests': count, 'window': len(latencies)}
+        for pct in (50, 90, 99):
+            if latencies:
+                idx = min(len(latencies) - 1, int(len(latencies) * pct / 100))
+                report['p{}_ms'.format(pct)] = round(latencies[idx] * 1000, 2)
+            else:
+                report['p{}_ms'.format(pct)] = None
+        return report
+
+
+class ModelServer(object):
+    """
+    Own the agent and run it on a dedicated inference thread.
+
+    Callers on the event loop use ``await server.predict(text)``; the request is
+    queued and the future is resolved from the worker thread once the agent
+    replies.
+    """
+
+    def __init__(self, opt):
+        self.opt = opt
+        self.agent = create_agent(opt, requireModelExists=True)
+        self.queue = queue.Queue()
+        self.queue_latency = LatencyTracker()
+        self.model_latency = LatencyTracker()
+        self.total_latency = LatencyTracker()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def predict(self, text, topk=None):
+        """
+        Queue a question for the inference worker.
+
+        :return: an asyncio future resolving to the result dict.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        if topk is None:
+            topk = self.opt['api_topk']
+        self.queue.put((self._act, (text, topk), loop, future, time.time()))
+        return future
+
+    def reload_candidates(self):
+        """
+        Queue a reload of the fixed candidates file.
+
+        Runs on the inference thread between two requests, so no request sees a
+        partially updated candidate set.
+
+        :return: an asyncio future resolving to the new number of candidates.
+        """
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self.queue.put((self._reload, (), loop, future, None))
+        return future
+
+    def shutdown(self):
+        self.queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            func, args, loop, future, enqueued = item
+            started = time.time()
+            try:
+                result = func(*args)
+            except Exception as e:
+                loop.call_soon_threadsafe(_set_exception, future, e)
+                continue
+            finished = time.time()
+            if enqueued is not None:
+                self.queue_latency.add(started - enqueued)
+                self.model_latency.add(finished - started)
+                self.total_latency.add(finished - enqueued)
+                result['timings']['queue_ms'] = 1000 * (started - enqueued)
+            loop.call_soon_threadsafe(_set_result, future, result)
+
+    def _act(self, text, topk):
+        # every request is a full episode so the history is cleared afterwards
+        started = time.time()
+        self.agent.observe({'text': text, 'episode_done': True})
+        vectorized = time.time()
+        reply = self.agent.act()
+        finished = time.time()
+        # time spent in each stage of this request, in milliseconds; agents run
+        # with --profile-stages report finer stages, e.g. encode_ctxt_ms
+        timings = {
+            'vectorize_ms': 1000 * (vectorized - started),
+            'model_ms': 1000 * (finished - vectorized),
+        }
+        for key, value in reply.get('metrics', {}).items():
+            if key.endswith('_ms'):
+                timings[key] = value.value()
+        cands = reply.get('text_candidates') or [reply.get('text')]
+        scores = reply.get('sorted_scores')
+        if scores is not None:
+            scores = scores.tolist()
+        else:
+            scores = [None] * len(cands)
+        return {
+            'answer': reply.get('text'),
+            'candidates': [
+                {'text': c, 'score': s} for c, s in zip(cands[:topk], scores[:topk])
+            ],
+            'timings': timings,
+        }
+
+    def _reload(self):
+        self.agent.reload_fixed_candidates()
+        return self.agent.num_fixed_candidates
+
+    def report(self):
+        return {
+            'queue_size': self.queue.qsize(),
+            'total': self.total_latency.report(),
+            'queue': self.queue_latency.report(),
+            'model': self.model_latency.report(),
+        }
+
+
+def _set_result(future, result):
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    if not future.cancelled():
+        future.set_exception(exc)
+
+
 app = FastAPI()
+SERVER = {}
+
+
+@app.on_event('startup')
+def load_model():
+    parser = setup_args()
+    opt = parser.parse_args(shlex.split(os.environ.get('PARLAI_ARGS', '')))
+    SERVER['model'] = ModelServer(opt)
+
+
+@app.on_event('shutdown')
+def unload_model():
+    if 'model' in SERVER:
+        SERVER.pop('model').shutdown()
+
 
-##########################################################
-# Launch a command with pipes
-# p = subprocess.Popen(['python -m parlai.scripts.interactive -mf ../model/poly/covid7'], shell=True,
-#                      stdout=subprocess.PIPE,
-#                      stdin=subprocess.PIPE)
-p = subprocess.Popen(['python -m parlai.scripts.interactive -mf model/covid19_scraped_ver6/poly_encoder_covid19'], shell=True,
-                     stdout=subprocess.PIPE,
-                     stdin=subprocess.PIPE)
-
-while 1:
-    line = p.stdout.readline()
-    line = line.strip().decode()
-    #print(line)
-    if line == '[  polyencoder_type: codes ]':
-        break
-#the model is ready for interactivation
-##########################################################
 @app.get("/")
-def root(question: str = "What is Covid-19?"):
-    # Send the question and get the output
-    p.stdin.write(bytes(question, 'utf-8'))
-    p.stdin.write(bytes("\n", 'utf-8'))
-    p.stdin.flush()
-    line = p.stdout.readline()
-    line = line.strip().decode() # To interpret as text, decode
-    if '[Polyencoder]' in line: # Exclude warnings and other messages
-        line = line.split('[Polyencoder]:')
-    #print(line)
-    result=line[-1]
-    return {"question": question, "answers": result}
+async def root(question: str = "What is Covid-19?", topk: Optional[int] = None):
+    result = await SERVER['model'].predict(question, topk)
+    return {
+        "question": question,
+        "answers": result['answer'],
+        "candidates": result['candidates'],
+        "timings": result['timings'],
+    }
+
+
+@app.get("/stats")
+async def stats():
+    return SERVER['model'].report()
+
+
+@app.post("/reload")
+async def reload():
+    num_candidates = await SERVER['model'].reload_candidates()
+    return {"candidates": num_candidates}
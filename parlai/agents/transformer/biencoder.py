@@ -103,6 +103,14 @@ class BiencoderAgent(TransformerRankerAgent):
         obs = TorchRankerAgent.vectorize(self, *args, **kwargs)
         return obs
 
+    def vectorize_fixed_candidates(self, *args, **kwargs):
+        """
+        Override to add start end tokens.
+        """
+        kwargs['add_start'] = True
+        kwargs['add_end'] = True
+        return super().vectorize_fixed_candidates(*args, **kwargs)
+
     def _vectorize_text(self, *args, **kwargs):
         """
         Override to add start end tokens.
@@ -12,13 +12,22 @@ from typing import Any, Dict, Optional, Tuple
 
 import torch
 
+from parlai.core.metrics import GlobalSumMetric
 from parlai.core.opt import Opt
 from parlai.core.torch_ranker_agent import TorchRankerAgent
+from parlai.utils.ann import IVFIndex
+from parlai.utils.torch import (
+    neginf,
+    quantize_linear_layers,
+    QuantizedRows,
+    TensorCache,
+)
 from .biencoder import AddLabelFixedCandsTRA
 from .modules import (
     BasicAttention,
     MultiHeadAttention,
     TransformerEncoder,
+    TransformerFFN,
     get_n_positions_from_options,
 )
 from .transformer import TransformerRankerAgent
@@ -32,6 +41,9 @@ class PolyencoderAgent(TorchRankerAgent):
     rely on an external library (hugging face).
     """
 
+    # fixed candidate encodings are [1, num_cands, dim], see _make_candidate_encs
+    fixed_candidate_encs_dim = 1
+
     @classmethod
     def add_cmdline_args(cls, argparser):
         """
@@ -92,6 +104,66 @@ class PolyencoderAgent(TorchRankerAgent):
             help='In case codes-attention-type is multihead, '
             'specify the number of heads',
         )
+        agent.add_argument(
+            '--poly-ann-shortlist',
+            type=int,
+            default=-1,
+            help='If > 0 and candidate encodings are cached, first shortlist '
+            'this many fixed candidates with an approximate nearest neighbour '
+            'index (dot product with the mean of the context codes), and only '
+            'compute the full poly-encoder score for the shortlist. Candidates '
+            'outside the shortlist get a score of -inf.',
+        )
+        agent.add_argument(
+            '--poly-ann-lists',
+            type=int,
+            default=-1,
+            hidden=True,
+            help='Number of k-means cells in the candidate index; defaults to '
+            'the square root of the number of candidates.',
+        )
+        agent.add_argument(
+            '--poly-ann-probe',
+            type=int,
+            default=8,
+            hidden=True,
+            help='Number of k-means cells searched per query in the candidate '
+            'index. Higher values trade speed for recall.',
+        )
+        agent.add_argument(
+            '--poly-context-cache-mb',
+            type=float,
+            default=0,
+            help='At inference, cache the encodings of contexts without dialogue '
+            'history, up to this many megabytes, so that repeated questions skip '
+            'the context encoder. 0 disables the cache.',
+        )
+        agent.add_argument(
+            '--poly-context-cache-ttl',
+            type=float,
+            default=-1,
+            hidden=True,
+            help='Expire cached context encodings after this many seconds. '
+            '-1 keeps them until they are evicted.',
+        )
+        agent.add_argument(
+            '--poly-int8-inference',
+            type='bool',
+            default=False,
+            help='When running inference on CPU, quantize the weights of the '
+            'linear layers of the attention and feed-forward blocks to int8. '
+            'The float candidate encoder is kept to encode fixed candidates. '
+            'Ignored when training or on GPU.',
+        )
+        agent.add_argument(
+            '--poly-cand-encs-dtype',
+            type=str,
+            default='float32',
+            choices=['float32', 'float16', 'int8'],
+            help='Keep cached fixed candidate encodings in memory with this '
+            'precision. They are converted back to the model precision chunk by '
+            'chunk when scoring; int8 uses a quarter of the memory of float32.',
+        )
         return agent
 
     @classmethod
@@ -116,10 +188,112 @@ class PolyencoderAgent(TorchRankerAgent):
         return opt_from_disk
 
     def __init__(self, opt, shared=None):
+        # the candidate encoder before int8 quantization, see _quantize_model
+        self._float_cand_encoder = shared.get('float_cand_encoder') if shared else None
         super().__init__(opt, shared)
         self.rank_loss = torch.nn.CrossEntropyLoss(reduce=True, size_average=True)
         if self.use_cuda:
             self.rank_loss.cuda()
+        if shared is None and opt.get('poly_int8_inference', False):
+            self._quantize_model()
+        self.ann_shortlist = opt.get('poly_ann_shortlist', -1)
+        if shared is not None:
+            self._ann_index = shared.get('ann_index')
+        else:
+            self._ann_index = None
+            if self.ann_shortlist > 0 and self.fixed_candidate_encs is not None:
+                # build the index up front so that shared copies reuse it
+                self._get_ann_index(self.fixed_candidate_encs)
+        if shared is not None:
+            self.context_cache = shared.get('context_cache')
+        elif opt.get('poly_context_cache_mb', 0) > 0:
+            self.context_cache = TensorCache(
+                opt['poly_context_cache_mb'], opt.get('poly_context_cache_ttl', -1)
+            )
+        else:
+            self.context_cache = None
+
+    def share(self):
+        """
+        Share the candidate index along with the model.
+        """
+        shared = super().share()
+        shared['ann_index'] = self._ann_index
+        shared['context_cache'] = self.context_cache
+        shared['float_cand_encoder'] = self._float_cand_encoder
+        return shared
+
+    def _ranking_options(self):
+        """
+        Add the options of the candidate shortlist and of int8 inference.
+        """
+        return super()._ranking_options() + [
+            self.ann_shortlist,
+            self.opt.get('poly_ann_lists', -1),
+            self.opt.get('poly_ann_probe', 8),
+            self.opt.get('poly_int8_inference', False),
+        ]
+
+    def _quantize_model(self):
+        """
+        Quantize the linear layers of the attention and feed-forward blocks.
+
+        Fixed candidates keep the full precision of the original weights: the
+        float candidate encoder is kept to encode candidates added later, and
+        the stored encodings stay keyed by the float weights.
+        """
+        if self.use_cuda or self.fp16 or self._should_initialize_optimizer():
+            print('[ --poly-int8-inference only applies to CPU inference, ignoring ]')
+            return
+        self._weights_signature()
+        self._float_cand_encoder = self.model.encoder_cand.eval()
+        self.model = quantize_linear_layers(
+            self.model, within=(MultiHeadAttention, TransformerFFN)
+        )
+        print('[ Quantized the linear layers of the model to int8 ]')
+
+    def _prepare_fixed_candidate_encs(self, encs):
+        """
+        Keep the cached candidate encodings in the --poly-cand-encs-dtype format.
+        """
+        encs_dtype = self.opt.get('poly_cand_encs_dtype', 'float32')
+        if encs_dtype == 'int8':
+            if self.use_cuda:
+                encs = encs.cuda()
+            return QuantizedRows(encs)
+        encs = super()._prepare_fixed_candidate_encs(encs)
+        if encs_dtype == 'float16':
+            return encs.half()
+        return encs
+
+    def _dequantize_encs(self, cand_encs):
+        """
+        Convert (a slice of) the cached candidate encodings to the model dtype.
+        """
+        dtype = torch.half if self.fp16 else torch.float
+        if isinstance(cand_encs, QuantizedRows):
+            return cand_encs.dequantize(dtype)
+        return cand_encs.to(dtype)
+
+    def _get_ann_index(self, cand_encs):
+        """
+        Return the ANN index over cand_encs, building it if necessary.
+
+        The index is kept alongside the tensor it was built from, and rebuilt
+        if the candidate encodings are replaced.
+        """
+        if self._ann_index is None or self._ann_index[0] is not cand_encs:
+            print(
+                "[ Building candidate index over {} candidate encodings ]"
+                "".format(cand_encs.size(1))
+            )
+            index = IVFIndex(
+                self._dequantize_encs(cand_encs[0]),
+                n_lists=self.opt.get('poly_ann_lists', -1),
+                n_probe=self.opt.get('poly_ann_probe', 8),
+            )
+            self._ann_index = (cand_encs, index)
+        return self._ann_index[1]
 
     def build_model(self, states=None):
         """
@@ -174,6 +348,8 @@ class PolyencoderAgent(TorchRankerAgent):
         """
         Encode candidates.
         """
+        if self._float_cand_encoder is not None:
+            return self._float_cand_encoder(padded_cands).unsqueeze(1)
         padded_cands = padded_cands.unsqueeze(1)
         _, _, cand_rep = self.model(cand_tokens=padded_cands)
         return cand_rep
@@ -186,19 +362,30 @@ class PolyencoderAgent(TorchRankerAgent):
         model applies additional attention before ultimately scoring a candidate.
         """
         bsz = self._get_batch_size(batch)
-        ctxt_rep, ctxt_rep_mask, _ = self.model(**self._model_context_input(batch))
+        with self.stage_timer.stage('encode_ctxt'):
+            ctxt_rep, ctxt_rep_mask = self._encode_context(batch)
+
+        if (
+            cand_encs is not None
+            and 0 < self.ann_shortlist < cand_encs.size(1)
+            and not self.is_training
+        ):
+            return self._score_shortlist(ctxt_rep, ctxt_rep_mask, cand_encs)
 
         if cand_encs is not None:
+            cand_encs = self._dequantize_encs(cand_encs)
             if bsz == 1:
                 cand_rep = cand_encs
             else:
                 cand_rep = cand_encs.expand(bsz, cand_encs.size(1), -1)
         # bsz x num cands x seq len
         elif len(cand_vecs.shape) == 3:
-            _, _, cand_rep = self.model(cand_tokens=cand_vecs)
+            with self.stage_timer.stage('encode_cands'):
+                _, _, cand_rep = self.model(cand_tokens=cand_vecs)
         # bsz x seq len (if batch cands) or num_cands x seq len (if fixed cands)
         elif len(cand_vecs.shape) == 2:
-            _, _, cand_rep = self.model(cand_tokens=cand_vecs.unsqueeze(1))
+            with self.stage_timer.stage('encode_cands'):
+                _, _, cand_rep = self.model(cand_tokens=cand_vecs.unsqueeze(1))
             num_cands = cand_rep.size(0)  # will be bsz if using batch cands
             cand_rep = cand_rep.expand(num_cands, bsz, -1).transpose(0, 1).contiguous()
         scores = self.model(
@@ -206,6 +393,123 @@ class PolyencoderAgent(TorchRankerAgent):
         )
         return scores
 
+    def score_candidates_chunked(self, batch, cand_vecs, cand_encs, k, chunksize):
+        """
+        Score cached candidate encodings chunk by chunk, encoding the context once.
+        """
+        if cand_encs is None:
+            return super().score_candidates_chunked(
+                batch, cand_vecs, cand_encs, k, chunksize
+            )
+        if 0 < self.ann_shortlist < cand_encs.size(1) and not self.is_training:
+            # the shortlist already bounds the scoring cost
+            scores = self.score_candidates(batch, cand_vecs, cand_encs=cand_encs)
+            return scores.topk(k, 1)
+
+        with self.stage_timer.stage('encode_ctxt'):
+            ctxt_rep, ctxt_rep_mask = self._encode_context(batch)
+        bsz = ctxt_rep.size(0)
+
+        def score_chunk(start, end):
+            cand_rep = self._dequantize_encs(cand_encs[:, start:end])
+            cand_rep = cand_rep.expand(bsz, end - start, -1)
+            return self.model(
+                ctxt_rep=ctxt_rep, ctxt_rep_mask=ctxt_rep_mask, cand_rep=cand_rep
+            )
+
+        return self._chunked_topk(score_chunk, cand_encs.size(1), k, chunksize)
+
+    def _encode_context(self, batch):
+        """
+        Return the context representation and mask, using the context cache.
+
+        Only contexts without dialogue history are cached, keyed by their token
+        ids. The cache is skipped during training, and cleared by
+        ``update_params`` since the weights change.
+        """
+        if self.context_cache is None or self.is_training or batch.observations is None:
+            ctxt_rep, ctxt_rep_mask, _ = self.model(**self._model_context_input(batch))
+            return ctxt_rep, ctxt_rep_mask
+
+        keys = [self._context_cache_key(obs) for obs in batch.observations]
+        cached = [None if k is None else self.context_cache.get(k) for k in keys]
+        missing = [i for i, c in enumerate(cached) if c is None]
+        hits = len(keys) - len(missing)
+        bypass = sum(k is None for k in keys)
+        self.global_metrics.add('ctxt_cache_hits', GlobalSumMetric(hits))
+        self.global_metrics.add(
+            'ctxt_cache_misses', GlobalSumMetric(len(missing) - bypass)
+        )
+        if not missing:
+            return (
+                torch.stack([c[0] for c in cached]),
+                torch.stack([c[1] for c in cached]),
+            )
+
+        ctxt_input = self._model_context_input(batch)
+        if hits:
+            # only encode the contexts that are not cached
+            idx = torch.LongTensor(missing).to(batch.text_vec.device)
+            ctxt_input = {
+                k: v.index_select(0, idx) if torch.is_tensor(v) else v
+                for k, v in ctxt_input.items()
+            }
+        ctxt_rep, ctxt_rep_mask, _ = self.model(**ctxt_input)
+        for j, i in enumerate(missing):
+            if keys[i] is not None:
+                self.context_cache.put(keys[i], (ctxt_rep[j], ctxt_rep_mask[j]))
+        if not hits:
+            return ctxt_rep, ctxt_rep_mask
+        for j, i in enumerate(missing):
+            cached[i] = (ctxt_rep[j], ctxt_rep_mask[j])
+        return (
+            torch.stack([c[0] for c in cached]),
+            torch.stack([c[1] for c in cached]),
+        )
+
+    def update_params(self):
+        """
+        Update the weights, then drop the context encodings of the old weights.
+        """
+        super().update_params()
+        if self.context_cache is not None:
+            # shared with the copies that evaluate, e.g. during validation
+            self.context_cache.clear()
+
+    def _context_cache_key(self, obs):
+        """
+        Return the context cache key of an observation, or None to bypass it.
+        """
+        vec = obs.get('text_vec')
+        if vec is None or obs.get('full_text', obs.get('text')) != obs.get('text'):
+            # the context includes earlier turns
+            return None
+        if torch.is_tensor(vec):
+            vec = vec.tolist()
+        return tuple(vec)
+
+    def _score_shortlist(self, ctxt_rep, ctxt_rep_mask, cand_encs):
+        """
+        Score only an approximate top-N of the cached candidate encodings.
+
+        The shortlist is retrieved with the mean of the context vectors as
+        query, then scored with the full poly-encoder attention. Scores of the
+        candidates that were not shortlisted are set to -inf.
+        """
+        bsz = ctxt_rep.size(0)
+        num_cands = cand_encs.size(1)
+        mask = ctxt_rep_mask.unsqueeze(2).type_as(ctxt_rep)
+        summary = (ctxt_rep * mask).sum(1) / mask.sum(1).clamp(min=1)
+        index = self._get_ann_index(cand_encs)
+        _, shortlist = index.search(summary, self.ann_shortlist)
+        shortlist = shortlist.to(cand_encs.device)
+        cand_rep = self._dequantize_encs(cand_encs[0][shortlist])
+        short_scores = self.model(
+            ctxt_rep=ctxt_rep, ctxt_rep_mask=ctxt_rep_mask, cand_rep=cand_rep
+        )
+        scores = short_scores.new_full((bsz, num_cands), neginf(short_scores.dtype))
+        return scores.scatter_(1, shortlist, short_scores)
+
     def _get_batch_size(self, batch) -> int:
         """
         Return the size of the batch.
@@ -491,6 +795,9 @@ class PolyEncoderModule(torch.nn.Module):
         ctxt_final_rep = self.attend(
             self.attention, cand_embed, ctxt_rep, ctxt_rep, ctxt_rep_mask
         )
+        if ctxt_final_rep.dim() == 2:
+            # basic attention squeezes the candidate dimension of a single candidate
+            ctxt_final_rep = ctxt_final_rep.unsqueeze(1)
         scores = torch.sum(ctxt_final_rep * cand_embed, 2)
         return scores
 
@@ -4,6 +4,7 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 
+import threading
 import time
 from abc import ABC, abstractmethod
 from queue import Queue
@@ -23,6 +24,8 @@ class ChatServiceAgent(Agent, ABC):
         self.acted_packets = {}
         self.data = {}
         self.msg_queue = Queue()
+        # events set whenever a message is queued, see add_message_listener
+        self.message_listeners = set()
         self.observed_packets = {}
         self.message_request_time = None
         self.stored_data = {}
@@ -80,6 +83,20 @@ class ChatServiceAgent(Agent, ABC):
         if act_id not in self.acted_packets:
             self.acted_packets[act_id] = act_data
             self.msg_queue.put(action)
+            for event in list(self.message_listeners):
+                event.set()
+
+    def add_message_listener(self, event):
+        """
+        Set the given threading.Event whenever a message is queued.
+
+        Lets the thread running a world sleep until one of its agents has a new
+        message, instead of polling.
+        """
+        self.message_listeners.add(event)
+
+    def remove_message_listener(self, event):
+        self.message_listeners.discard(event)
 
     def set_stored_data(self):
         """
@@ -116,18 +133,24 @@ class ChatServiceAgent(Agent, ABC):
 
     def act_blocking(self, timeout=None):
         """
-        Repeatedly loop until we retrieve a message from the queue.
-        """
-        while True:
-            if self.message_request_time is None:
-                self.message_request_time = time.time()
-            msg = self.act()
-            if msg is not None:
-                self.message_request_time = None
-                return msg
-            if self._check_timeout(timeout):
-                return None
-            time.sleep(0.2)
+        Wait until we retrieve a message from the queue.
+        """
+        event = threading.Event()
+        self.add_message_listener(event)
+        try:
+            while True:
+                if self.message_request_time is None:
+                    self.message_request_time = time.time()
+                event.clear()
+                msg = self.act()
+                if msg is not None:
+                    self.message_request_time = None
+                    return msg
+                if self._check_timeout(timeout):
+                    return None
+                event.wait(0.2)
+        finally:
+            self.remove_message_listener(event)
 
     def episode_done(self):
         """
@@ -466,6 +466,8 @@ class ChatServiceManager(ABC):
             agent.time_in_pool.setdefault(world_type, time.time())
             # add agent to pool
             self.agent_pool.setdefault(world_type, []).append(agent)
+            # wake up the main loop to start a world for it
+            self.agent_pool_change_condition.notify_all()
 
     def remove_agent_from_pool(
         self, agent: AgentState, world_type: str = 'default', mark_removed: bool = True
@@ -759,7 +761,9 @@ class ChatServiceManager(ABC):
                         future.add_done_callback(done_callback)
                         self.active_worlds[task_id] = future
 
-            time.sleep(utils.THREAD_MEDIUM_SLEEP)
+                # sleep until an agent joins a pool, checking the pool timeouts
+                # at least every THREAD_MEDIUM_SLEEP seconds
+                self.agent_pool_change_condition.wait(utils.THREAD_MEDIUM_SLEEP)
 
     def shutdown(self):
         """
@@ -4,13 +4,31 @@
 # This source code is licensed under the MIT license found in the
 # LICENSE file in the root directory of this source tree.
 import logging
+import threading
 import time
 import datetime
 from concurrent import futures
+from contextlib import contextmanager
 import parlai.chat_service.utils.logging as log_utils
 import parlai.chat_service.utils.misc as utils
 
 
+@contextmanager
+def _wake_on_message(agents):
+    """
+    Yield an event that is set whenever one of the agents receives a message.
+    """
+    event = threading.Event()
+    agents = [a for a in agents if hasattr(a, 'add_message_listener')]
+    for agent in agents:
+        agent.add_message_listener(event)
+    try:
+        yield event
+    finally:
+        for agent in agents:
+            agent.remove_message_listener(event)
+
+
 class ChatServiceWorldRunner:
     """
     World Runner.
@@ -95,9 +113,13 @@ class ChatServiceWorldRunner:
         world = world_generator(self.opt, agents)
         task.world = world
 
-        while not world.episode_done() and not self.system_done:
-            ret_val = world.parley()
-            time.sleep(0.3)
+        with _wake_on_message(agents) as new_message:
+            while not world.episode_done() and not self.system_done:
+                new_message.clear()
+                ret_val = world.parley()
+                # parley again as soon as a message arrives, and at least every
+                # THREAD_MEDIUM_SLEEP seconds for worlds that check timeouts
+                new_message.wait(utils.THREAD_MEDIUM_SLEEP)
         world.shutdown()
         world_data = world.data if hasattr(world, "data") else {}
         return ret_val, world_data
@@ -165,28 +187,36 @@ class ChatServiceWorldRunner:
                 self._world_module, overworld_name, "generate_world"
             )
             overworld = world_generator(self.opt, [overworld_agent])
-            while not overworld.episode_done() and not self.system_done:
-                world_type = overworld.parley()
-                if world_type is None:
-                    time.sleep(0.5)
-                    continue
-
-                if world_type == self.manager.EXIT_STR:
-                    self.manager._remove_agent(overworld_agent.id)
-                    return world_type
-
-                # perform onboarding
-                onboard_type = onboard_map.get(world_type)
-                if onboard_type:
-                    onboard_id = 'onboard-{}-{}'.format(overworld_agent.id, time.time())
-                    agent = self.manager._create_agent(onboard_id, overworld_agent.id)
-                    agent_state.set_active_agent(agent)
-                    agent_state.assign_agent_to_task(agent, onboard_id)
-                    _, onboard_data = self._run_world(task, onboard_type, [agent])
-                    agent_state.onboard_data = onboard_data
-                    agent_state.data = agent.data
-                self.manager.add_agent_to_pool(agent_state, world_type)
-                log_utils.print_and_log(logging.INFO, 'onboarding/overworld complete')
+            with _wake_on_message([overworld_agent]) as new_message:
+                while not overworld.episode_done() and not self.system_done:
+                    new_message.clear()
+                    world_type = overworld.parley()
+                    if world_type is None:
+                        new_message.wait(0.5)
+                        continue
+
+                    if world_type == self.manager.EXIT_STR:
+                        self.manager._remove_agent(overworld_agent.id)
+                        return world_type
+
+                    # perform onboarding
+                    onboard_type = onboard_map.get(world_type)
+                    if onboard_type:
+                        onboard_id = 'onboard-{}-{}'.format(
+                            overworld_agent.id, time.time()
+                        )
+                        agent = self.manager._create_agent(
+                            onboard_id, overworld_agent.id
+                        )
+                        agent_state.set_active_agent(agent)
+                        agent_state.assign_agent_to_task(agent, onboard_id)
+                        _, onboard_data = self._run_world(task, onboard_type, [agent])
+                        agent_state.onboard_data = onboard_data
+                        agent_state.data = agent.data
+                    self.manager.add_agent_to_pool(agent_state, world_type)
+                    log_utils.print_and_log(
+                        logging.INFO, 'onboarding/overworld complete'
+                    )
 
             return world_type
 
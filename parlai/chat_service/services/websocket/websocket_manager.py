@@ -8,7 +8,6 @@ Websocket Manager Module Contains implementation of the WebsocketManager which h
 ParlAI via websockets.
 """
 import json
-import asyncio
 import logging
 from parlai.core.agents import create_agent
 from parlai.chat_service.core.chat_service_manager import ChatServiceManager
@@ -16,6 +15,8 @@ from parlai.chat_service.core.chat_service_manager import ChatServiceManager
 import parlai.chat_service.utils.logging as log_utils
 import parlai.chat_service.utils.misc as utils
 from parlai.chat_service.services.websocket.sockets import MessageSocketHandler
+from parlai.chat_service.utils.batching import InferenceScheduler
+from parlai.chat_service.utils.worker_pool import InferenceWorkerPool
 from agents import WebsocketAgent
 import tornado
 from tornado.options import options
@@ -44,6 +45,7 @@ class WebsocketManager(ChatServiceManager):
         self.subs = {}
 
         self.app = None
+        self.ioloop = None
         self.debug = opt.get('is_debug', False)
 
         self.message_sender = WebsocketManager.MessageSender()
@@ -73,6 +75,25 @@ class WebsocketManager(ChatServiceManager):
         # print("TEST", self.opt)
         if 'model' in self.opt:
             self.runner_opt['shared_bot_params'] = create_agent(self.runner_opt).share()
+            # optionally answer all task worlds through one batched model copy
+            batchsize = self.runner_opt.get('inference_batchsize', 1)
+            max_wait = self.runner_opt.get('inference_batch_wait', 0.01)
+            processes = self.runner_opt.get('inference_processes', 0)
+            if processes > 0:
+                # or through worker processes sharing the weights, which
+                # batch the sessions they serve
+                self.runner_opt['inference_pool'] = InferenceWorkerPool(
+                    self.runner_opt['shared_bot_params'],
+                    processes,
+                    max_batchsize=batchsize,
+                    max_wait=max_wait,
+                )
+            elif batchsize > 1:
+                self.runner_opt['inference_scheduler'] = InferenceScheduler(
+                    self.runner_opt['shared_bot_params'],
+                    max_batchsize=batchsize,
+                    max_wait=max_wait,
+                )
 
     def _handle_message_read(self, event):
         """
@@ -81,6 +102,15 @@ class WebsocketManager(ChatServiceManager):
         """
         pass
 
+    def add_agent_to_pool(self, agent, world_type='default'):
+        """
+        Add the agent to pool, and launch its world without waiting for the next
+        iteration of the main loop.
+        """
+        super().add_agent_to_pool(agent, world_type)
+        if self.ioloop is not None:
+            self.ioloop.add_callback(self._manager_loop_fn)
+
     def _manager_loop_fn(self):
         """
         An iteration of the manager's main loop to launch worlds.
@@ -158,7 +188,9 @@ class WebsocketManager(ChatServiceManager):
         self.running = True
         self.app = self._make_app()
         self.app.listen(self.port)
-        # Must use a tornado callback to run the main loop
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        # Must use a tornado callback to run the main loop. Worlds are also
+        # launched as soon as agents join a pool; this catches the timeouts.
         callback_time = utils.THREAD_MEDIUM_SLEEP * 1000
         tornado.ioloop.PeriodicCallback(
             callback=self._manager_loop_fn, callback_time=callback_time
@@ -172,6 +204,10 @@ class WebsocketManager(ChatServiceManager):
         try:
             self.world_runner.shutdown()
             self._expire_all_conversations()
+            if self.runner_opt.get('inference_scheduler') is not None:
+                self.runner_opt['inference_scheduler'].shutdown()
+            if self.runner_opt.get('inference_pool') is not None:
+                self.runner_opt['inference_pool'].shutdown()
         finally:
             pass
         tornado.ioloop.IOLoop.current().stop()
@@ -220,7 +256,7 @@ class WebsocketManager(ChatServiceManager):
         :param quick_replies:
             (list) list of strings to send as quick replies.
 
-        Returns a tornado future for tracking the `write_message` action.
+        The message is sent from the event loop as soon as it is free.
         """
         if quick_replies is not None:
             quick_replies = list(quick_replies)
@@ -228,12 +264,7 @@ class WebsocketManager(ChatServiceManager):
         message = json.dumps(
             {'text': message.replace('\n', '<br />'), 'quick_replies': quick_replies}
         )
-
-        asyncio.set_event_loop(asyncio.new_event_loop())
-        if socket_id not in self.subs:
-            self.agent_id_to_overworld_future[socket_id].cancel()
-            return
-        return self.subs[socket_id].write_message(message)
+        self._write_message(socket_id, message)
 
     def observe_payload(self, socket_id, payload, quick_replies=None):
         """
@@ -248,16 +279,30 @@ class WebsocketManager(ChatServiceManager):
                     If 'type' is 'image', the 'mime_type' (str) key can be provided
                     to specify the Mime type of the image
 
-        Returns a tornado future for tracking the `write_message` action.
+        The message is sent from the event loop as soon as it is free.
         """
         message = {'text': '', 'payload': payload, 'quick_replies': quick_replies}
-        payload = json.dumps(message)
+        self._write_message(socket_id, json.dumps(message))
 
-        asyncio.set_event_loop(asyncio.new_event_loop())
+    def _write_message(self, socket_id, message):
+        """
+        Send a message through a socket.
+
+        Sockets may only be written from the thread running the event loop, so
+        messages from world threads are handed over to it.
+        """
         if socket_id not in self.subs:
             self.agent_id_to_overworld_future[socket_id].cancel()
             return
-        return self.subs[socket_id].write_message(message)
+        if self.ioloop is None:
+            self.subs[socket_id].write_message(message)
+        else:
+            self.ioloop.add_callback(self._write_message_on_loop, socket_id, message)
+
+    def _write_message_on_loop(self, socket_id, message):
+        socket = self.subs.get(socket_id)
+        if socket is not None:
+            socket.write_message(message)
 
     def restructure_message(self, message):
         """
@@ -38,11 +38,18 @@ class MessengerBotChatTaskWorld(World):
         self.episodeDone = False
         self.model = bot
         self.first_time = True
+        # shared micro-batching scheduler, if the manager set one up
+        self.scheduler = opt.get('inference_scheduler')
 
     @staticmethod
     def generate_world(opt, agents):
         if opt['model'] is None:
             raise RuntimeError("Model must be specified")
+        if opt.get('inference_pool') is not None:
+            # the session is served by a worker process
+            return MessengerBotChatTaskWorld(
+                opt, agents[0], opt['inference_pool'].create_agent()
+            )
         return MessengerBotChatTaskWorld(
             opt,
             agents[0],
@@ -76,7 +83,10 @@ class MessengerBotChatTaskWorld(World):
                 print(a)
                 print("~~~~~~~~~~~")
                 self.model.observe(a)
-                response = self.model.act()
+                if self.scheduler is not None:
+                    response = self.scheduler.act(self.model)
+                else:
+                    response = self.model.act()
                 print("===response====")
                 print(response)
                 print("~~~~~~~~~~~")
@@ -89,6 +99,7 @@ class MessengerBotChatTaskWorld(World):
 
     def shutdown(self):
         self.agent.shutdown()
+        self.model.shutdown()
 
 
 # ---------- Overworld -------- #
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Cross-session batching of model calls for chat services.
+
+Each task world owns a copy of the bot created with ``create_agent_from_shared``,
+so that every session keeps its own dialogue history. Instead of calling
+``act()`` on that copy, a world can hand it to an :class:`InferenceScheduler`,
+which collects pending observations from all active worlds and answers them
+with a single ``batch_act`` call.
+
+``batch_act`` runs on a separate copy of the bot, so the observations carry the
+raw history strings of their session, which TorchRankerAgent's repeat blocking
+uses instead of the (empty) history of that copy.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from parlai.core.agents import create_agent_from_shared
+import parlai.chat_service.utils.logging as log_utils
+
+DEFAULT_MAX_BATCHSIZE = 16
+DEFAULT_MAX_WAIT = 0.01
+
+
+def observation_with_history(agent):
+    """
+    Return the last observation of a session's copy of the bot, with its history.
+
+    The raw history strings of the copy are set as 'history_raw_strings', so
+    that a ``batch_act`` on another copy blocks the same repeats as the
+    session's own ``act`` would.
+    """
+    observation = agent.observation
+    history = getattr(agent, 'history', None)
+    if history is not None:
+        observation.force_set('history_raw_strings', list(history.history_raw_strings))
+    return observation
+
+
+class InferenceScheduler(object):
+    """
+    Micro-batch model calls coming from many task worlds.
+
+    Worlds call ``observe`` on their own agent copy as usual and then
+    :meth:`act` instead of ``agent.act()``. The scheduler thread waits at most
+    ``max_wait`` seconds after the first pending request (or until
+    ``max_batchsize`` requests are pending), runs one ``batch_act`` over all of
+    them, and routes each reply back to the world that asked for it.
+
+    ``batch_act`` runs on a dedicated copy of the bot; each observation carries
+    the history of its session (see :func:`observation_with_history`), so
+    repeat blocking gives the same replies as calling ``act()`` on the copy.
+
+    :param shared_bot_params:
+        output of ``agent.share()`` for the bot being served
+    :param max_batchsize:
+        maximum number of observations answered by one ``batch_act``
+    :param max_wait:
+        maximum number of seconds to wait for a batch to fill up
+    """
+
+    def __init__(
+        self,
+        shared_bot_params,
+        max_batchsize=DEFAULT_MAX_BATCHSIZE,
+        max_wait=DEFAULT_MAX_WAIT,
+    ):
+        self.agent = create_agent_from_shared(shared_bot_params)
+        self.max_batchsize = max_batchsize
+        self.max_wait = max_wait
+        self.num_batches = 0
+        self.num_examples = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def act(self, agent, timeout=None):
+        """
+        Produce the reply of ``agent`` to the observation it last observed.
+
+        Blocks until the batch containing this request has been processed, then
+        lets the agent observe its own reply, like ``TorchAgent.act`` does.
+
+        :param agent:
+            the world's copy of the bot; ``observe`` must already be called
+        :param timeout:
+            seconds to wait for the reply, or None to wait forever
+        """
+        future = Future()
+        self._queue.put((observation_with_history(agent), future))
+        response = future.result(timeout=timeout)
+        agent.self_observe(response)
+        return response
+
+    def report(self):
+        """
+        Return batching statistics.
+        """
+        return {
+            'batches': self.num_batches,
+            'exs': self.num_examples,
+            'avg_batchsize': self.num_examples / max(1, self.num_batches),
+            'pending': self._queue.qsize(),
+        }
+
+    def shutdown(self):
+        """
+        Stop the scheduler thread.
+        """
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batchsize:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            observations, futures = zip(*batch)
+            try:
+                replies = self.agent.batch_act(list(observations))
+            except Exception as e:
+                log_utils.print_and_log(
+                    logging.ERROR,
+                    'Batched inference failed: {}'.format(repr(e)),
+                    should_print=True,
+                )
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            self.num_batches += 1
+            self.num_examples += len(batch)
+            for future, reply in zip(futures, replies):
+                future.set_result(reply)
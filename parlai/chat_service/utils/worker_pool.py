@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Multi-process serving of a bot for chat services.
+
+An :class:`InferenceWorkerPool` moves the weights and candidate encodings of a
+loaded bot to shared memory, then forks worker processes that each serve their
+own copies of the bot from those tensors. Every task world gets a
+:class:`WorkerAgent` instead of a local copy of the bot; its session is pinned
+to one worker, which keeps the dialogue history of the session.
+
+Workers are forked, so the pool must be created before any CUDA call, and
+changes made to the parent's bot afterwards (e.g. new fixed candidates) are not
+seen by the workers.
+"""
+import itertools
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from parlai.core.agents import Agent, create_agent_from_shared
+from parlai.chat_service.utils.batching import observation_with_history
+import parlai.chat_service.utils.logging as log_utils
+
+# shared fields holding tensors that the workers only read
+SHARED_TENSOR_KEYS = (
+    'fixed_candidate_vecs',
+    'fixed_candidate_encs',
+    'vocab_candidate_vecs',
+    'vocab_candidate_encs',
+)
+
+
+def share_bot_memory(shared_bot_params):
+    """
+    Move the model and candidate tensors of a shared bot to shared memory.
+    """
+    tensors = [shared_bot_params.get(key) for key in SHARED_TENSOR_KEYS]
+    holder = shared_bot_params.get('fixed_candidate_holder')
+    if holder is not None:
+        tensors.extend(holder['state'][1:])
+    model = shared_bot_params.get('model')
+    if model is not None:
+        tensors.extend(model.parameters())
+    tensors = [t for t in tensors if hasattr(t, 'share_memory_')]
+    if any(t.device.type != 'cpu' for t in tensors):
+        raise RuntimeError('Inference workers can only serve CPU models')
+    if model is not None:
+        model.share_memory()
+    for tensor in tensors:
+        tensor.share_memory_()
+
+
+def _reopen_connections(shared_bot_params):
+    """
+    Give the worker its own connections, which cannot be used across a fork.
+    """
+    response_cache = shared_bot_params.get('response_cache')
+    if response_cache is not None:
+        shared_bot_params['response_cache'] = type(response_cache)(response_cache.path)
+
+
+def _next_requests(requests, max_batchsize, max_wait):
+    item = requests.get()
+    if item is None:
+        return None
+    batch = [item]
+    deadline = time.time() + max_wait
+    while len(batch) < max_batchsize:
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            break
+        try:
+            item = requests.get(timeout=remaining)
+        except queue.Empty:
+            break
+        if item is None:
+            # answer this batch, then stop
+            requests.put(None)
+            break
+        batch.append(item)
+    return batch
+
+
+def _serve(shared_bot_params, requests, results, max_batchsize, max_wait):
+    """
+    Main loop of a worker process.
+
+    Requests are ``(request_id, session_id, observation)`` tuples; an observation
+    of None closes the session. Replies to pending observations are computed
+    with one ``batch_act``, like :class:`InferenceScheduler` does, even when a
+    single observation is pending, so that replies do not depend on the load.
+    """
+    # the workers provide the parallelism
+    torch.set_num_threads(1)
+    _reopen_connections(shared_bot_params)
+    batch_agent = create_agent_from_shared(shared_bot_params)
+    sessions = {}
+    while True:
+        batch = _next_requests(requests, max_batchsize, max_wait)
+        if batch is None:
+            return
+        pending = []
+        for request_id, session_id, observation in batch:
+            if observation is None:
+                sessions.pop(session_id, None)
+                continue
+            if session_id not in sessions:
+                sessions[session_id] = create_agent_from_shared(shared_bot_params)
+            agent = sessions[session_id]
+            agent.observe(observation)
+            pending.append((request_id, agent, observation_with_history(agent)))
+        if not pending:
+            continue
+        try:
+            replies = batch_agent.batch_act([obs for _, _, obs in pending])
+            for (_, agent, _), reply in zip(pending, replies):
+                agent.self_observe(reply)
+        except Exception as e:
+            for request_id, _, _ in pending:
+                results.put((request_id, None, repr(e)))
+            continue
+        for (request_id, _, _), reply in zip(pending, replies):
+            results.put((request_id, reply, None))
+
+
+class WorkerAgent(Agent):
+    """
+    Stand-in for a copy of the bot, served by a worker process.
+
+    ``observe`` only stores the observation; ``act`` sends it to the worker that
+    holds the session and waits for the reply.
+    """
+
+    def __init__(self, opt, pool, worker, session_id):
+        # set before Agent.__init__, which would deep copy it
+        self.opt = opt
+        super().__init__(opt)
+        self.pool = pool
+        self.worker = worker
+        self.session_id = session_id
+
+    def act(self, timeout=None):
+        future = self.pool._submit(self.worker, self.session_id, self.observation)
+        return future.result(timeout=timeout)
+
+    def shutdown(self):
+        self.pool._submit(self.worker, self.session_id, None)
+
+
+class InferenceWorkerPool(object):
+    """
+    Serve a bot from several processes that share its weights.
+
+    Workers answer several sessions with one ``batch_act`` when
+    ``max_batchsize`` is above one. As with :class:`InferenceScheduler`, the
+    batch is ranked by a separate copy of the bot, and each observation carries
+    the history of its session, so repeat blocking sees the same history
+    however many requests are pending.
+
+    :param shared_bot_params:
+        output of ``agent.share()`` for the bot being served
+    :param num_workers:
+        number of worker processes
+    :param max_batchsize:
+        maximum number of observations a worker answers with one ``batch_act``
+    :param max_wait:
+        maximum number of seconds a worker waits for a batch to fill up
+    """
+
+    def __init__(self, shared_bot_params, num_workers, max_batchsize=1, max_wait=0):
+        share_bot_memory(shared_bot_params)
+        self.opt = shared_bot_params['opt']
+        self.num_examples = 0
+        self._sessions = [0] * num_workers
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._session_ids = itertools.count()
+
+        context = multiprocessing.get_context('fork')
+        self._results = context.Queue()
+        self._requests = [context.Queue() for _ in range(num_workers)]
+        self._workers = [
+            context.Process(
+                target=_serve,
+                args=(
+                    shared_bot_params,
+                    requests,
+                    self._results,
+                    max_batchsize,
+                    max_wait,
+                ),
+                daemon=True,
+            )
+            for requests in self._requests
+        ]
+        for worker in self._workers:
+            worker.start()
+        self._running = True
+        self._thread = threading.Thread(target=self._collect, daemon=True)
+        self._thread.start()
+
+    def create_agent(self):
+        """
+        Return a WorkerAgent for a new session, on the least busy live worker.
+        """
+        alive = [i for i, w in enumerate(self._workers) if w.is_alive()]
+        if not alive:
+            raise RuntimeError('All inference workers died')
+        with self._lock:
+            worker = min(alive, key=lambda i: self._sessions[i])
+            self._sessions[worker] += 1
+        return WorkerAgent(self.opt, self, worker, next(self._session_ids))
+
+    def report(self):
+        """
+        Return serving statistics.
+        """
+        return {
+            'workers': len(self._workers),
+            'alive': sum(w.is_alive() for w in self._workers),
+            'sessions': list(self._sessions),
+            'exs': self.num_examples,
+            'pending': len(self._pending),
+        }
+
+    def shutdown(self):
+        """
+        Stop the worker processes.
+        """
+        self._running = False
+        for requests in self._requests:
+            requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._thread.join()
+
+    def _submit(self, worker, session_id, observation):
+        future = Future()
+        request_id = next(self._request_ids)
+        with self._lock:
+            if observation is None:
+                self._sessions[worker] -= 1
+                future.set_result(None)
+            elif not self._workers[worker].is_alive():
+                future.set_exception(RuntimeError('Inference worker died'))
+                return future
+            else:
+                self._pending[request_id] = (worker, future)
+        self._requests[worker].put((request_id, session_id, observation))
+        return future
+
+    def _collect(self):
+        while self._running or self._pending:
+            # checked on every iteration, as replies of the other workers may
+            # keep the queue busy while requests of a dead worker wait
+            self._fail_dead_workers()
+            try:
+                request_id, reply, error = self._results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            with self._lock:
+                pending = self._pending.pop(request_id, None)
+            if pending is None:
+                # already failed, its worker died after replying
+                continue
+            future = pending[1]
+            if error is not None:
+                future.set_exception(RuntimeError('Inference worker: ' + error))
+            else:
+                self.num_examples += 1
+                future.set_result(reply)
+
+    def _fail_dead_workers(self):
+        dead = {i for i, w in enumerate(self._workers) if not w.is_alive()}
+        if not dead:
+            return
+        with self._lock:
+            failed = [r for r, (w, _) in self._pending.items() if w in dead]
+            futures = [self._pending.pop(r)[1] for r in failed]
+        if futures and self._running:
+            log_utils.print_and_log(
+                logging.ERROR,
+                '{} inference workers died'.format(len(dead)),
+                should_print=True,
+            )
+        for future in futures:
+            future.set_exception(RuntimeError('Inference worker died'))
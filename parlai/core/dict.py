@@ -13,8 +13,12 @@ from .agents import Agent
 from .build_data import make_dir
 from collections import defaultdict
 from .gpt2_helper import Gpt2BpeHelper
+from parlai.utils.dialog_cache import cached_tokens
 import codecs
 import copy
+import functools
+import itertools
+import multiprocessing
 import numpy as np
 import os
 import json
@@ -30,6 +34,9 @@ except ImportError:
 
 RETOK = re.compile(r'\w+|[^\w\s]|\n', re.UNICODE)
 
+# dictionary used by the worker processes of txt2vec_batch, inherited on fork
+_WORKER_DICT = None
+
 
 def escape(s):
     r"""
@@ -114,6 +121,7 @@ class DictionaryAgent(Agent):
     default_tok = 're'
     default_lower = False
     default_textfields = 'text,labels'
+    default_bpe_cache_size = 100000
 
     @staticmethod
     def add_cmdline_args(argparser):
@@ -210,6 +218,14 @@ class DictionaryAgent(Agent):
             hidden=True,
             help='Leave BPE tokens untouched in output. Useful for debugging.',
         )
+        dictionary.add_argument(
+            '--dict-bpe-cache-size',
+            type=int,
+            default=DictionaryAgent.default_bpe_cache_size,
+            hidden=True,
+            help='Number of words whose BPE segmentation is kept in an LRU cache. '
+            '0 disables the cache.',
+        )
         dictionary.add_argument(
             '--dict-textfields',
             default=DictionaryAgent.default_textfields,
@@ -320,7 +336,12 @@ class DictionaryAgent(Agent):
         elif self.tokenizer == 'bpe':
             if not opt.get('dict_file'):
                 raise RuntimeError('--dict-file is mandatory.')
-            self.bpehelper = _BPEHelper(f"{opt['dict_file']}.codecs")
+            self.bpehelper = _BPEHelper(
+                f"{opt['dict_file']}.codecs",
+                cache_size=opt.get(
+                    'dict_bpe_cache_size', DictionaryAgent.default_bpe_cache_size
+                ),
+            )
         elif self.tokenizer == 'gpt2':
             if self.lower:
                 raise ValueError(
@@ -361,6 +382,7 @@ class DictionaryAgent(Agent):
         Add a single token to the dictionary.
         """
         if word not in self.tok2ind:
+            self._token_caches = ()
             index = len(self.tok2ind)
             self.tok2ind[word] = index
             self.ind2tok[index] = word
@@ -593,6 +615,7 @@ class DictionaryAgent(Agent):
             del self.freq[token]
             idx = self.tok2ind.pop(token)
             del self.ind2tok[idx]
+        self._token_caches = ()
 
     def _remove_non_bpe(self):
         """
@@ -610,6 +633,7 @@ class DictionaryAgent(Agent):
             del self.freq[token]
             idx = self.tok2ind.pop(token)
             del self.ind2tok[idx]
+        self._token_caches = ()
         for token, freq in to_add:
             self.add_token(token)
             self.freq[token] += freq
@@ -624,6 +648,7 @@ class DictionaryAgent(Agent):
                 del self.ind2tok[k]
                 del self.tok2ind[v]
                 del self.freq[v]
+            self._token_caches = ()
 
     def load(self, filename):
         """
@@ -716,6 +741,7 @@ class DictionaryAgent(Agent):
             new_ind2tok[i] = tok
         self.tok2ind = new_tok2ind
         self.ind2tok = new_ind2tok
+        self._token_caches = ()
         if trim:
             self.resize_to_max(self.maxtokens)
         assert len(self.freq) == len(self.ind2tok) == len(self.tok2ind)
@@ -745,8 +771,13 @@ class DictionaryAgent(Agent):
         :param type vec_type:
             The type of the returned vector if the input is a string. Suggested
             ``list``, ``tuple``, ``set``, or ``np.ndarray``.
+
+        Strings of datasets loaded with ``--dialog-cache-dir`` are not tokenized
+        again, their token ids are read from the cache.
         """
-        itr = (self._word_lookup(token) for token in self.tokenize(str(text)))
+        itr = cached_tokens(self, text)
+        if itr is None:
+            itr = (self._word_lookup(token) for token in self.tokenize(str(text)))
         if vec_type == list or vec_type == tuple or vec_type == set:
             res = vec_type(itr)
         elif vec_type == np.ndarray:
@@ -755,6 +786,65 @@ class DictionaryAgent(Agent):
             raise RuntimeError('Type {} not supported by dict'.format(vec_type))
         return res
 
+    def txt2vec_batch(self, texts, vec_type=list, num_workers=0):
+        """
+        Convert a list of strings to vectors.
+
+        Gives the same result as calling ``txt2vec`` on every string, but the
+        token ids of the whole batch are looked up at once into a numpy array,
+        which is split back into one vector per string.
+
+        :param texts:
+            the strings to vectorize
+        :param type vec_type:
+            the type of the returned vectors: ``list``, ``tuple``, ``set`` or
+            ``np.ndarray``.
+        :param num_workers:
+            if > 1, tokenize in this many forked processes. Only worth it for
+            bulk jobs of many thousands of strings.
+        """
+        if vec_type not in (list, tuple, set, np.ndarray):
+            raise RuntimeError('Type {} not supported by dict'.format(vec_type))
+        if (
+            type(self).txt2vec is not DictionaryAgent.txt2vec
+            or type(self)._word_lookup is not DictionaryAgent._word_lookup
+            or self._unk_token_idx is None
+        ):
+            # subclasses with their own vectorization, or no unknown token
+            return [self.txt2vec(text, vec_type) for text in texts]
+
+        texts = [str(text) for text in texts]
+        if num_workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            global _WORKER_DICT
+            chunksize = (len(texts) + num_workers - 1) // num_workers
+            chunks = [texts[i : i + chunksize] for i in range(0, len(texts), chunksize)]
+            _WORKER_DICT = self
+            try:
+                with multiprocessing.get_context('fork').Pool(num_workers) as pool:
+                    results = pool.map(_txt2ids_worker, chunks)
+            finally:
+                _WORKER_DICT = None
+            ids = np.concatenate([r[0] for r in results])
+            lengths = np.concatenate([r[1] for r in results])
+        else:
+            ids, lengths = self._txt2ids(texts)
+
+        vecs = np.split(ids, np.cumsum(lengths)[:-1]) if len(texts) else []
+        if vec_type == np.ndarray:
+            return vecs
+        return [vec_type(vec.tolist()) for vec in vecs]
+
+    def _txt2ids(self, texts):
+        """
+        Return the concatenated token ids of texts, and the number per text.
+        """
+        token_lists = [self.tokenize(text) for text in texts]
+        lengths = np.fromiter(map(len, token_lists), np.int64, len(token_lists))
+        tokens = itertools.chain.from_iterable(token_lists)
+        # dict.get runs in C, so no python code is executed per token
+        ids = map(self.tok2ind.get, tokens, itertools.repeat(self._unk_token_idx))
+        return np.fromiter(ids, np.int64, int(lengths.sum())), lengths
+
     def vec2txt(self, vector, delimiter=' '):
         """
         Convert a vector of IDs to a string.
@@ -831,7 +921,9 @@ class _BPEHelper(object):
     in a second pass, calling tokenize() again to get processed output.
     """
 
-    def __init__(self, codecs_filename):
+    cache_size = 0
+
+    def __init__(self, codecs_filename, cache_size=0):
         """
         Initialize the BPE module.
 
@@ -840,6 +932,8 @@ class _BPEHelper(object):
 
         :param codecs_filename:
             place to save/load codecs.
+        :param cache_size:
+            number of words whose segmentation is kept in an LRU cache.
         """
         if not BPE_INSTALLED:
             raise RuntimeError(
@@ -850,12 +944,35 @@ class _BPEHelper(object):
         self.splitter = re.compile(r'\w+|[^\w\s]', re.UNICODE)
 
         self.codecs = codecs_filename
+        self.cache_size = cache_size
         if os.path.exists(self.codecs):
             self._load_from_codecs()
 
     def _load_from_codecs(self):
         with open(self.codecs, 'r', encoding='utf-8') as codecs_file:
             self.bpe = apply_bpe.BPE(codecs_file)
+        self._init_cache()
+
+    def _init_cache(self):
+        if self.cache_size > 0:
+            # words are segmented independently of each other
+            self._segment_word = functools.lru_cache(maxsize=self.cache_size)(
+                self._segment_word
+            )
+
+    def _segment_word(self, word):
+        return tuple(self.bpe.segment_tokens([word]))
+
+    def __getstate__(self):
+        # the cache wraps a bound method, which cannot be pickled
+        state = self.__dict__.copy()
+        state.pop('_segment_word', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if hasattr(self, 'bpe'):
+            self._init_cache()
 
     def tokenize(self, text):
         """
@@ -870,7 +987,9 @@ class _BPEHelper(object):
         tokens = self.splitter.findall(text)
 
         if hasattr(self, 'bpe'):
-            return self.bpe.segment_tokens(tokens)
+            if self.cache_size <= 0:
+                return self.bpe.segment_tokens(tokens)
+            return [piece for word in tokens for piece in self._segment_word(word)]
         else:
             return tokens
 
@@ -922,3 +1041,7 @@ class _BPEHelper(object):
             with open(self.codecs, encoding='utf-8') as rfile:
                 for line in rfile:
                     wfile.write(line)
+
+
+def _txt2ids_worker(texts):
+    return _WORKER_DICT._txt2ids(texts)
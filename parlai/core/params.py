@@ -657,6 +657,15 @@ class ParlaiParser(argparse.ArgumentParser):
             help='default (False) moves labels in valid and test sets to the '
             'eval_labels field. If True, they are hidden completely.',
         )
+        parlai.add_argument(
+            '--dialog-cache-dir',
+            default=None,
+            type=str,
+            help='if set, dialog teachers cache their parsed and tokenized data in '
+            'this directory, so later runs skip parsing and tokenization. '
+            'Streamed data is indexed instead, so that readers can seek to any '
+            'episode.',
+        )
         parlai.add_argument(
             '-mtw',
             '--multitask-weights',
@@ -681,6 +690,43 @@ class ParlaiParser(argparse.ArgumentParser):
             choices={None, 'full', 'batchsort'},
             help='Use dynamic batching',
         )
+        parlai.add_argument(
+            '--bucket-batches',
+            default=0,
+            type=int,
+            help='if > 0 and batchsize > 1, teachers sort episodes by the length of '
+            'their text and labels within shuffled chunks of this many batches, '
+            'so that each batch needs less padding. Batches are still shuffled '
+            'when training.',
+        )
+        parlai.add_argument(
+            '--num-workers',
+            default=0,
+            type=int,
+            help='if > 0 and batchsize > 1, this many background processes read, '
+            'vectorize and batchify examples ahead of the model. Supports a '
+            'single task whose examples have labels',
+        )
+        parlai.add_argument(
+            '--prefetch-batches',
+            default=8,
+            type=int,
+            help='with --num-workers, number of ready batches the workers may '
+            'queue up',
+        )
+        parlai.add_argument(
+            '--chunk-loaders',
+            default=1,
+            type=int,
+            help='number of chunks that chunked teachers load at the same time',
+        )
+        parlai.add_argument(
+            '--chunk-loader-processes',
+            default=False,
+            type='bool',
+            help='load the chunks of chunked teachers in forked processes instead '
+            'of threads',
+        )
         self.add_parlai_data_path(parlai)
 
     def add_distributed_training_args(self):
@@ -2219,17 +2219,22 @@ from parlai.core.agents import Agent, create_agent_from_shared
 from parlai.core.image_featurizers import ImageLoader
 from parlai.core.loader import load_teacher_module
 from parlai.core.message import Message
-from parlai.core.metrics import TeacherMetrics, aggregate_named_reports
+from parlai.core.metrics import AverageMetric, TeacherMetrics, aggregate_named_reports
 from parlai.core.opt import Opt
 from parlai.utils.misc import AttrDict, no_lock, str_to_msg, warn_once
+from parlai.utils.candidate_registry import CandidateSet, get_candidates
 from parlai.utils.distributed import get_rank, num_workers, is_distributed
+from parlai.utils.candidate_store import hash_strings
+from parlai.utils.dialog_cache import DialogCache, StreamIndex, file_stamp, hash_file
+from parlai.utils.dialog_store import DialogStore
 
 from abc import ABC, abstractmethod
 
+import collections
 import concurrent.futures
 import multiprocessing
 from multiprocessing import Value, Lock
-from threading import Thread
+from threading import Condition, Thread
 import queue
 import random
 import sys
@@ -2441,8 +2446,10 @@ class FixedDialogTeacher(Teacher):
                 self.threadindex = shared['threadindex']
             if 'examples' in shared:
                 self.examples = shared['examples']
+            self.buckets = shared.get('buckets', {})
         else:
             self.index = AttrDict(value=-1)
+            self.buckets = {}
 
         if not hasattr(self, 'data_loader'):
             self.data_loader = DataLoader(opt)
@@ -2450,6 +2457,7 @@ class FixedDialogTeacher(Teacher):
 
         # set up batching
         self.bsz = opt.get('batchsize', 1)
+        self.bucket_batches = opt.get('bucket_batches', 0) if self.bsz > 1 else 0
 
     def _lock(self):
         if hasattr(self.index, 'get_lock'):
@@ -2471,6 +2479,7 @@ class FixedDialogTeacher(Teacher):
         self.episode_idx = -1
         with self._lock():
             self.index.value = -1
+            self.buckets['order'] = None
 
     def submit_load_request(self):
         """
@@ -2506,12 +2515,13 @@ class FixedDialogTeacher(Teacher):
         if hasattr(self, 'data_loader'):
             shared['data_loader'] = self.data_loader
 
-        if self.opt.get('numthreads', 1) > 1:
-            if type(self.index) is not multiprocessing.sharedctypes.Synchronized:
+        if self.opt.get('numthreads', 1) > 1 or self.opt.get('num_workers', 0) > 0:
+            if not hasattr(self.index, 'get_lock'):
                 # for multithreading need to move index into threadsafe memory
                 self.index = Value('l', -1)
 
         shared['index'] = self.index
+        shared['buckets'] = self.buckets
 
         return shared
 
@@ -2528,6 +2538,8 @@ class FixedDialogTeacher(Teacher):
             num_eps = self.num_episodes()
         if loop is None:
             loop = self.training
+        if self.bucket_batches > 0:
+            return self._next_bucketed_idx(num_eps, loop)
         if self.random:
             new_idx = random.randrange(num_eps)
         else:
@@ -2538,6 +2550,66 @@ class FixedDialogTeacher(Teacher):
                 new_idx = self.index.value
         return new_idx
 
+    def episode_length(self, episode_idx):
+        """
+        Return the length used to group episodes with ``--bucket-batches``.
+
+        The default implementation returns the largest number of characters in
+        the text and first label of any example of the episode.
+        """
+        length = 0
+        entry_idx = 0
+        episode_done = False
+        while not episode_done:
+            ex = self.get(episode_idx, entry_idx)
+            labels = ex.get('labels', ex.get('eval_labels')) or ['']
+            length = max(length, len(ex.get('text') or '') + len(labels[0]))
+            episode_done = ex.get('episode_done', True)
+            entry_idx += 1
+        return length
+
+    def _bucketed_order(self, num_eps):
+        """
+        Return the episode indices, sorted by length within shuffled chunks.
+
+        Every ``batchsize`` consecutive indices form a batch. When training,
+        batches are shuffled and the last one is filled up with random episodes,
+        so that batches stay aligned when the order is repeated.
+        """
+        if self.buckets.get('lengths') is None:
+            self.buckets['lengths'] = [self.episode_length(i) for i in range(num_eps)]
+        lengths = self.buckets['lengths']
+        order = list(range(num_eps))
+        if self.random:
+            random.shuffle(order)
+        chunksize = self.bsz * self.bucket_batches
+        batches = []
+        for start in range(0, num_eps, chunksize):
+            chunk = sorted(order[start : start + chunksize], key=lengths.__getitem__)
+            batches.extend(
+                chunk[i : i + self.bsz] for i in range(0, len(chunk), self.bsz)
+            )
+        if self.random:
+            random.shuffle(batches)
+            last = min(range(len(batches)), key=lambda i: len(batches[i]))
+            batches.append(batches.pop(last))
+            while len(batches[-1]) < self.bsz:
+                batches[-1].append(random.randrange(num_eps))
+        return [i for batch in batches for i in batch]
+
+    def _next_bucketed_idx(self, num_eps, loop):
+        with self._lock():
+            order = self.buckets.get('order')
+            if order is None:
+                order = self.buckets['order'] = self._bucketed_order(num_eps)
+            self.index.value += 1
+            if loop and self.index.value >= len(order):
+                self.index.value = 0
+                if self.random:
+                    order = self.buckets['order'] = self._bucketed_order(num_eps)
+            self.episode_pos = self.index.value
+        return order[self.episode_pos] if self.episode_pos < len(order) else num_eps
+
     def next_example(self):
         """
         Return the next example.
@@ -2558,10 +2630,12 @@ class FixedDialogTeacher(Teacher):
         ex = self.get(self.episode_idx, self.entry_idx)
         self.episode_done = ex.get('episode_done', False)
 
+        # with --bucket-batches, episodes are not visited in order
+        position = self.episode_pos if self.bucket_batches > 0 else self.episode_idx
         if (
             not self.random
             and self.episode_done
-            and self.episode_idx + self.opt.get("batchsize", 1) >= self.num_episodes()
+            and position + self.opt.get("batchsize", 1) >= self.num_episodes()
         ):
             epoch_done = True
         else:
@@ -2706,6 +2780,8 @@ class DialogTeacher(FixedDialogTeacher):
         if shared and shared.get('data'):
             self.data = data_class(opt, shared=shared['data'], **kwargs)
         else:
+            if opt.get('dialog_cache_dir'):
+                kwargs['cache'] = self._dialog_cache(opt['dialog_cache_dir'])
             self.data = data_class(
                 opt,
                 data_loader=self.setup_data,
@@ -2715,6 +2791,35 @@ class DialogTeacher(FixedDialogTeacher):
 
         self.reset()
 
+    def dialog_cache_signature(self):
+        """
+        Return a list of strings identifying the output of ``setup_data()``.
+
+        Used to key the cache enabled by ``--dialog-cache-dir``. The default
+        implementation assumes the data only depends on the teacher class and
+        the contents of ``opt['datafile']``; override it if other options
+        change what ``setup_data()`` yields, or return None to never cache.
+        Streamed datafiles can be too large to hash on every run, so they are
+        identified by their path, size and modification time instead.
+        """
+        datafile = self.opt.get('datafile')
+        if not isinstance(datafile, str) or not os.path.isfile(datafile):
+            return None
+        if self.stream:
+            fingerprint = 'stream:{}:{}:{}'.format(*file_stamp(datafile))
+        else:
+            fingerprint = hash_file(datafile)
+        return [type(self).__module__, type(self).__qualname__, fingerprint]
+
+    def _dialog_cache(self, cache_dir):
+        signature = self.dialog_cache_signature()
+        if signature is None:
+            return None
+        key = hash_strings(*signature)
+        name = '{}.{}'.format(os.path.basename(self.opt['datafile']), key[:16])
+        cache_class = StreamIndex if self.stream else DialogCache
+        return cache_class(os.path.join(cache_dir, name), key)
+
     def reset(self):
         """
         Reset the dialog to the start of the epoch, reset all metrics.
@@ -2773,6 +2878,19 @@ class DialogTeacher(FixedDialogTeacher):
         """
         return self.data.get(episode_idx, entry_idx)[0]
 
+    def episode_length(self, episode_idx):
+        """
+        Return the length used to group episodes with ``--bucket-batches``.
+
+        Reads the stored entries directly, without building the examples.
+        """
+        length = 0
+        for entry in self.data.data[episode_idx]:
+            text = entry[0] or ''
+            labels = entry[1] if len(entry) > 1 and entry[1] else ('',)
+            length = max(length, len(text) + len(labels[0]))
+        return length
+
     def next_example(self):
         """
         Get the next example.
@@ -2804,11 +2922,15 @@ class DialogData(object):
     :param cands:
         can be set to provide a list of candidate labels for every example in
         this dataset, which the agent can choose from (the correct answer
-        should be in this set).
+        should be in this set). Given as a ``CandidateSet`` it is used as is,
+        and shared with whoever else uses it.
 
     :param random:
         tells the data class whether or not to visit episodes sequentially or
         randomly when returning examples to the caller.
+    :param cache:
+        a ``DialogCache`` to read the episodes from instead of the data loader,
+        or to write them to after reading them.
 
     The contents of the ``((x, y, r, c, i), new_episode?)`` tuples returned by
     the data loader is the following:
@@ -2824,7 +2946,9 @@ class DialogData(object):
       to ``True`` every time.
     """
 
-    def __init__(self, opt, data_loader=None, cands=None, shared=None, **kwargs):
+    def __init__(
+        self, opt, data_loader=None, cands=None, shared=None, cache=None, **kwargs
+    ):
         # in case we need to shard the dataset
         self.rank = get_rank()
         self.num_workers = num_workers()
@@ -2832,8 +2956,7 @@ class DialogData(object):
             x in opt['datatype'] for x in ('valid', 'test', 'train:evalmode')
         )
 
-        # self.data is a list of episodes
-        # each episode is a tuple of entries
+        # self.data is a DialogStore of episodes, read as sequences of entries
         # each entry is a tuple of values for the action/observation table
         if shared:
             self.image_loader = shared.get('image_loader', None)
@@ -2842,11 +2965,13 @@ class DialogData(object):
         else:
             self.image_loader = ImageLoader(opt)
             self.data = []
+            self.cache = cache
+            self.opt = opt
             self._load(data_loader, opt['datafile'])
-            self.cands = None if cands is None else set(sys.intern(c) for c in cands)
-
-        self.addedCands = []
-        self.copied_cands = False
+            if cands is None or isinstance(cands, CandidateSet):
+                self.cands = cands
+            else:
+                self.cands = CandidateSet(cands)
 
     def share(self):
         """
@@ -2940,9 +3065,17 @@ class DialogData(object):
             class docstring.
         :param str datafile:
         """
-        for i, episode in enumerate(self._read_episode(data_loader(datafile))):
+        episodes = self._read_episode(data_loader(datafile))
+        if self.cache is not None:
+            episodes = self.cache.load_or_build(episodes, self.opt)
+        if isinstance(episodes, DialogStore) and not self.is_distributed_and_is_eval:
+            self.data = episodes
+            return
+        self.data = DialogStore()
+        for i, episode in enumerate(episodes):
             if not self.is_distributed_and_is_eval or i % self.num_workers == self.rank:
                 self.data.append(episode)
+        self.data.freeze()
 
     def num_episodes(self):
         """
@@ -2958,7 +3091,7 @@ class DialogData(object):
         """
         if hasattr(self, '_num_examples_cache'):
             return self._num_examples_cache
-        self._num_examples_cache = sum(len(episode) for episode in self.data)
+        self._num_examples_cache = self.data.num_examples()
         return self._num_examples_cache
 
     def get(self, episode_idx, entry_idx=0):
@@ -3012,19 +3145,11 @@ class DialogData(object):
                 table['image'] = img
 
         if table.get('labels', None) is not None and self.cands is not None:
-            if self.addedCands:
-                # remove elements in addedCands
-                self.cands.difference_update(self.addedCands)
-                self.addedCands.clear()
-            for label in table['labels']:
-                if label not in self.cands:
-                    # add labels, queue them for removal next time
-                    if not self.copied_cands:
-                        self.cands = self.cands.copy()
-                        self.copied_cands = True
-                    self.cands.add(label)
-                    self.addedCands.append(label)
-            table['label_candidates'] = self.cands
+            # the shared candidates, plus the labels that are not among them
+            if all(label in self.cands for label in table['labels']):
+                table['label_candidates'] = self.cands
+            else:
+                table['label_candidates'] = self.cands.extended(table['labels'])
 
         # print(table['labels'][0])
         # print(table['label_candidates'])
@@ -3061,6 +3186,13 @@ class StreamDialogData(DialogData):
     :param cycle:
         (default True) whether to restart at beginning when end of stream
         reached without reset being called.
+    :param cache:
+        a ``StreamIndex`` to read the episodes from, which is written from the
+        data loader the first time. Episodes are then read by seeking to them:
+        copies of the data take the next episode from a shared position, so
+        each episode of an epoch is read by one of them, workers of a
+        distributed evaluation only read their own episodes, and cycling
+        streams are read in a new random order every epoch.
     """
 
     # represents that we haven't read in any data at all
@@ -3081,13 +3213,19 @@ class StreamDialogData(DialogData):
             self.data_loader = shared['data_loader']
             if 'lock' in shared:
                 self.lock = shared['lock']
+            self.opt = opt
+            self.cache = shared['cache']
+            self.position = shared['position']
+            self.seed = shared['seed']
         else:
             # main instance holds the stream and shares pointer to it
             self.data_loader = data_loader
             self.datafile = opt['datafile']
             self.reset_data = None
             self.is_reset = True
-            if opt.get('numthreads', 1) > 1:
+            self.position = AttrDict(value=0)
+            self.seed = random.randrange(2 ** 31)
+            if opt.get('numthreads', 1) > 1 and self.cache is None:
                 print(
                     'WARNING: multithreaded streaming will process every '
                     'example numthreads times.'
@@ -3097,6 +3235,8 @@ class StreamDialogData(DialogData):
         self.cur_episode = self._FIRST_PASS
         self.num_eps = None
         self.num_exs = None
+        self._order = None
+        self._order_epoch = None
 
         self.rank = get_rank()
         self.num_workers = num_workers()
@@ -3116,6 +3256,13 @@ class StreamDialogData(DialogData):
         shared['data_loader'] = self.data_loader
         if hasattr(self, 'lock'):
             shared['lock'] = self.lock
+        shared['cache'] = self.cache
+        if self.opt.get('numthreads', 1) > 1 or self.opt.get('num_workers', 0) > 0:
+            if not hasattr(self.position, 'get_lock'):
+                # use a multiprocessing value so forked readers share it too
+                self.position = Value('l', self.position.value)
+        shared['position'] = self.position
+        shared['seed'] = self.seed
 
         return shared
 
@@ -3123,7 +3270,43 @@ class StreamDialogData(DialogData):
         """
         Load data generator into data field.
         """
-        self.data = self._data_generator(data_loader, datafile)
+        if self.cache is not None:
+            episodes = self._read_episode(data_loader(datafile))
+            if not self.cache.load_or_build(episodes):
+                self.cache = None
+        if self.cache is not None:
+            self.data = self._indexed_generator()
+        else:
+            self.data = self._data_generator(data_loader, datafile)
+
+    def _position_lock(self):
+        if hasattr(self.position, 'get_lock'):
+            return self.position.get_lock()
+        else:
+            return no_lock()
+
+    def _indexed_generator(self):
+        """
+        Generate episodes by seeking to them in the stream index.
+        """
+        num_eps = self.cache.num_episodes
+        start, step = 0, 1
+        if self.is_distributed_and_is_eval:
+            start, step = self.rank, self.num_workers
+        while True:
+            with self._position_lock():
+                position = self.position.value
+                self.position.value += 1
+            epoch, idx = divmod(start + position * step, max(num_eps, 1))
+            if num_eps == 0 or (epoch > 0 and not self.cycle):
+                yield self._END_OF_EPOCH
+                continue
+            if self.cycle:
+                if self._order_epoch != epoch:
+                    self._order = self.cache.shuffled([self.seed, self.rank, epoch])
+                    self._order_epoch = epoch
+                idx = self._order[idx]
+            yield self.cache.episode(idx)
 
     def _data_generator(self, data_loader, datafile):
         """
@@ -3150,6 +3333,8 @@ class StreamDialogData(DialogData):
         Note that this can take some time for large datasets. Episode and entry indexes
         cannot be specified during streaming.
         """
+        if self.cache is not None:
+            return self.cache.num_episodes, self.cache.num_examples
         datafiles = self.datafile if type(self.datafile) is tuple else [self.datafile]
         length_file = datafiles[0] + ".lengths"
         if not os.path.isfile(length_file):
@@ -3216,7 +3401,12 @@ class StreamDialogData(DialogData):
         """
         Reset the datastream to its beginning.
         """
-        if self.reset_data is not None:
+        if self.cache is not None:
+            # every copy resets the shared position, at the start of an epoch
+            with self._position_lock():
+                self.position.value = 0
+            self.data = self._indexed_generator()
+        elif self.reset_data is not None:
             # auxiliary instance, reset main datastream
             self.data = self.reset_data()
         elif not self.is_reset:
@@ -3317,38 +3507,19 @@ class FbDialogTeacher(DialogTeacher):
 
         The candidates will be provided by the teacher for every example (the true
         labels for a specific example are also added to this set, so that it's possible
-        to get the right answer).
+        to get the right answer). Each file is only read once per process, see
+        ``parlai.utils.candidate_registry.get_candidates``.
         """
-        if path is None:
-            return None
-        cands = []
-        lines_have_ids = False
-        cands_are_replies = False
-        cnt = 0
-        with open(path) as read:
-            for line in read:
-                line = line.strip().replace('\\n', '\n')
-                if len(line) > 0:
-                    cnt = cnt + 1
-                    # If lines are numbered we strip them of numbers.
-                    if cnt == 1 and line[0:2] == '1 ':
-                        lines_have_ids = True
-                    # If tabs then the label_candidates are all the replies.
-                    if '\t' in line and not cands_are_replies:
-                        cands_are_replies = True
-                        cands = []
-                    if lines_have_ids:
-                        space_idx = line.find(' ')
-                        line = line[space_idx + 1 :]
-                        if cands_are_replies:
-                            sp = line.split('\t')
-                            if len(sp) > 1 and sp[1] != '':
-                                cands.append(sp[1])
-                        else:
-                            cands.append(line)
-                    else:
-                        cands.append(line)
-        return cands
+        return get_candidates(path)
+
+    def dialog_cache_signature(self):
+        """
+        Add the cloze option to the cache key, it changes the parsed text.
+        """
+        signature = super().dialog_cache_signature()
+        if signature is not None:
+            signature.append(str(self.cloze))
+        return signature
 
     def setup_data(self, path):
         r"""
@@ -4137,12 +4308,109 @@ class MultiTaskTeacher(Teacher):
             t.update_counters()
 
 
+# chunk teachers that load their chunks in forked processes, see ChunkTeacher
+_CHUNK_TEACHERS = {}
+
+
+def _load_chunk_in_process(key, chunk_idx):
+    return _CHUNK_TEACHERS[key].load_chunk(chunk_idx)
+
+
+class ChunkBuffer(object):
+    """
+    The loaded chunks of a ``ChunkTeacher``, shared by all its copies.
+
+    Chunks are added as whole lists and samples are read from them in order,
+    so handing a chunk over does not copy it. Loaders block in ``put`` while
+    ``maxsize`` samples are waiting. Each ``reset`` starts a new generation;
+    chunks loaded for an older generation are dropped.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.generation = 0
+        self._blocks = collections.deque()
+        self._pos = 0
+        self._size = 0
+        self._error = None
+        self._cond = Condition()
+
+    def __len__(self):
+        return self._size
+
+    def put(self, block, generation):
+        """
+        Add a loaded chunk, waiting for room in the buffer.
+
+        :return: False if the buffer was reset since the chunk was requested.
+        """
+        with self._cond:
+            while self._size >= self.maxsize and generation == self.generation:
+                self._cond.wait()
+            if generation != self.generation:
+                return False
+            self._blocks.append(block)
+            self._size += len(block)
+            self._cond.notify_all()
+            return True
+
+    def fail(self, error, generation):
+        """
+        Make readers raise an error, e.g. when a chunk could not be loaded.
+        """
+        with self._cond:
+            if generation == self.generation:
+                self._error = error
+                self._cond.notify_all()
+
+    def get(self):
+        """
+        Return the next sample, and the seconds spent waiting for it.
+        """
+        with self._cond:
+            started = None
+            while not self._blocks:
+                if self._error is not None:
+                    raise RuntimeError('Failed to load a chunk') from self._error
+                if started is None:
+                    started = time.time()
+                self._cond.wait()
+            block = self._blocks[0]
+            sample = block[self._pos]
+            self._pos += 1
+            self._size -= 1
+            if self._pos == len(block):
+                self._blocks.popleft()
+                self._pos = 0
+            if self._size + 1 >= self.maxsize:
+                # a loader may be waiting for room
+                self._cond.notify_all()
+        return sample, 0 if started is None else time.time() - started
+
+    def reset(self):
+        """
+        Drop all chunks and start a new generation.
+        """
+        with self._cond:
+            self.generation += 1
+            self._blocks.clear()
+            self._pos = 0
+            self._size = 0
+            self._error = None
+            self._cond.notify_all()
+
+
 class ChunkTeacher(FixedDialogTeacher, ABC):
     """
     Useful for loading large amounts of data.
 
-    Data is separated into chunks and loaded one chunk at a time. Loads the data off of
-    the main thread.
+    Data is separated into chunks, which are loaded off of the main thread.
+    ``--chunk-loaders`` chunks are loaded at the same time, in threads or, with
+    ``--chunk-loader-processes``, in forked processes, for ``load_from_chunk``
+    implementations that hold the GIL. Loaded chunks wait in a buffer of
+    ``get_buffersize()`` samples. The teacher reports how full the buffer was
+    when a sample was read (``chunk_buffer``) and how long reading a sample
+    waited for a chunk to load (``chunk_stall_ms``).
     """
 
     def __init__(self, opt, shared=None):
@@ -4172,16 +4440,23 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
             self.rng = shared['rng']
         else:
             self.is_root_teacher = True
-            self.samples = queue.Queue(maxsize=self.buffersize)
+            self.samples = ChunkBuffer(self.buffersize)
             self.chunks = queue.Queue()
+            self._chunks_lock = Lock()
             if self.is_train:
                 # TODO: possible need a fixed seed here in the future
                 self.rng = random.Random()
             else:
                 self.rng = random.Random(42)
+            self._pool = None
+            if opt.get('chunk_loader_processes'):
+                # forked loaders find the teacher here, as it cannot be pickled
+                _CHUNK_TEACHERS[id(self)] = self
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    self.num_loaders(), mp_context=multiprocessing.get_context('fork')
+                )
             self._enqueue_chunks()
-            # launch queue loader on the main thread
-            self._enqueue_request()
+            self._start_loaders()
 
         self.episode_done = True
 
@@ -4221,6 +4496,12 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
         """
         return 100000
 
+    def num_loaders(self):
+        """
+        Return the number of chunks loaded at the same time.
+        """
+        return max(1, self.opt.get('chunk_loaders', 1))
+
     def set_datasettings(self, datatype):
         self.folder = self._get_data_folder()
         self.num_exs, self.num_eps = self.get_num_samples(datatype)
@@ -4247,28 +4528,37 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
     def num_examples(self):
         return self.num_exs
 
-    def _enqueue_request(self):
+    def _start_loaders(self):
         """
-        Queue a request for loading to the data loader.
+        Start the threads loading the chunks of the current epoch.
         """
-        self.data_loader.request_load(self.receive_data, self.get_chunk, ())
+        generation = self.samples.generation
+        for _ in range(self.num_loaders()):
+            Thread(target=self._load_chunks, args=(generation,), daemon=True).start()
 
-    def receive_data(self, future):
+    def _load_chunks(self, generation):
         """
-        Loads data.
+        Main loop of a loader thread.
 
-        Load data into self.samples until buffersize is reached.
+        Loads chunks into ``self.samples`` until the chunks of the epoch run
+        out or the buffer is reset.
         """
-        data = future.result()
-        if data is None:
-            return
-        while data:
-            # self.samples is a queue with maxsize
-            # self.buffersize, so will block if the
-            # buffer gets full
-            self.samples.put(data.pop(0))
-        # and start loading the next chunk
-        self._enqueue_request()
+        try:
+            while generation == self.samples.generation:
+                chunk_idx = self._next_chunk_idx()
+                if chunk_idx is None:
+                    return
+                if self._pool is not None:
+                    output = self._pool.submit(
+                        _load_chunk_in_process, id(self), chunk_idx
+                    ).result()
+                else:
+                    output = self.load_chunk(chunk_idx)
+                if output and not self.samples.put(output, generation):
+                    return
+        except Exception as e:
+            self.samples.fail(e, generation)
+            raise
 
     def _enqueue_chunks(self):
         """
@@ -4296,20 +4586,24 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
         """
         pass
 
-    def get_chunk(self):
+    def _next_chunk_idx(self):
         """
-        Refill the buffer.
+        Return the next chunk to load, or None at the end of valid/test data.
         """
-        if self.chunks.empty():
-            if self.is_train:
-                self._enqueue_chunks()
-            else:
-                # if we're in valid/test, we need to actually signal the end
-                return None
+        with self._chunks_lock:
+            if self.chunks.empty():
+                if self.is_train:
+                    self._enqueue_chunks()
+                else:
+                    return None
+            return self.chunks.get()
 
-        next_chunk = self.chunks.get()
+    def load_chunk(self, chunk_idx):
+        """
+        Load the samples of a chunk, in random order.
+        """
         # abstract method `load_from_chunk` returns a list of tuples
-        output = self.load_from_chunk(next_chunk)
+        output = self.load_from_chunk(chunk_idx)
 
         if self.is_train:
             # randomize the samples
@@ -4319,7 +4613,11 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
         return output
 
     def get(self, episode_idx, entry_idx=0):
-        queue_output = self.samples.get()
+        queue_output, stall = self.samples.get()
+        self.metrics.add(
+            'chunk_buffer', AverageMetric(len(self.samples), self.samples.maxsize)
+        )
+        self.metrics.add('chunk_stall_ms', AverageMetric(1000 * stall))
         if queue_output is None:
             return None
 
@@ -4336,12 +4634,21 @@ class ChunkTeacher(FixedDialogTeacher, ABC):
     def reset(self):
         super().reset()
         if self.is_root_teacher:
-            # drain the queues and refill the chunk queue with a new epoch.
-            # additionally, we have to relaunch the loader
-            self._drain(self.samples)
-            self._drain(self.chunks)
-            self._enqueue_chunks()
-            self._enqueue_request()
+            # drop the loaded chunks and refill the chunk queue with a new
+            # epoch. loaders of the old epoch stop, so launch new ones
+            self.samples.reset()
+            with self._chunks_lock:
+                self._drain(self.chunks)
+                self._enqueue_chunks()
+            self._start_loaders()
+
+    def shutdown(self):
+        super().shutdown()
+        if self.is_root_teacher:
+            self.samples.reset()
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                _CHUNK_TEACHERS.pop(id(self), None)
 
 
 def _add_task_flags_to_agent_opt(agent, opt: Opt, flags):
@@ -1981,7 +1981,7 @@ from parlai.core.dict import DictionaryAgent
 from parlai.nn.lr_scheduler import ParlAILRScheduler
 from parlai.core.message import Message
 from parlai.utils.distributed import is_distributed
-from parlai.utils.misc import AttrDict, warn_once
+from parlai.utils.misc import AttrDict, StageTimer, Timer, warn_once
 from parlai.utils.fp16 import (
     fp16_apex_available,
     fp16_optimizer_wrapper,
@@ -1992,6 +1992,7 @@ from parlai.utils.fp16 import (
 from parlai.core.metrics import (
     Metrics,
     Metric,
+    AverageMetric,
     GlobalAverageMetric,
     GlobalSumMetric,
     GlobalFixedMetric,
@@ -2000,6 +2001,15 @@ from parlai.utils.distributed import is_primary_worker
 from parlai.utils.torch import argsort, compute_grad_norm, padded_tensor
 
 
+def _cat_vecs(vecs):
+    """
+    Concatenate a list of vectors, which may be empty.
+    """
+    if not vecs:
+        return torch.zeros(0, dtype=torch.long)
+    return torch.cat(vecs)
+
+
 class Batch(AttrDict):
     """
     Batch is a namedtuple containing data being sent to an agent.
@@ -2111,6 +2121,9 @@ class History(object):
     :param maxlen:
         if `vec_type` is 'deque', this sets the maximum length of that object
 
+    :param size:
+        number of utterances to keep, or -1 to keep all of them
+
     :param p1_token:
         token indicating 'person 1'; opt must have 'person_tokens' set to True
         for this to be added
@@ -2153,6 +2166,7 @@ class History(object):
         self.history_strings = []
         self.history_raw_strings = []
         self.history_vecs = []
+        self._reset_token_buffer()
 
         # person token args
         self.add_person_tokens = opt.get('person_tokens', False)
@@ -2173,6 +2187,56 @@ class History(object):
         self.history_raw_strings = []
         self.history_strings = []
         self.history_vecs = []
+        self._reset_token_buffer()
+
+    def _reset_token_buffer(self):
+        # the token ids of the history, with delimiters, are kept in
+        # self._tokens[self._begin:self._end], so that they never need to be
+        # concatenated again. the buffer is compacted when it is full.
+        self._tokens = torch.empty(64, dtype=torch.long)
+        self._begin = 0
+        self._end = 0
+        # position in the buffer of the first token of each utterance
+        self._starts = deque()
+
+    def _append_tokens(self, vec):
+        num = len(vec)
+        if self._end + num > len(self._tokens):
+            # move the live tokens to the front, growing the buffer so that at
+            # least half of it is free afterwards
+            live = self._tokens[self._begin : self._end].clone()
+            capacity = len(self._tokens)
+            while capacity < 2 * (len(live) + num):
+                capacity *= 2
+            if capacity > len(self._tokens):
+                self._tokens = self._tokens.new_empty(capacity)
+            self._tokens[: len(live)] = live
+            offset = self._begin
+            self._starts = deque(start - offset for start in self._starts)
+            self._begin, self._end = 0, len(live)
+        self._tokens[self._end : self._end + num] = torch.as_tensor(
+            vec, dtype=torch.long
+        )
+        self._end += num
+
+    def _update_token_buffer(self, vec, evicted):
+        """
+        Add an utterance to the token buffer, after dropping evicted ones.
+        """
+        for _ in range(evicted):
+            self._starts.popleft()
+        if not self._starts:
+            self._begin = self._end = 0
+        else:
+            if evicted:
+                # drop the evicted utterances and the delimiter after them
+                self._begin = max(self._begin, self._starts[0])
+            self._append_tokens(self.delimiter_tok)
+        self._starts.append(self._end)
+        self._append_tokens(vec)
+        if self.vec_type == 'deque' and self.max_len is not None:
+            # older tokens can never be part of the history vec again
+            self._begin = max(self._begin, self._end - self.max_len)
 
     def _update_strings(self, text):
         if self.size > 0:
@@ -2187,10 +2251,14 @@ class History(object):
         self.history_raw_strings.append(text)
 
     def _update_vecs(self, text):
+        evicted = 0
         if self.size > 0:
             while len(self.history_vecs) >= self.size:
                 self.history_vecs.pop(0)
-        self.history_vecs.append(self.parse(text))
+                evicted += 1
+        vec = self.parse(text)
+        self.history_vecs.append(vec)
+        self._update_token_buffer(vec, evicted)
 
     def add_reply(self, text):
         """
@@ -2239,23 +2307,34 @@ class History(object):
         if len(self.history_vecs) == 0:
             return None
 
+        history = self._tokens[self._begin : self._end].tolist()
+        if self._global_end_token is not None:
+            history.append(self._global_end_token)
         if self.vec_type == 'deque':
-            history = deque(maxlen=self.max_len)
-            for vec in self.history_vecs[:-1]:
-                history.extend(vec)
-                history.extend(self.delimiter_tok)
-            history.extend(self.history_vecs[-1])
-            if self._global_end_token is not None:
-                history.extend([self._global_end_token])
+            return deque(history, maxlen=self.max_len)
+        return history
+
+    def get_history_tensor(self):
+        """
+        Return the vectorized history as a LongTensor.
+
+        Same tokens as ``get_history_vec``, but copied straight from the token
+        buffer.
+        """
+        if type(self).get_history_vec is not History.get_history_vec:
+            # keep the behavior of subclasses that build their own vec
+            vec = self.get_history_vec()
+            return None if vec is None else torch.LongTensor(list(vec))
+        if len(self.history_vecs) == 0:
+            return None
+
+        history = self._tokens[self._begin : self._end]
+        if self._global_end_token is not None:
+            history = torch.cat([history, history.new_tensor([self._global_end_token])])
         else:
-            # vec type is a list
-            history = []
-            for vec in self.history_vecs[:-1]:
-                history += vec
-                history += self.delimiter_tok
-            history += self.history_vecs[-1]
-            if self._global_end_token is not None:
-                history += [self._global_end_token]
+            history = history.clone()
+        if self.vec_type == 'deque' and self.max_len is not None:
+            history = history[-self.max_len :]
         return history
 
     def get_history_vec_list(self):
@@ -2571,6 +2650,27 @@ class TorchAgent(ABC, Agent):
             choices=[None, 'end'],
             help='Add special token to the end of history encoding.',
         )
+        agent.add_argument(
+            '--profile-stages',
+            type='bool',
+            default=False,
+            help='Time the stages of observe and batch_act (vectorize, batchify, '
+            'encoding, scoring, ...) and report them as <stage>_ms metrics',
+        )
+        agent.add_argument(
+            '--profile-trace',
+            type=str,
+            default=None,
+            help='With --profile-stages, write the most recent stages to this file '
+            'as a Chrome trace (chrome://tracing) on shutdown',
+        )
+        agent.add_argument(
+            '--profile-trace-events',
+            type=int,
+            default=100000,
+            hidden=True,
+            help='Number of most recent stages kept for --profile-trace',
+        )
         # GPU arguments
         # these gpu options are all mutually exclusive, and should error if the
         # user tries to present multiple of them
@@ -2694,6 +2794,16 @@ class TorchAgent(ABC, Agent):
 
         self.is_training = False  # track whether model is training
         self.rank_candidates = opt['rank_candidates']
+        if shared is None:
+            trace = opt.get('profile_trace')
+            self.stage_timer = StageTimer(
+                opt.get('profile_stages', False),
+                sync_cuda=self.use_cuda,
+                max_events=opt.get('profile_trace_events', 100000) if trace else 0,
+            )
+        else:
+            # copies record their observe stages in the same timer
+            self.stage_timer = shared['stage_timer']
         self.add_person_tokens = opt.get('person_tokens', False)
         # set interactive mode or not according to options.
         self.set_interactive_mode(opt.get('interactive_mode', False), shared)
@@ -3148,6 +3258,7 @@ class TorchAgent(ABC, Agent):
         shared['model'] = self.model
         shared['criterion'] = self.criterion
         shared['opt'] = self.opt
+        shared['stage_timer'] = self.stage_timer
         return shared
 
     def _add_start_end_tokens(self, vec, add_start=False, add_end=False):
@@ -3243,12 +3354,14 @@ class TorchAgent(ABC, Agent):
                 return obs
             obs['full_text'] = history_string
             if history_string:
-                obs['text_vec'] = history.get_history_vec()
+                obs['text_vec'] = history.get_history_tensor()
 
         # check truncation
         if obs.get('text_vec') is not None:
             truncated_vec = self._check_truncate(obs['text_vec'], truncate, True)
-            obs.force_set('text_vec', torch.LongTensor(truncated_vec))
+            if not torch.is_tensor(truncated_vec):
+                truncated_vec = torch.LongTensor(truncated_vec)
+            obs.force_set('text_vec', truncated_vec)
         return obs
 
     def _set_label_vec(self, obs, add_start, add_end, truncate):
@@ -3479,6 +3592,70 @@ class TorchAgent(ABC, Agent):
             observations=exs,
         )
 
+    def pack_batch(self, batch, batchsize):
+        """
+        Return a compact copy of a batch, to send it to another process.
+
+        Vectors of varying length (candidates and the texts of the observations)
+        are concatenated into one tensor per field, so that a batch crosses
+        processes as a few tensors. Other tensors in the observations are left
+        out, since the batch already holds them padded.
+
+        :param batch:
+            a batch returned by ``batchify``, on the CPU
+        :param batchsize:
+            number of observations the batch was made from
+        """
+        packed = Batch(**batch)
+        packed.batchsize = batchsize
+        if batch.candidate_vecs is not None:
+            cand_vecs = [vecs or [] for vecs in batch.candidate_vecs]
+            packed.candidate_vecs = (
+                _cat_vecs([v for vecs in cand_vecs for v in vecs]),
+                [[len(v) for v in vecs] for vecs in cand_vecs],
+                [vecs is None for vecs in batch.candidate_vecs],
+            )
+        if batch.observations is not None:
+            text_vecs = [obs.get('text_vec') for obs in batch.observations]
+            packed.observations = [
+                Message(
+                    {
+                        k: v
+                        for k, v in obs.items()
+                        if not torch.is_tensor(v)
+                        and not k.endswith('_vecs')
+                        and k != 'label_candidates_rows'
+                    }
+                )
+                for obs in batch.observations
+            ]
+            if all(torch.is_tensor(v) for v in text_vecs):
+                packed.text_vecs = (_cat_vecs(text_vecs), [len(v) for v in text_vecs])
+        return packed
+
+    def unpack_batch(self, packed):
+        """
+        Return the batch packed by ``pack_batch``, on this agent's device.
+        """
+        batch = Batch(**packed)
+        if packed.candidate_vecs is not None:
+            flat, lengths, missing = packed.candidate_vecs
+            vecs = iter(flat.split([n for row in lengths for n in row]))
+            batch.candidate_vecs = [
+                None if miss else [next(vecs) for _ in row]
+                for row, miss in zip(lengths, missing)
+            ]
+        text_vecs = batch.pop('text_vecs', None)
+        if text_vecs is not None:
+            for obs, vec in zip(batch.observations, text_vecs[0].split(text_vecs[1])):
+                obs['text_vec'] = vec
+        if self.use_cuda:
+            # the same tensors that batchify puts on the GPU
+            for key in ('text_vec', 'label_vec'):
+                if batch[key] is not None:
+                    batch[key] = batch[key].pin_memory().cuda(non_blocking=True)
+        return batch
+
     def match_batch(self, batch_reply, valid_inds, output=None):
         """
         Match sub-batch of predictions to the original batch indices.
@@ -3541,14 +3718,15 @@ class TorchAgent(ABC, Agent):
             self.__expecting_to_reply = True
 
         self.observation = observation
-        # update the history using the observation
-        self.history.update_history(observation)
-        return self.vectorize(
-            observation,
-            self.history,
-            text_truncate=self.text_truncate,
-            label_truncate=self.label_truncate,
-        )
+        with self.stage_timer.stage('vectorize'):
+            # update the history using the observation
+            self.history.update_history(observation)
+            return self.vectorize(
+                observation,
+                self.history,
+                text_truncate=self.text_truncate,
+                label_truncate=self.label_truncate,
+            )
 
     def self_observe(self, self_message: Message) -> None:
         """
@@ -3781,6 +3959,15 @@ class TorchAgent(ABC, Agent):
         self.history.reset()
         self.reset_metrics()
 
+    def shutdown(self):
+        """
+        Write the stage trace if requested.
+        """
+        path = self.opt.get('profile_trace')
+        if path and self.stage_timer.events:
+            self.stage_timer.save_trace(path)
+        super().shutdown()
+
     def reset_metrics(self):
         """
         Reset all TorchAgentMetrics.
@@ -3808,20 +3995,36 @@ class TorchAgent(ABC, Agent):
         default behaviors are fine then just override the ``train_step`` and
         ``eval_step`` methods instead. The former is called when labels are
         present in the observations batch; otherwise, the latter is called.
+
+        Instead of observations, this also accepts a batch returned by
+        ``unpack_batch``, which was batchified by a background worker.
         """
         # clear local metrics before anything else
         self._local_metrics.clear()
+        timer = Timer()
+
+        if isinstance(observations, Batch):
+            # batchified ahead of time
+            batch = observations
+            observations = batch.observations or []
+            batchsize = batch.batchsize
+        else:
+            batch = None
+            batchsize = len(observations)
 
         # initialize a list of replies with this agent's id
         batch_reply = [
-            Message({'id': self.getID(), 'episode_done': False}) for _ in observations
+            Message({'id': self.getID(), 'episode_done': False})
+            for _ in range(batchsize)
         ]
 
         # check if there are any labels available, if so we will train on them
         self.is_training = any('labels' in obs for obs in observations)
 
-        # create a batch from the vectors
-        batch = self.batchify(observations)
+        if batch is None:
+            # create a batch from the vectors
+            with self.stage_timer.stage('batchify'):
+                batch = self.batchify(observations)
 
         if (
             'label_vec' in batch
@@ -3838,17 +4041,45 @@ class TorchAgent(ABC, Agent):
             )
             self.global_metrics.add('tpb', tpb)
 
+        # fraction of padding in the batch, e.g. to compare --bucket-batches
+        num_tokens = 0
+        for key in ('text_vec', 'label_vec'):
+            vec = batch.get(key)
+            if vec is not None and vec.numel() > 0:
+                real_tokens = (vec != self.NULL_IDX).sum().item()
+                num_tokens += real_tokens
+                self.global_metrics.add(
+                    key[: -len('_vec')] + '_pad',
+                    GlobalAverageMetric(vec.numel() - real_tokens, vec.numel()),
+                )
+
         if self.is_training:
-            output = self.train_step(batch)
+            with self.stage_timer.stage('train_step'):
+                output = self.train_step(batch)
         else:
-            with torch.no_grad():
+            with torch.no_grad(), self.stage_timer.stage('eval_step'):
                 # save memory and compute by disabling autograd.
                 # use `with torch.enable_grad()` to gain back gradients.
                 output = self.eval_step(batch)
 
         if output is not None:
             # local metrics are automatically matched up
-            self.match_batch(batch_reply, batch.valid_indices, output)
+            with self.stage_timer.stage('postprocess'):
+                self.match_batch(batch_reply, batch.valid_indices, output)
+
+        # time spent in each stage, including the observe calls since the last
+        # batch, attributed to every example of the batch
+        num_valid = len(batch.valid_indices or ())
+        for stage, elapsed in self.stage_timer.pop().items():
+            self.record_local_metric(
+                stage + '_ms', AverageMetric.many([1000 * elapsed] * num_valid)
+            )
+
+        if num_tokens > 0:
+            # non-padding text and label tokens per second of batch_act
+            self.global_metrics.add(
+                'tps', GlobalAverageMetric(num_tokens, timer.time())
+            )
 
         # broadcast the metrics back
         for k, values in self._local_metrics.items():
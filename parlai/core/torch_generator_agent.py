@@ -591,8 +591,9 @@ class TorchGeneratorAgent(TorchAgent, ABC):
 
         try:
             loss = self.compute_loss(batch)
-            self.backward(loss)
-            self.update_params()
+            with self.stage_timer.stage('backward'):
+                self.backward(loss)
+                self.update_params()
         except RuntimeError as e:
             # catch out of memory exceptions during fwd/bck (skip batch)
             if 'out of memory' in str(e):
@@ -719,7 +720,8 @@ class TorchGeneratorAgent(TorchAgent, ABC):
             )
         else:
             maxlen = self.label_truncate or 256
-            beam_preds_scores, _ = self._generate(batch, self.beam_size, maxlen)
+            with self.stage_timer.stage('search'):
+                beam_preds_scores, _ = self._generate(batch, self.beam_size, maxlen)
             preds, scores = zip(*beam_preds_scores)
 
         cand_choices = None
@@ -990,11 +990,11 @@ See the TorchRankerAgent tutorial for examples.
 
 from typing import Dict, Any
 from abc import abstractmethod
-from itertools import islice
 import os
 from tqdm import tqdm
 import random
 
+import numpy as np
 import torch
 
 
@@ -1002,14 +1002,24 @@ from parlai.core.opt import Opt
 from parlai.utils.distributed import is_distributed
 from parlai.core.torch_agent import TorchAgent, Output
 from parlai.utils.misc import warn_once
+from parlai.utils.candidate_registry import CandidateSet
 from parlai.utils.torch import (
+    InternedVectors,
     padded_3d,
     total_parameters,
     trainable_parameters,
     PipelineHelper,
 )
 from parlai.utils.fp16 import FP16SafeCrossEntropy
-from parlai.core.metrics import AverageMetric
+from parlai.core.metrics import AverageMetric, GlobalSumMetric
+from parlai.utils.response_cache import ResponseCache
+from parlai.utils.candidate_store import (
+    CandidateStore,
+    hash_state_dict,
+    hash_strings,
+    hash_text,
+    load_or_build,
+)
 
 
 class TorchRankerAgent(TorchAgent):
@@ -1024,6 +1034,9 @@ class TorchRankerAgent(TorchAgent):
     - Caching representations for fast runtime when deploying models to production.
     """
 
+    # dimension of fixed_candidate_encs that indexes the candidates
+    fixed_candidate_encs_dim = 0
+
     @classmethod
     def add_cmdline_args(cls, argparser):
         """
@@ -1073,7 +1086,9 @@ class TorchRankerAgent(TorchAgent):
             'The default path is a /path/to/model-file.<cands_name>, where '
             '<cands_name> is the name of the file (not the full path) passed by '
             'the flag --fixed-candidates-path. By default, this file is created '
-            'once and reused. To replace it, use the "replace" option.',
+            'once and reused; only candidates whose text changed are recomputed, '
+            'and encodings are recomputed when the model weights change. '
+            'To replace it, use the "replace" option.',
         )
         agent.add_argument(
             '--encode-candidate-vecs',
@@ -1091,6 +1106,15 @@ class TorchRankerAgent(TorchAgent):
             hidden=True,
             help='Batchsize when encoding candidate vecs',
         )
+        agent.add_argument(
+            '--response-cache-path',
+            type=str,
+            default=None,
+            help='SQLite file caching the ranked replies to contexts without '
+            'dialogue history, when evaluating against fixed candidates. Entries '
+            'are ignored once the model weights, the candidates or the ranking '
+            'options change.',
+        )
         agent.add_argument(
             '--init-model',
             type=str,
@@ -1124,6 +1148,29 @@ class TorchRankerAgent(TorchAgent):
             help='Ranking returns the top k results of k > 0, otherwise sorts every '
             'single candidate according to the ranking.',
         )
+        agent.add_argument(
+            '--score-chunksize',
+            type=int,
+            default=-1,
+            help='When ranking fixed or vocab candidates without labels, score '
+            'this many candidates at a time and only keep a running top k '
+            '(--rank-top-k, or --cap-num-predictions if it is not set), so that '
+            'memory does not grow with the number of candidates. -1 scores all '
+            'candidates at once. Ignored with --return-cand-scores and no '
+            '--rank-top-k, which return the scores of all candidates.',
+        )
+        agent.add_argument(
+            '--intern-candidate-vecs',
+            type='bool',
+            default=False,
+            help='Vectorize each distinct inline candidate only once, and build '
+            'the candidate tensors of inline and batch-all-cands batches from the '
+            'stored vectors. Speeds up datasets where examples share candidates, '
+            'but keeps the vectors of every distinct candidate in memory. The '
+            'candidates of a candidate file (cands_datafile) are always '
+            'vectorized this way, but without this flag the labels that an '
+            'example adds to them are vectorized for that example only.',
+        )
         agent.add_argument(
             '--inference',
             choices={'max', 'topk'},
@@ -1186,11 +1233,25 @@ class TorchRankerAgent(TorchAgent):
                 self.criterion.cuda()
 
         self.rank_top_k = opt.get('rank_top_k', -1)
+        # InternedVectors of inline candidates, per vectorization settings
+        self.interned_cands = shared.get('interned_cands', {}) if shared else {}
+        # (training updates, hash) of the model weights, see _weights_signature
+        self._weights_signature_state = (
+            shared.get('weights_signature', (None, None)) if shared else (None, None)
+        )
 
         # Vectorize and save fixed/vocab candidates once upfront if applicable
         self.set_fixed_candidates(shared)
         self.set_vocab_candidates(shared)
 
+        if shared:
+            self.response_cache = shared.get('response_cache')
+        elif opt.get('response_cache_path'):
+            self.response_cache = ResponseCache(opt['response_cache_path'])
+        else:
+            self.response_cache = None
+        self._response_cache_signature = (None, None, None, None)
+
         if shared:
             # We don't use get here because hasattr is used on optimizer later.
             if 'optimizer' in shared:
@@ -1272,6 +1333,54 @@ class TorchRankerAgent(TorchAgent):
         """
         pass
 
+    def score_candidates_chunked(self, batch, cand_vecs, cand_encs, k, chunksize):
+        """
+        Return the top k (scores, ranks) of a shared candidate set, in chunks.
+
+        By default this calls score_candidates() on every chunk of candidates.
+        Subclasses may override it to encode the context only once.
+
+        :param LongTensor cand_vecs:
+            [num_cands, seq_len] candidates shared by the whole batch
+        :param cand_encs:
+            their cached encodings, or None
+        :param int k:
+            number of candidates to return per example
+        :param int chunksize:
+            number of candidates scored at once
+        """
+
+        def score_chunk(start, end):
+            encs = None
+            if cand_encs is not None:
+                encs = cand_encs.narrow(
+                    self.fixed_candidate_encs_dim, start, end - start
+                )
+            return self.score_candidates(batch, cand_vecs[start:end], cand_encs=encs)
+
+        return self._chunked_topk(score_chunk, cand_vecs.size(0), k, chunksize)
+
+    def _chunked_topk(self, score_chunk, num_cands, k, chunksize):
+        """
+        Keep a running top k over the scores of consecutive candidate chunks.
+
+        :param score_chunk:
+            function mapping (start, end) to the [bsz, end - start] scores of
+            candidates start to end
+        """
+        best_scores = best_ranks = None
+        for start in range(0, num_cands, chunksize):
+            end = min(start + chunksize, num_cands)
+            scores = score_chunk(start, end)
+            ranks = torch.arange(start, end, device=scores.device)
+            ranks = ranks.unsqueeze(0).expand_as(scores)
+            if best_scores is not None:
+                scores = torch.cat([best_scores, scores], 1)
+                ranks = torch.cat([best_ranks, ranks], 1)
+            best_scores, idx = scores.topk(min(k, scores.size(1)), 1)
+            best_ranks = ranks.gather(1, idx)
+        return best_scores, best_ranks
+
     def _maybe_invalidate_fixed_encs_cache(self):
         if self.candidates != 'fixed':
             self.fixed_candidate_encs = None
@@ -1296,27 +1405,63 @@ class TorchRankerAgent(TorchAgent):
         self.record_local_metric('rank', AverageMetric.many(ranks))
         self.record_local_metric('mrr', AverageMetric.many(mrr))
 
+    def _get_rank_metrics(self, scores, label_inds):
+        """
+        Record the rank and mean reciprocal rank of the labels.
+
+        The rank of a label is one plus the number of candidates scored higher,
+        computed in one pass over the scores rather than from the sorted order,
+        so candidates tied with the label do not count. With --rank-top-k, a
+        label outside the top k gets the rank after the last candidate, as if
+        it had not been ranked at all.
+        """
+        label_scores = scores.gather(1, label_inds.view(-1, 1))
+        ranks = (scores > label_scores).float().sum(dim=1) + 1
+        if self.rank_top_k > 0:
+            ranks[ranks > self.rank_top_k] = scores.size(1) + 1
+        self.record_local_metric('rank', AverageMetric.many(ranks))
+        self.record_local_metric('mrr', AverageMetric.many(1.0 / ranks))
+
+    def _rank_candidates(self, scores, cands, cand_vecs):
+        """
+        Return the sorted scores and indices of the candidates worth returning.
+
+        Only sorts the whole score matrix if all scores are returned; otherwise
+        keeps the first ``--rank-top-k`` or ``--cap-num-predictions``
+        candidates, plus enough to skip over padding candidates.
+        """
+        num_cands = scores.size(1)
+        if self.rank_top_k > 0:
+            k = self.rank_top_k
+        elif self.opt.get('return_cand_scores', False):
+            k = num_cands
+        else:
+            k = self.opt['cap_num_predictions'] + self._num_pad_candidates(
+                cands, cand_vecs
+            )
+        if k >= num_cands:
+            return scores.sort(1, descending=True)
+        return scores.topk(k, 1, largest=True)
+
+    def _num_pad_candidates(self, cands, cand_vecs):
+        """
+        Return the most candidates that were added to any example as padding.
+        """
+        if cand_vecs.dim() == 3:
+            return cand_vecs.size(1) - min(len(c) for c in cands)
+        return max(0, cand_vecs.size(0) - len(cands))
+
     def _get_train_preds(self, scores, label_inds, cands, cand_vecs):
         """
         Return predictions from training.
         """
-        # TODO: speed these calculations up
-        batchsize = scores.size(0)
         if self.rank_top_k > 0:
             _, ranks = scores.topk(
                 min(self.rank_top_k, scores.size(1)), 1, largest=True
             )
         else:
             _, ranks = scores.sort(1, descending=True)
-        ranks_m = []
-        mrrs_m = []
-        for b in range(batchsize):
-            rank = (ranks[b] == label_inds[b]).nonzero()
-            rank = rank.item() if len(rank) == 1 else scores.size(1)
-            ranks_m.append(1 + rank)
-            mrrs_m.append(1.0 / (1 + rank))
-        self.record_local_metric('rank', AverageMetric.many(ranks_m))
-        self.record_local_metric('mrr', AverageMetric.many(mrrs_m))
+        self._get_rank_metrics(scores, label_inds)
 
         ranks = ranks.cpu()
         # Here we get the top prediction for each example, but do not
@@ -1371,22 +1516,26 @@ class TorchRankerAgent(TorchAgent):
         """
         Train on a single batch of examples.
         """
+        self._sync_fixed_candidates()
         self._maybe_invalidate_fixed_encs_cache()
         if batch.text_vec is None and batch.image is None:
             return
         self.model.train()
         self.zero_grad()
 
-        cands, cand_vecs, label_inds = self._build_candidates(
-            batch, source=self.candidates, mode='train'
-        )
+        with self.stage_timer.stage('encode_cands'):
+            cands, cand_vecs, label_inds = self._build_candidates(
+                batch, source=self.candidates, mode='train'
+            )
         try:
-            scores = self.score_candidates(batch, cand_vecs)
-            loss = self.criterion(scores, label_inds)
+            with self.stage_timer.stage('score'):
+                scores = self.score_candidates(batch, cand_vecs)
+                loss = self.criterion(scores, label_inds)
             self.record_local_metric('mean_loss', AverageMetric.many(loss))
             loss = loss.mean()
-            self.backward(loss)
-            self.update_params()
+            with self.stage_timer.stage('backward'):
+                self.backward(loss)
+                self.update_params()
         except RuntimeError as e:
             # catch out of memory exceptions during fwd/bck (skip batch)
             if 'out of memory' in str(e):
@@ -1415,8 +1564,14 @@ class TorchRankerAgent(TorchAgent):
         """
         Evaluate a single batch of examples.
         """
+        self._sync_fixed_candidates()
         if batch.text_vec is None and batch.image is None:
             return
+        cache_keys = self._response_cache_keys(batch)
+        if cache_keys is not None:
+            output = self._get_cached_responses(cache_keys)
+            if output is not None:
+                return output
         batchsize = (
             batch.text_vec.size(0)
             if batch.text_vec is not None
@@ -1424,30 +1579,40 @@ class TorchRankerAgent(TorchAgent):
         )
         self.model.eval()
 
-        cands, cand_vecs, label_inds = self._build_candidates(
-            batch, source=self.eval_candidates, mode='eval'
-        )
+        with self.stage_timer.stage('encode_cands'):
+            cands, cand_vecs, label_inds = self._build_candidates(
+                batch, source=self.eval_candidates, mode='eval'
+            )
 
         cand_encs = None
         if self.encode_candidate_vecs and self.eval_candidates in ['fixed', 'vocab']:
             # if we cached candidate encodings for a fixed list of candidates,
             # pass those into the score_candidates function
             if self.fixed_candidate_encs is None:
-                self.fixed_candidate_encs = self._make_candidate_encs(
-                    cand_vecs
-                ).detach()
+                with self.stage_timer.stage('encode_cands'):
+                    self.fixed_candidate_encs = self._make_candidate_encs(
+                        cand_vecs
+                    ).detach()
             if self.eval_candidates == 'fixed':
                 cand_encs = self.fixed_candidate_encs
             elif self.eval_candidates == 'vocab':
                 cand_encs = self.vocab_candidate_encs
 
-        scores = self.score_candidates(batch, cand_vecs, cand_encs=cand_encs)
-        if self.rank_top_k > 0:
-            sorted_scores, ranks = scores.topk(
-                min(self.rank_top_k, scores.size(1)), 1, largest=True
-            )
-        else:
-            sorted_scores, ranks = scores.sort(1, descending=True)
+        chunksize = self.opt.get('score_chunksize', -1)
+        # returning the scores of all candidates needs them all at once anyway
+        all_scores = self.rank_top_k <= 0 and self.opt.get('return_cand_scores')
+        can_chunk = label_inds is None and cand_vecs.dim() == 2 and not all_scores
+        with self.stage_timer.stage('score'):
+            if can_chunk and 0 < chunksize < len(cands):
+                k = self.rank_top_k
+                if k <= 0:
+                    k = self.opt['cap_num_predictions']
+                sorted_scores, ranks = self.score_candidates_chunked(
+                    batch, cand_vecs, cand_encs, min(k, len(cands)), chunksize
+                )
+            else:
+                scores = self.score_candidates(batch, cand_vecs, cand_encs=cand_encs)
+                sorted_scores, ranks = self._rank_candidates(scores, cands, cand_vecs)
 
         if self.opt.get('return_cand_scores', False):
             sorted_scores = sorted_scores.cpu()
@@ -1458,64 +1623,198 @@ class TorchRankerAgent(TorchAgent):
         if label_inds is not None:
             loss = self.criterion(scores, label_inds)
             self.record_local_metric('loss', AverageMetric.many(loss))
-            ranks_m = []
-            mrrs_m = []
-            for b in range(batchsize):
-                rank = (ranks[b] == label_inds[b]).nonzero()
-                rank = rank.item() if len(rank) == 1 else scores.size(1)
-                ranks_m.append(1 + rank)
-                mrrs_m.append(1.0 / (1 + rank))
-            self.record_local_metric('rank', AverageMetric.many(ranks_m))
-            self.record_local_metric('mrr', AverageMetric.many(mrrs_m))
+            self._get_rank_metrics(scores, label_inds)
 
-        ranks = ranks.cpu()
+        with self.stage_timer.stage('postprocess'):
+            cand_preds = self._get_cand_preds(ranks, cands, cand_vecs, batch)
+
+        if self.opt.get('inference', 'max') == 'max':
+            preds = [cand_preds[i][0] for i in range(batchsize)]
+        else:
+            # Top-k inference.
+            preds = []
+            for i in range(batchsize):
+                preds.append(random.choice(cand_preds[i][0 : self.opt['topk']]))
+
+        output = Output(preds, cand_preds, sorted_scores=sorted_scores)
+        if cache_keys is not None:
+            self._cache_responses(cache_keys, output)
+        return output
+
+    def _get_cand_preds(self, ranks, cands, cand_vecs, batch=None):
+        """
+        Return the strings of the top ranked candidates of each example.
+        """
+        # only look up the strings of the candidates that can be returned
         max_preds = self.opt['cap_num_predictions']
+        ranks = ranks[:, : max_preds + self._num_pad_candidates(cands, cand_vecs)]
         cand_preds = []
-        for i, ordering in enumerate(ranks):
+        for i, ordering in enumerate(ranks.tolist()):
             if cand_vecs.dim() == 2:
                 cand_list = cands
             elif cand_vecs.dim() == 3:
                 cand_list = cands[i]
-            # using a generator instead of a list comprehension allows
-            # to cap the number of elements.
-            cand_preds_generator = (
-                cand_list[rank] for rank in ordering if rank < len(cand_list)
-            )
-            cand_preds.append(list(islice(cand_preds_generator, max_preds)))
+            num_cands = len(cand_list)
+            preds = [cand_list[rank] for rank in ordering if rank < num_cands]
+            cand_preds.append(preds[:max_preds])
 
         if (
             self.opt.get('repeat_blocking_heuristic', True)
             and self.eval_candidates == 'fixed'
         ):
-            cand_preds = self.block_repeats(cand_preds)
+            histories = None
+            if batch is not None and batch.observations is not None:
+                histories = [
+                    obs.get('history_raw_strings', self.history.history_raw_strings)
+                    for obs in batch.observations
+                ]
+            cand_preds = self.block_repeats(cand_preds, histories)
+        return cand_preds
+
+    def _response_cache_keys(self, batch):
+        """
+        Return the response cache key of every example in the batch.
 
-        if self.opt.get('inference', 'max') == 'max':
-            preds = [cand_preds[i][0] for i in range(batchsize)]
-        else:
-            # Top-k inference.
-            preds = []
-            for i in range(batchsize):
-                preds.append(random.choice(cand_preds[i][0 : self.opt['topk']]))
+        Examples whose reply is not a function of their text alone get a None
+        key. Returns None if the batch cannot use the cache at all.
+        """
+        if (
+            self.response_cache is None
+            or self.is_training
+            or self.eval_candidates != 'fixed'
+            or batch.label_vec is not None
+            or batch.observations is None
+            or self.opt.get('inference', 'max') != 'max'
+        ):
+            return None
+        keys = []
+        for obs in batch.observations:
+            vec = obs.get('text_vec')
+            if vec is None or obs.get('full_text', obs.get('text')) != obs.get('text'):
+                # the context includes earlier turns
+                keys.append(None)
+            else:
+                if torch.is_tensor(vec):
+                    vec = vec.tolist()
+                keys.append(' '.join(str(i) for i in vec))
+        return keys
 
-        return Output(preds, cand_preds, sorted_scores=sorted_scores)
+    def _ranking_options(self):
+        """
+        Return the options besides the weights and candidates that change the
+        ranked replies.
 
-    def block_repeats(self, cand_preds):
+        Subclasses with more such options should add them.
         """
-        Heuristic to block a model repeating a line from the history.
+        return [
+            self.rank_top_k,
+            self.opt.get('return_cand_scores', False),
+            self.opt['cap_num_predictions'],
+            self.opt.get('repeat_blocking_heuristic', True),
+            self.opt.get('score_chunksize', -1),
+            self.opt.get('inference', 'max'),
+            self.opt.get('topk', 1),
+        ]
+
+    def _get_response_cache_signature(self):
+        """
+        Identify everything besides the context that the ranked replies depend on.
+
+        Recomputed when the fixed candidates change or the model is trained.
+
+        :return:
+            the (namespace, signature) of the responses. The namespace stays
+            the same for this model file, candidate file and ranking options,
+            so entries of older weights or candidates are pruned without
+            touching those of other agents sharing the cache.
+        """
+        state, updates, namespace, signature = self._response_cache_signature
+        if (
+            state is not self._fixed_candidate_state
+            or updates != self._number_training_updates
+        ):
+            namespace = hash_strings(
+                type(self).__name__,
+                os.path.abspath(self.opt.get('model_file') or ''),
+                os.path.abspath(self.fixed_candidates_path or ''),
+                *self._ranking_options(),
+            )
+            signature = hash_strings(
+                namespace,
+                self._candidate_vecs_signature(),
+                self._weights_signature(),
+                getattr(self.fixed_candidate_encs, 'dtype', None),
+                *self.fixed_candidates[: self.num_fixed_candidates],
+            )
+            self.response_cache.prune(signature, namespace)
+            self._response_cache_signature = (
+                self._fixed_candidate_state,
+                self._number_training_updates,
+                namespace,
+                signature,
+            )
+        return namespace, signature
+
+    def _get_cached_responses(self, keys):
+        """
+        Return the cached Output for the batch, or None unless every example hits.
         """
-        history_strings = []
-        for h in self.history.history_raw_strings:
-            # Heuristic: Block any given line in the history, splitting by '\n'.
-            history_strings.extend(h.split('\n'))
+        valid_keys = [k for k in keys if k is not None]
+        found = {}
+        if valid_keys:
+            _, signature = self._get_response_cache_signature()
+            found = self.response_cache.get_many(signature, valid_keys)
+        hits = sum(k in found for k in valid_keys)
+        self.global_metrics.add('response_cache_hits', GlobalSumMetric(hits))
+        self.global_metrics.add(
+            'response_cache_misses', GlobalSumMetric(len(valid_keys) - hits)
+        )
+        if hits < len(keys):
+            return None
+        cand_preds = [found[k][0] for k in keys]
+        scores = [found[k][1] for k in keys]
+        sorted_scores = None
+        if all(s is not None for s in scores):
+            sorted_scores = torch.from_numpy(np.stack(scores))
+        return Output(
+            [c[0] for c in cand_preds], cand_preds, sorted_scores=sorted_scores
+        )
 
-        new_preds = []
-        for cp in cand_preds:
-            np = []
-            for c in cp:
-                if c not in history_strings:
-                    np.append(c)
-            new_preds.append(np)
-        return new_preds
+    def _cache_responses(self, keys, output):
+        entries = []
+        for i, key in enumerate(keys):
+            if key is None or not output.text_candidates[i]:
+                continue
+            scores = None
+            if output.sorted_scores is not None:
+                scores = output.sorted_scores[i].float().cpu().numpy()
+            entries.append((key, output.text_candidates[i], scores))
+        if entries:
+            namespace, signature = self._get_response_cache_signature()
+            self.response_cache.put_many(signature, entries, namespace=namespace)
+
+    def block_repeats(self, cand_preds, histories=None):
+        """
+        Heuristic to block a model repeating a line from the history.
+
+        :param histories:
+            the raw history strings of each example. Observations answered for
+            other copies of the agent, like the sessions of a chat service,
+            carry them as 'history_raw_strings'; defaults to this agent's
+            history for every example.
+        """
+        if histories is None:
+            histories = [self.history.history_raw_strings] * len(cand_preds)
+        blocked = []
+        for cp, history in zip(cand_preds, histories):
+            history_strings = set()
+            for h in history:
+                # Heuristic: Block any given line in the history, splitting by '\n'.
+                history_strings.update(h.split('\n'))
+            if history_strings:
+                cp = [c for c in cp if c not in history_strings]
+            blocked.append(cp)
+        return blocked
 
     def _set_label_cands_vec(self, *args, **kwargs):
         """
@@ -1532,8 +1831,71 @@ class TorchRankerAgent(TorchAgent):
             # vectorize label candidates if and only if we are using inline
             # candidates
             return obs
+        cands = obs.get('label_candidates')
+        if (
+            self.opt.get('intern_candidate_vecs') or isinstance(cands, CandidateSet)
+        ) and ('label_candidates_vecs' not in obs and cands):
+            return self._set_interned_cands_vec(*args, **kwargs)
         return super()._set_label_cands_vec(*args, **kwargs)
 
+    def _set_interned_cands_vec(self, obs, add_start, add_end, truncate):
+        """
+        Set 'label_candidates_vecs' to views of the interned candidate vectors.
+
+        Also sets 'label_candidates_rows', the rows of the candidates in
+        ``self.interned_cands``, which ``_build_candidates`` uses to pad the
+        batch.
+        """
+        settings = (add_start, add_end, truncate)
+        if settings not in self.interned_cands:
+            self.interned_cands[settings] = InternedVectors()
+        interned = self.interned_cands[settings]
+
+        def make_vecs(cands):
+            return [
+                self._check_truncate(
+                    self._add_start_end_tokens(vec, add_start, add_end),
+                    truncate,
+                    truncate_left=False,
+                )
+                for vec in self.dict.txt2vec_batch(cands)
+            ]
+
+        cands = obs['label_candidates']
+        if isinstance(cands, CandidateSet):
+            # the candidates of a candidate file, maybe with this example's
+            # labels after them: only the labels are looked up
+            base = cands if cands.base is None else cands.base
+            rows, vecs = interned.intern_shared(base, make_vecs, base.source)
+            if base is not cands and not self.opt.get('intern_candidate_vecs'):
+                # the labels are not kept, so the batch is padded from the vectors
+                extra = make_vecs(cands[len(base) :])
+                obs['label_candidates_vecs'] = vecs + [
+                    torch.as_tensor(vec, dtype=torch.long) for vec in extra
+                ]
+                return obs
+            if base is not cands:
+                extra = interned.intern(cands[len(base) :], make_vecs)
+                rows = rows + extra
+                vecs = vecs + [interned.vec(row) for row in extra]
+        else:
+            obs.force_set('label_candidates', list(cands))
+            rows = interned.intern(obs['label_candidates'], make_vecs)
+            vecs = [interned.vec(row) for row in rows]
+        obs['label_candidates_vecs'] = vecs
+        obs['label_candidates_rows'] = (interned, rows)
+        return obs
+
+    def _interned_rows(self, batch):
+        """
+        Return the InternedVectors and candidate rows of the batch, if all have
+        them.
+        """
+        rows = [obs.get('label_candidates_rows') for obs in batch.observations]
+        if not rows or any(r is None or r[0] is not rows[0][0] for r in rows):
+            return None, None
+        return rows[0][0], [r[1] for r in rows]
+
     def _build_candidates(self, batch, source, mode):
         """
         Build a candidate set for this batch.
@@ -1626,6 +1988,10 @@ class TorchRankerAgent(TorchAgent):
                     "--{m}={{'batch','fixed','vocab'}}."
                     "".format(m='candidates' if mode == 'train' else 'eval-candidates')
                 )
+            interned, rows = self._interned_rows(batch)
+            if type(self)._pad_tensor is not TorchAgent._pad_tensor:
+                # respect custom padding
+                interned = None
             # initialize the list of cands with the labels
             cands = []
             all_cands_vecs = []
@@ -1636,8 +2002,18 @@ class TorchRankerAgent(TorchAgent):
                     if cand not in cands_to_id:
                         cands.append(cand)
                         cands_to_id[cand] = len(cands_to_id)
-                        all_cands_vecs.append(batch.candidate_vecs[i][j])
-            cand_vecs, _ = self._pad_tensor(all_cands_vecs)
+                        if interned is None:
+                            all_cands_vecs.append(batch.candidate_vecs[i][j])
+                        else:
+                            all_cands_vecs.append(rows[i][j])
+            if interned is None:
+                cand_vecs, _ = self._pad_tensor(all_cands_vecs)
+            else:
+                cand_vecs = interned.padded(
+                    [all_cands_vecs], self.NULL_IDX, fp16friendly=self.fp16
+                ).squeeze(0)
+                if self.use_cuda:
+                    cand_vecs = cand_vecs.cuda()
             label_inds = label_vecs.new_tensor(
                 [cands_to_id[label] for label in batch.labels]
             )
@@ -1656,12 +2032,19 @@ class TorchRankerAgent(TorchAgent):
                 )
 
             cands = batch.candidates
-            cand_vecs = padded_3d(
-                batch.candidate_vecs,
-                self.NULL_IDX,
-                use_cuda=self.use_cuda,
-                fp16friendly=self.fp16,
-            )
+            interned, rows = self._interned_rows(batch)
+            if interned is None:
+                cand_vecs = padded_3d(
+                    batch.candidate_vecs,
+                    self.NULL_IDX,
+                    use_cuda=self.use_cuda,
+                    fp16friendly=self.fp16,
+                )
+            else:
+                # a single gather from the interned vectors
+                cand_vecs = interned.padded(rows, self.NULL_IDX, fp16friendly=self.fp16)
+                if self.use_cuda:
+                    cand_vecs = cand_vecs.cuda()
             if label_vecs is not None:
                 label_inds = label_vecs.new_empty((batchsize))
                 bad_batch = False
@@ -1752,6 +2135,10 @@ class TorchRankerAgent(TorchAgent):
         shared['fixed_candidate_vecs'] = self.fixed_candidate_vecs
         shared['fixed_candidate_encs'] = self.fixed_candidate_encs
         shared['num_fixed_candidates'] = self.num_fixed_candidates
+        shared['fixed_candidate_holder'] = self._fixed_candidate_holder
+        shared['response_cache'] = self.response_cache
+        shared['interned_cands'] = self.interned_cands
+        shared['weights_signature'] = self._weights_signature_state
         shared['vocab_candidates'] = self.vocab_candidates
         shared['vocab_candidate_vecs'] = self.vocab_candidate_vecs
         shared['vocab_candidate_encs'] = self.vocab_candidate_encs
@@ -1820,14 +2207,14 @@ class TorchRankerAgent(TorchAgent):
         overwrite the vectorize_fixed_candidates() method to produce encoded vectors
         instead of just vectorized ones.
         """
+        self._fixed_candidate_state = None
         if shared:
-            self.fixed_candidates = shared['fixed_candidates']
-            self.fixed_candidate_vecs = shared['fixed_candidate_vecs']
-            self.fixed_candidate_encs = shared['fixed_candidate_encs']
-            self.num_fixed_candidates = shared['num_fixed_candidates']
+            # copies follow the candidate set of the original agent, including
+            # later updates from update_fixed_candidates()
+            self._fixed_candidate_holder = shared['fixed_candidate_holder']
+            self._sync_fixed_candidates()
         else:
-            self.num_fixed_candidates = 0
-            opt = self.opt
+            self._fixed_candidate_holder = {'state': (None, None, None)}
             cand_path = self.fixed_candidates_path
             if 'fixed' in (self.candidates, self.eval_candidates):
                 if not cand_path:
@@ -1839,58 +2226,155 @@ class TorchRankerAgent(TorchAgent):
                         cand_path = self.fixed_candidates_path
                 # Load candidates
                 print("[ Loading fixed candidate set from {} ]".format(cand_path))
-                with open(cand_path, 'r', encoding='utf-8') as f:
-                    cands = [line.strip() for line in f.readlines()]
+                cands = self._read_fixed_candidates(cand_path)
                 # Load or create candidate vectors
-                if os.path.isfile(self.opt['fixed_candidate_vecs']):
-                    vecs_path = opt['fixed_candidate_vecs']
-                    vecs = self.load_candidates(vecs_path)
-                else:
-                    setting = self.opt['fixed_candidate_vecs']
-                    model_dir, model_file = os.path.split(self.opt['model_file'])
-                    model_name = os.path.splitext(model_file)[0]
-                    cands_name = os.path.splitext(os.path.basename(cand_path))[0]
-                    vecs_path = os.path.join(
-                        model_dir, '.'.join([model_name, cands_name, 'vecs'])
+                setting = self.opt['fixed_candidate_vecs']
+                if os.path.isfile(setting):
+                    vecs = self.load_candidates(setting)
+                    self._swap_fixed_candidates(
+                        cands, vecs, hash_state_dict({'vecs': vecs})
                     )
-                    if setting == 'reuse' and os.path.isfile(vecs_path):
-                        vecs = self.load_candidates(vecs_path)
-                    else:  # setting == 'replace' OR generating for the first time
-                        vecs = self._make_candidate_vecs(cands)
-                        self._save_candidates(vecs, vecs_path)
-
-                self.fixed_candidates = cands
-                self.num_fixed_candidates = len(self.fixed_candidates)
-                self.fixed_candidate_vecs = vecs
-                if self.use_cuda:
-                    self.fixed_candidate_vecs = self.fixed_candidate_vecs.cuda()
-
-                if self.encode_candidate_vecs:
-                    # candidate encodings are fixed so set them up now
-                    enc_path = os.path.join(
-                        model_dir, '.'.join([model_name, cands_name, 'encs'])
-                    )
-                    if setting == 'reuse' and os.path.isfile(enc_path):
-                        encs = self.load_candidates(enc_path, cand_type='encodings')
-                    else:
-                        encs = self._make_candidate_encs(self.fixed_candidate_vecs)
-                        self._save_candidates(
-                            encs, path=enc_path, cand_type='encodings'
-                        )
-                    self.fixed_candidate_encs = encs
-                    if self.use_cuda:
-                        self.fixed_candidate_encs = self.fixed_candidate_encs.cuda()
-                    if self.fp16:
-                        self.fixed_candidate_encs = self.fixed_candidate_encs.half()
-                    else:
-                        self.fixed_candidate_encs = self.fixed_candidate_encs.float()
                 else:
-                    self.fixed_candidate_encs = None
+                    self._load_fixed_candidates(cands, rebuild=(setting == 'replace'))
+            self._sync_fixed_candidates()
 
-            else:
-                self.fixed_candidates = None
-                self.fixed_candidate_vecs = None
-                self.fixed_candidate_encs = None
+    def _read_fixed_candidates(self, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return [line.strip() for line in f.readlines()]
+
+    def _fixed_candidates_store_path(self):
+        model_dir, model_file = os.path.split(self.opt['model_file'])
+        model_name = os.path.splitext(model_file)[0]
+        cands_name = os.path.splitext(os.path.basename(self.fixed_candidates_path))[0]
+        return os.path.join(model_dir, '.'.join([model_name, cands_name]))
+
+    def _load_fixed_candidates(self, cands, rebuild=False):
+        """
+        Vectorize and encode cands, reusing the on-disk stores, and swap them in.
+        """
+        vecs_signature = self._candidate_vecs_signature()
+        vecs = load_or_build(
+            CandidateStore(self._fixed_candidates_store_path() + '.vecs'),
+            vecs_signature,
+            [hash_text(c) for c in cands],
+            lambda idx: self._make_candidate_vecs([cands[i] for i in idx]),
+            pad_value=self.NULL_IDX,
+            rebuild=rebuild,
+        )
+        self._swap_fixed_candidates(cands, vecs, vecs_signature, rebuild=rebuild)
+
+    def _swap_fixed_candidates(self, cands, vecs, vecs_signature, rebuild=False):
+        """
+        Encode the candidates if needed and make them the current fixed set.
+
+        The candidates, vectors and encodings are replaced together, so neither
+        this agent nor its copies can see a mix of the old and new sets.
+        """
+        if self.use_cuda:
+            vecs = vecs.cuda()
+
+        encs = None
+        if self.encode_candidate_vecs:
+            # candidate encodings are fixed so set them up now. they are only
+            # reused if they were made by the same weights
+            encs_signature = hash_strings(vecs_signature, self._weights_signature())
+            encs = load_or_build(
+                CandidateStore(
+                    self._fixed_candidates_store_path() + '.encs',
+                    dim=self.fixed_candidate_encs_dim,
+                ),
+                encs_signature,
+                [hash_text(c) for c in cands],
+                lambda idx: self._make_candidate_encs(
+                    vecs[torch.LongTensor(idx).to(vecs.device)]
+                ),
+                rebuild=rebuild,
+            )
+            encs = self._prepare_fixed_candidate_encs(encs)
+
+        self._fixed_candidate_holder['state'] = (cands, vecs, encs)
+
+    def _prepare_fixed_candidate_encs(self, encs):
+        """
+        Move the fixed candidate encodings to the device and dtype used to score.
+
+        Subclasses can override this to keep the encodings in a compact format.
+        """
+        if self.use_cuda:
+            encs = encs.cuda()
+        if self.fp16:
+            return encs.half()
+        return encs.float()
+
+    def _sync_fixed_candidates(self):
+        """
+        Switch to the latest fixed candidate set, if it changed.
+        """
+        state = self._fixed_candidate_holder['state']
+        if state is self._fixed_candidate_state:
+            return
+        self._fixed_candidate_state = state
+        cands, self.fixed_candidate_vecs, self.fixed_candidate_encs = state
+        self.fixed_candidates = cands
+        self.num_fixed_candidates = 0 if cands is None else len(cands)
+
+    def update_fixed_candidates(self, add=None, remove=None, modify=None, save=True):
+        """
+        Add, remove or modify fixed candidates in place.
+
+        Only candidates that are not already in the candidate stores are vectorized
+        and encoded. The new set is swapped in atomically; this agent and all its
+        copies use it from their next train or eval step on.
+
+        :param add:
+            list of candidates to append to the set
+        :param remove:
+            list of candidates to remove from the set
+        :param modify:
+            dict mapping existing candidates to their new text
+        :param save:
+            also rewrite the file at --fixed-candidates-path, so that other
+            processes can pick up the change with reload_fixed_candidates()
+
+        :return:
+            the new list of candidates
+        """
+        self._sync_fixed_candidates()
+        if self.fixed_candidates is None:
+            raise RuntimeError('This agent does not use a fixed candidate set.')
+        remove = set(remove or [])
+        modify = {
+            old: self._clean_candidate(new) for old, new in (modify or {}).items()
+        }
+        cands = [
+            modify.get(c, c)
+            for c in self.fixed_candidates[: self.num_fixed_candidates]
+            if c not in remove
+        ]
+        cands.extend(self._clean_candidate(c) for c in (add or []))
+        if save:
+            tmp_path = self.fixed_candidates_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for cand in cands:
+                    f.write(cand + '\n')
+            os.replace(tmp_path, self.fixed_candidates_path)
+        self._load_fixed_candidates(cands)
+        self._sync_fixed_candidates()
+        return cands
+
+    def reload_fixed_candidates(self):
+        """
+        Re-read the fixed candidates file, e.g. after another process updated it.
+
+        Candidates found in the candidate stores are not encoded again.
+        """
+        cands = self._read_fixed_candidates(self.fixed_candidates_path)
+        self._load_fixed_candidates(cands)
+        self._sync_fixed_candidates()
+
+    def _clean_candidate(self, cand):
+        # candidates are stored one per line
+        return ' '.join(cand.split())
 
     def load_candidates(self, path, cand_type='vectors'):
         """
@@ -1899,6 +2383,34 @@ class TorchRankerAgent(TorchAgent):
         print("[ Loading fixed candidate set {} from {} ]".format(cand_type, path))
         return torch.load(path, map_location=lambda cpu, _: cpu)
 
+    def _weights_signature(self):
+        """
+        Identify the model weights, e.g. to tell which weights made stored encodings.
+
+        Hashing every weight is slow for large models, so the hash is only
+        computed again after the model was trained.
+        """
+        updates, signature = self._weights_signature_state
+        if signature is None or updates != self._number_training_updates:
+            signature = hash_state_dict(self.model.state_dict())
+            self._weights_signature_state = (self._number_training_updates, signature)
+        return signature
+
+    def _candidate_vecs_signature(self):
+        """
+        Identify the vectorization of fixed candidates.
+
+        Stored candidate vectors are only reused if the dictionary, the
+        tokenization and the truncation are unchanged.
+        """
+        return hash_strings(
+            type(self).__name__,
+            self.label_truncate,
+            self.opt.get('dict_tokenizer'),
+            self.opt.get('dict_lower'),
+            *getattr(self.dict, 'tok2ind', {}).keys(),
+        )
+
     def _make_candidate_vecs(self, cands):
         """
         Prebuild cached vectors for fixed candidates.
@@ -1975,12 +2487,12 @@ class TorchRankerAgent(TorchAgent):
         well as encoding if so desired.
         """
         return [
-            self._vectorize_text(
-                cand,
-                truncate=self.label_truncate,
-                truncate_left=False,
-                add_start=add_start,
-                add_end=add_end,
+            torch.LongTensor(
+                self._check_truncate(
+                    self._add_start_end_tokens(vec, add_start, add_end),
+                    self.label_truncate,
+                    truncate_left=False,
+                )
             )
-            for cand in cands_batch
+            for vec in self.dict.txt2vec_batch(cands_batch)
         ]
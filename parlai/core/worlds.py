@@ -3384,6 +3384,7 @@ All worlds are initialized with the following parameters:
 """
 
 import copy
+import queue
 import random
 import time
 
@@ -3391,8 +3392,10 @@ from typing import List, Dict, Any, Union
 
 try:
     from torch.multiprocessing import Process, Value, Condition, Semaphore
+    from torch.multiprocessing import get_context
 except ImportError:
     from multiprocessing import Process, Value, Semaphore, Condition  # noqa: F401
+    from multiprocessing import get_context
 
 from parlai.core.agents import create_agents_from_shared
 from parlai.core.loader import load_task_module, load_world_module
@@ -4606,6 +4609,250 @@ class BatchWorld(World):
         self.world.shutdown()
 
 
+def _preprocess_batches(opt: Opt, shared, seed, batches, ready, stop):
+    """
+    Main loop of a ``BackgroundPreprocessWorld`` worker.
+
+    Runs the teachers and copies of the model agent of a ``BatchWorld`` and
+    puts ``(labels, packed batch)`` for every batch in ``batches``, then None at
+    the end of an epoch of ordered data.
+    """
+    random.seed(seed)
+    # a full queue must not keep the worker from exiting
+    batches.cancel_join_thread()
+    world = BatchWorld(opt, shared['world_class'](opt, None, shared))
+    agent = world.get_model_agent()
+    # the main process moves the batches to the GPU
+    agent.use_cuda = False
+    # new teachers reset the shared index, so wait until all are created
+    ready.wait()
+    datatype = opt['datatype']
+    looping = datatype.startswith('train') and 'evalmode' not in datatype
+    while not stop.is_set() and (looping or not world.epoch_done()):
+        observations = []
+        labels = []
+        for w in world.worlds:
+            teacher, student = w.get_agents()
+            act = teacher.act()
+            labels.append(act.get('labels', act.get('eval_labels')))
+            observations.append(student.observe(validate(act)))
+        batch = agent.batchify(observations)
+        for w in world.worlds:
+            # the history holds the labels, so the reply is not needed
+            w.get_model_agent().self_observe(None)
+        if batch.valid_indices is None and all(lbls is None for lbls in labels):
+            continue
+        item = (labels, agent.pack_batch(batch, len(observations)))
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+    if not stop.is_set():
+        batches.put(None)
+    # the queued tensors are shared by this process until the main one is done
+    stop.wait()
+
+
+def _is_seekable(teacher):
+    return getattr(getattr(teacher, 'data', None), 'cache', None) is not None
+
+
+class BackgroundPreprocessWorld(World):
+    """
+    Batch world whose batches are prepared by background processes.
+
+    Each of the ``--num-workers`` processes runs a ``BatchWorld`` of its own
+    with the teacher and copies of the model agent: it reads the examples,
+    vectorizes them in ``observe`` and batchifies them, then queues the batch
+    for the main process, which only runs ``batch_act`` and the teacher's
+    metrics. Up to ``--prefetch-batches`` batches are queued ahead. Ordered data
+    is split between the workers through the teacher's shared index, or the
+    shared position in the stream index of streamed data.
+
+    The workers never see the model's replies, so the dialogue history must hold
+    the labels (``--use-reply label``), and teachers that compute extra metrics
+    in ``observe`` only get the standard ones. Teachers that load data in
+    threads (e.g. ``ChunkTeacher``) are not supported. Workers are forked when
+    the first batch is needed and never use CUDA.
+    """
+
+    def __init__(self, opt: Opt, world):
+        super().__init__(opt)
+        if not isinstance(world, DialogPartnerWorld):
+            raise ValueError('--num-workers supports a single task and model agent')
+        if opt.get('dynamic_batching'):
+            raise ValueError('--num-workers does not support --dynamic-batching')
+        if 'stream' in opt['datatype'] and not _is_seekable(world.get_agents()[0]):
+            raise ValueError(
+                '--num-workers only supports streamed data read from the stream '
+                'index of a dialog teacher, see --dialog-cache-dir'
+            )
+        agent = world.get_model_agent()
+        if not hasattr(agent, 'pack_batch'):
+            raise ValueError('--num-workers needs an agent based on TorchAgent')
+        if agent.opt.get('use_reply', 'label') != 'label':
+            raise ValueError('--num-workers needs --use-reply label')
+        self.inner_world = world
+        self.num_workers = opt['num_workers']
+        self._context = get_context('fork')
+        self._workers: List[Any] = []
+        self._finished = 0
+
+    def _start_workers(self):
+        self._batches = self._context.Queue(max(1, self.opt['prefetch_batches']))
+        self._stop = self._context.Event()
+        ready = self._context.Barrier(self.num_workers)
+        self._finished = 0
+        for _ in range(self.num_workers):
+            # every worker shares the teacher's index with the others
+            shared = self.inner_world.share()
+            seed = random.randrange(2 ** 31)
+            self._workers.append(
+                self._context.Process(
+                    target=_preprocess_batches,
+                    args=(self.opt, shared, seed, self._batches, ready, self._stop),
+                    daemon=True,
+                )
+            )
+        for worker in self._workers:
+            worker.start()
+        print(f'[ {self.num_workers} preprocessing workers started ]')
+
+    def _stop_workers(self):
+        if not self._workers:
+            return
+        self._stop.set()
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def _next_batch(self):
+        while self._finished < len(self._workers):
+            try:
+                item = self._batches.get(timeout=1.0)
+            except queue.Empty:
+                if not all(w.is_alive() for w in self._workers):
+                    self.shutdown()
+                    raise RuntimeError('A preprocessing worker died')
+                continue
+            if item is not None:
+                return item
+            self._finished += 1
+        return None
+
+    def parley(self):
+        """
+        Run the model and teacher metrics on the next prepared batch.
+        """
+        if not self._workers:
+            self._start_workers()
+        teacher = self.inner_world.get_task_agent()
+        agent = self.inner_world.get_model_agent()
+        with agent.stage_timer.stage('wait_batch'):
+            item = self._next_batch()
+        if item is None:
+            return
+        labels, packed = item
+        batch = agent.unpack_batch(packed)
+        replies = agent.batch_act(batch)
+        for reply, lbls in zip(replies, labels):
+            if lbls is not None:
+                teacher.metrics.evaluate_response(reply, lbls)
+        if batch.valid_indices is not None:
+            self.total_exs += len(batch.valid_indices)
+        self.update_counters()
+
+    def display(self):
+        """
+        Unsupported operation; returns an empty string.
+        """
+        return ''
+
+    def epoch_done(self):
+        """
+        Return whether every worker has finished the epoch.
+        """
+        return bool(self._workers) and self._finished == len(self._workers)
+
+    def getID(self):
+        """
+        Return the inner world's ID.
+        """
+        return self.inner_world.getID()
+
+    def num_examples(self):
+        """
+        Return the number of examples.
+        """
+        return self.inner_world.num_examples()
+
+    def num_episodes(self):
+        """
+        Return the number of episodes.
+        """
+        return self.inner_world.num_episodes()
+
+    def get_agents(self):
+        """
+        Return the agents of the inner world.
+        """
+        return self.inner_world.get_agents()
+
+    def get_task_agent(self):
+        """
+        Return task agent of inner world.
+        """
+        return self.inner_world.get_task_agent()
+
+    def get_model_agent(self):
+        """
+        Return model agent of inner world.
+        """
+        return self.inner_world.get_model_agent()
+
+    def get_total_exs(self):
+        """
+        Return the number of examples in the batches run so far.
+        """
+        return self.total_exs
+
+    def report(self):
+        """
+        Report the inner world's metrics.
+        """
+        return self.inner_world.report()
+
+    def save_agents(self):
+        """
+        Save the inner world's agents.
+        """
+        self.inner_world.save_agents()
+
+    def reset(self):
+        """
+        Stop the workers and reset the inner world; the next parley restarts them.
+        """
+        self._stop_workers()
+        self.inner_world.reset()
+
+    def reset_metrics(self):
+        """
+        Reset metrics for the inner world.
+        """
+        self.inner_world.reset_metrics()
+
+    def shutdown(self):
+        """
+        Stop the workers and shut down the inner world.
+        """
+        self._stop_workers()
+        self.inner_world.shutdown()
+
+
 class DynamicBatchWorld(World):
     def __init__(self, opt: Opt, world: Union[DialogPartnerWorld, MultiWorld]):
         super().__init__(opt)
@@ -5191,6 +5438,9 @@ def create_task(opt: Opt, user_agents, default_world=None):
         # use hogwild world if more than one thread requested
         # hogwild world will create sub batch worlds as well if bsz > 1
         world = HogwildWorld(opt, world)
+    elif opt.get('batchsize', 1) > 1 and opt.get('num_workers', 0) > 0:
+        # batches are read, vectorized and batchified by background processes
+        world = BackgroundPreprocessWorld(opt, world)
     elif opt.get('batchsize', 1) > 1 and opt.get('dynamic_batching'):
         world = DynamicBatchWorld(opt, world)
     elif opt.get('batchsize', 1) > 1:
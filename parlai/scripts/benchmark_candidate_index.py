@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Compare the recall and latency of shortlisted poly-encoder scoring against
+exhaustive scoring of all fixed candidates.
+
+Queries are taken from the text fields of the given task. For each shortlist size,
+recall@k is the fraction of the exhaustive top-k that is also in the shortlisted
+top-k.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/benchmark_candidate_index.py -t covid19 -dt valid \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 \\
+      --shortlists 50,200,1000 -ne 500
+"""
+
+from parlai.core.params import ParlaiParser
+from parlai.core.agents import create_agent
+from parlai.core.worlds import create_task
+from parlai.agents.repeat_label.repeat_label import RepeatLabelAgent
+from parlai.utils.misc import Timer
+
+import random
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Benchmark approximate candidate scoring')
+    parser.add_argument(
+        '-ne', '--num-examples', type=int, default=500, help='Number of queries'
+    )
+    parser.add_argument(
+        '--shortlists',
+        type=str,
+        default='50,100,500',
+        help='Comma separated shortlist sizes to benchmark',
+    )
+    parser.add_argument(
+        '--recall-at', type=int, default=10, help='Compare the top-k predictions'
+    )
+    parser.set_defaults(datatype='valid', interactive_mode=True)
+    parser.set_params(
+        encode_candidate_vecs=True, rank_top_k=-1, repeat_blocking_heuristic=False
+    )
+    return parser
+
+
+def _get_queries(opt):
+    task_opt = opt.copy()
+    task_opt['batchsize'] = 1
+    world = create_task(task_opt, RepeatLabelAgent(task_opt))
+    queries = []
+    while len(queries) < opt['num_examples'] and not world.epoch_done():
+        world.parley()
+        text = world.get_acts()[0].get('text')
+        if text:
+            queries.append(text)
+    return queries
+
+
+def _run(agent, queries, k):
+    timer = Timer()
+    latencies = []
+    preds = []
+    for text in queries:
+        timer.reset()
+        agent.observe({'text': text, 'episode_done': True})
+        reply = agent.act()
+        latencies.append(timer.time())
+        preds.append(reply.get('text_candidates', [])[:k])
+    latencies.sort()
+    return preds, latencies
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def benchmark_candidate_index(opt):
+    random.seed(42)
+    queries = _get_queries(opt)
+    agent = create_agent(opt, requireModelExists=True)
+    if agent.fixed_candidate_encs is None:
+        raise RuntimeError('This benchmark requires cached fixed candidate encodings')
+    k = opt['recall_at']
+    print(
+        '[ {} queries against {} candidates ]'.format(
+            len(queries), agent.fixed_candidate_encs.size(1)
+        )
+    )
+
+    agent.ann_shortlist = -1
+    exact, exact_lat = _run(agent, queries, k)
+    rows = [('exhaustive', 1.0, 1.0, exact_lat)]
+    for size in (int(x) for x in opt['shortlists'].split(',')):
+        agent.ann_shortlist = size
+        # warm up, so the index construction is not counted
+        _run(agent, queries[:1], k)
+        approx, lat = _run(agent, queries, k)
+        r1 = sum(a[:1] == e[:1] for a, e in zip(approx, exact)) / len(queries)
+        rk = sum(len(set(a) & set(e)) / max(1, len(e)) for a, e in zip(approx, exact))
+        rows.append(('shortlist={}'.format(size), r1, rk / len(queries), lat))
+
+    print(
+        '{:>16} {:>9} {:>9} {:>9} {:>9}'.format(
+            'mode', 'recall@1', 'recall@{}'.format(k), 'p50 ms', 'p99 ms'
+        )
+    )
+    for name, r1, rk, lat in rows:
+        print(
+            '{:>16} {:>9.4f} {:>9.4f} {:>9.2f} {:>9.2f}'.format(
+                name, r1, rk, _percentile(lat, 50) * 1000, _percentile(lat, 99) * 1000
+            )
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    benchmark_candidate_index(parser.parse_args(print_args=False))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Measure the reply latency of a running websocket chat service.
+
+Each client opens a websocket, sends the ``--setup-messages`` (waiting for one
+reply after each, e.g. to get through the overworld and onboarding), then sends
+``--num-messages`` texts one at a time and times how long each reply takes.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/chat_service/services/websocket/run.py \\
+      --config-path parlai/chat_service/tasks/covid19_chatbot/config.yml &
+  python parlai/scripts/benchmark_chat_latency.py --port 35496 --num-clients 4
+"""
+
+import json
+import threading
+
+import websocket
+
+from parlai.core.params import ParlaiParser
+from parlai.utils.misc import Timer
+
+DEFAULT_TEXTS = [
+    'What are the symptoms of COVID-19?',
+    'How does the virus spread?',
+    'Should I wear a mask?',
+    'How long is the incubation period?',
+    'Can pets get infected?',
+]
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(False, False, 'Benchmark chat service latency')
+    parser.add_argument(
+        '--port', type=int, default=35496, help='Port of the websocket service'
+    )
+    parser.add_argument(
+        '--host', type=str, default='localhost', help='Host of the websocket service'
+    )
+    parser.add_argument(
+        '--num-clients', type=int, default=1, help='Number of concurrent clients'
+    )
+    parser.add_argument(
+        '--num-messages', type=int, default=20, help='Texts sent by each client'
+    )
+    parser.add_argument(
+        '--setup-messages',
+        type=str,
+        default='hi,begin',
+        help='Comma separated texts sent before timing starts',
+    )
+    parser.add_argument(
+        '--texts', type=str, default=None, help='File with one text per line'
+    )
+    parser.add_argument(
+        '--reply-timeout',
+        type=float,
+        default=30,
+        help='Seconds to wait for a reply before giving up',
+    )
+    return parser
+
+
+def _send(ws, text):
+    ws.send(json.dumps({'text': text}))
+    return json.loads(ws.recv())
+
+
+def _run_client(opt, texts, latencies, errors):
+    url = 'ws://{}:{}/websocket'.format(opt['host'], opt['port'])
+    try:
+        ws = websocket.create_connection(url, timeout=opt['reply_timeout'])
+    except Exception as e:
+        errors.append(repr(e))
+        return
+    try:
+        for text in opt['setup_messages'].split(','):
+            if text:
+                _send(ws, text)
+        timer = Timer()
+        for i in range(opt['num_messages']):
+            timer.reset()
+            _send(ws, texts[i % len(texts)])
+            latencies.append(timer.time())
+        _send(ws, '[DONE]')
+    except Exception as e:
+        errors.append(repr(e))
+    finally:
+        ws.close()
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def benchmark_chat_latency(opt):
+    texts = DEFAULT_TEXTS
+    if opt['texts']:
+        with open(opt['texts'], 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(target=_run_client, args=(opt, texts, latencies, errors))
+        for _ in range(opt['num_clients'])
+    ]
+    timer = Timer()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = timer.time()
+
+    for error in sorted(set(errors)):
+        print('[ error: {} ]'.format(error))
+    if not latencies:
+        raise RuntimeError('No replies were received')
+    latencies.sort()
+    report = {
+        'replies': len(latencies),
+        'errors': len(errors),
+        'replies/s': len(latencies) / elapsed,
+        'mean ms': 1000 * sum(latencies) / len(latencies),
+        'p50 ms': 1000 * _percentile(latencies, 50),
+        'p95 ms': 1000 * _percentile(latencies, 95),
+        'p99 ms': 1000 * _percentile(latencies, 99),
+        'max ms': 1000 * latencies[-1],
+    }
+    for key, value in report.items():
+        print('{:>10}: {:.1f}'.format(key, value))
+    return report
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    benchmark_chat_latency(parser.parse_args(print_args=False))
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Measure the memory held by the data of teachers, and how fast they serve it.
+
+Each task's teachers are created in a fresh forked process while ``tracemalloc``
+counts the Python memory they allocate, then all examples are read with
+``act()`` to time them. Dialog teachers are measured twice: with the columnar
+``DialogStore`` they use, and with the list of episode tuples they used to hold,
+for comparison. Other teachers, e.g. wizard_of_wikipedia's, keep their own data
+and are measured once.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/benchmark_dialog_memory.py \\
+      -t covid19,wizard_of_wikipedia -dt train:ordered
+"""
+
+import gc
+import multiprocessing
+import tracemalloc
+
+import parlai.core.teachers as teachers
+from parlai.core.params import ParlaiParser
+from parlai.core.teachers import DialogData, create_task_agent_from_taskname
+from parlai.utils.misc import Timer
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, False, 'Benchmark the memory of teacher data')
+    parser.add_argument(
+        '-ne',
+        '--num-examples',
+        type=int,
+        default=-1,
+        help='Number of examples to read when timing act(); -1 reads them all',
+    )
+    parser.set_defaults(task='covid19,wizard_of_wikipedia', datatype='train:ordered')
+    return parser
+
+
+class _EpisodeTuples(list):
+    """
+    The list of episode tuples ``DialogData`` held before ``DialogStore``.
+    """
+
+    def freeze(self):
+        pass
+
+    def num_examples(self):
+        return sum(len(episode) for episode in self)
+
+
+def _measure(opt, task, tuples):
+    if tuples:
+        teachers.DialogStore = _EpisodeTuples
+    task_opt = opt.copy()
+    task_opt['task'] = task
+    task_opt['dialog_cache_dir'] = None
+    gc.collect()
+    tracemalloc.start()
+    agents = create_task_agent_from_taskname(task_opt)
+    gc.collect()
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    columnar = any(isinstance(getattr(a, 'data', None), DialogData) for a in agents)
+    num_exs = sum(a.num_examples() for a in agents)
+    num_eps = sum(a.num_episodes() for a in agents)
+    limit = opt['num_examples'] if opt['num_examples'] >= 0 else num_exs
+    timer = Timer()
+    read = 0
+    for agent in agents:
+        while read < limit and not agent.epoch_done():
+            agent.act()
+            read += 1
+    elapsed = timer.time()
+    return {
+        'columnar': columnar,
+        'episodes': num_eps,
+        'examples': num_exs,
+        'memory': memory,
+        'examples/s': read / elapsed if elapsed > 0 else 0,
+    }
+
+
+def _measure_in_process(opt, task, tuples):
+    # a fresh process for each measurement, so no strings are left over from
+    # the previous one
+    with multiprocessing.get_context('fork').Pool(1) as pool:
+        return pool.apply(_measure, (opt, task, tuples))
+
+
+def benchmark_dialog_memory(opt):
+    rows = []
+    for task in opt['task'].split(','):
+        # builds the data if needed, before anything is measured
+        _measure_in_process(dict(opt, num_examples=0), task, False)
+        result = _measure_in_process(opt, task, False)
+        rows.append((task, 'store' if result['columnar'] else 'own', result))
+        if result['columnar']:
+            rows.append((task, 'tuples', _measure_in_process(opt, task, True)))
+
+    print(
+        '{:>30} {:>7} {:>9} {:>9} {:>10} {:>12}'.format(
+            'task', 'data', 'episodes', 'examples', 'MB', 'examples/s'
+        )
+    )
+    for task, mode, result in rows:
+        print(
+            '{:>30} {:>7} {:>9} {:>9} {:>10.1f} {:>12.0f}'.format(
+                task,
+                mode,
+                result['episodes'],
+                result['examples'],
+                result['memory'] / 2 ** 20,
+                result['examples/s'],
+            )
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    benchmark_dialog_memory(parser.parse_args(print_args=False))
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Compare the accuracy and CPU latency of a poly-encoder with int8 weights and
+compressed candidate encodings against the full precision model.
+
+Queries and their labels are taken from the given task. Every query is ranked
+against the fixed candidates; MRR only counts labels within the first
+``--cap-num-predictions`` candidates. Agreement is the fraction of queries with
+the same top candidate as the full precision model.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/benchmark_quantization.py -t covid19 -dt valid \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 -ne 500
+"""
+
+from parlai.core.params import ParlaiParser
+from parlai.core.agents import create_agent
+from parlai.core.worlds import create_task
+from parlai.agents.repeat_label.repeat_label import RepeatLabelAgent
+from parlai.utils.misc import Timer
+
+import random
+
+# (name, --poly-int8-inference, --poly-cand-encs-dtype)
+MODES = [
+    ('fp32', False, 'float32'),
+    ('fp16 encs', False, 'float16'),
+    ('int8 encs', False, 'int8'),
+    ('int8 model', True, 'float32'),
+    ('int8 all', True, 'int8'),
+]
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Benchmark int8 poly-encoder inference')
+    parser.add_argument(
+        '-ne', '--num-examples', type=int, default=500, help='Number of queries'
+    )
+    parser.add_argument(
+        '--modes',
+        type=str,
+        default=','.join(name for name, _, _ in MODES),
+        help='Comma separated modes to benchmark, among: '
+        + ', '.join(name for name, _, _ in MODES),
+    )
+    parser.set_defaults(datatype='valid', interactive_mode=True, no_cuda=True)
+    parser.set_params(
+        encode_candidate_vecs=True, rank_top_k=-1, repeat_blocking_heuristic=False
+    )
+    return parser
+
+
+def _get_examples(opt):
+    task_opt = opt.copy()
+    task_opt['batchsize'] = 1
+    world = create_task(task_opt, RepeatLabelAgent(task_opt))
+    examples = []
+    while len(examples) < opt['num_examples'] and not world.epoch_done():
+        world.parley()
+        act = world.get_acts()[0]
+        labels = act.get('labels', act.get('eval_labels'))
+        if act.get('text') and labels:
+            examples.append((act['text'], set(labels)))
+    return examples
+
+
+def _create_agent(opt, int8_inference, encs_dtype):
+    mode_opt = opt.copy()
+    mode_opt['override'] = dict(opt.get('override', {}))
+    for key, value in (
+        ('poly_int8_inference', int8_inference),
+        ('poly_cand_encs_dtype', encs_dtype),
+    ):
+        mode_opt[key] = value
+        mode_opt['override'][key] = value
+    return create_agent(mode_opt, requireModelExists=True)
+
+
+def _run(agent, examples):
+    timer = Timer()
+    latencies = []
+    top1 = []
+    rr = 0
+    for text, labels in examples:
+        timer.reset()
+        agent.observe({'text': text, 'episode_done': True})
+        reply = agent.act()
+        latencies.append(timer.time())
+        cands = reply.get('text_candidates', [])
+        top1.append(cands[0] if cands else None)
+        for rank, cand in enumerate(cands):
+            if cand in labels:
+                rr += 1.0 / (rank + 1)
+                break
+    latencies.sort()
+    return top1, rr / max(1, len(examples)), latencies
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _encs_mb(agent):
+    encs = agent.fixed_candidate_encs
+    if encs is None:
+        return 0
+    if hasattr(encs, 'num_bytes'):
+        return encs.num_bytes() / (1024 * 1024)
+    return encs.element_size() * encs.numel() / (1024 * 1024)
+
+
+def benchmark_quantization(opt):
+    random.seed(42)
+    examples = _get_examples(opt)
+    modes = {name: (int8, dtype) for name, int8, dtype in MODES}
+    rows = []
+    reference = None
+    for name in opt['modes'].split(','):
+        name = name.strip()
+        if name not in modes:
+            raise ValueError('Unknown mode: {}'.format(name))
+        agent = _create_agent(opt, *modes[name])
+        if agent.fixed_candidate_encs is None:
+            raise RuntimeError(
+                'This benchmark requires cached fixed candidate encodings'
+            )
+        # warm up, so that lazy initialization is not counted
+        _run(agent, examples[:1])
+        top1, mrr, lat = _run(agent, examples)
+        if reference is None:
+            reference = top1
+        agree = sum(a == b for a, b in zip(top1, reference)) / max(1, len(top1))
+        rows.append((name, mrr, agree, _encs_mb(agent), lat))
+
+    print('[ {} queries ]'.format(len(examples)))
+    print(
+        '{:>12} {:>8} {:>8} {:>9} {:>8} {:>8} {:>8}'.format(
+            'mode', 'mrr', 'agree', 'encs MB', 'p50 ms', 'p95 ms', 'p99 ms'
+        )
+    )
+    for name, mrr, agree, mb, lat in rows:
+        print(
+            '{:>12} {:>8.4f} {:>8.4f} {:>9.2f} {:>8.2f} {:>8.2f} {:>8.2f}'.format(
+                name,
+                mrr,
+                agree,
+                mb,
+                _percentile(lat, 50) * 1000,
+                _percentile(lat, 95) * 1000,
+                _percentile(lat, 99) * 1000,
+            )
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    benchmark_quantization(parser.parse_args(print_args=False))
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Compare the throughput of per-string and batched dictionary vectorization.
+
+Texts are read from a file with one text per line, or from the text and label
+fields of a task. The per-string path calls ``txt2vec`` with the BPE cache
+disabled; the batched paths call ``txt2vec_batch`` with a cold and a warm cache,
+and with a pool of worker processes.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/benchmark_tokenization.py \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 \\
+      --texts data/covid19/answers.txt --num-workers 4
+"""
+
+from parlai.core.params import ParlaiParser
+from parlai.core.dict import DictionaryAgent
+from parlai.core.worlds import create_task
+from parlai.agents.repeat_label.repeat_label import RepeatLabelAgent
+from parlai.utils.misc import Timer
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, False, 'Benchmark dictionary vectorization')
+    DictionaryAgent.add_cmdline_args(parser)
+    parser.add_argument(
+        '--texts', type=str, default=None, help='File with one text per line'
+    )
+    parser.add_argument(
+        '-ne',
+        '--num-examples',
+        type=int,
+        default=10000,
+        help='Number of texts to read from the task',
+    )
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=512,
+        help='Number of texts per txt2vec_batch call',
+    )
+    parser.add_argument(
+        '--num-workers',
+        type=int,
+        default=4,
+        help='Worker processes for the last benchmark; <= 1 skips it',
+    )
+    parser.set_defaults(datatype='train:ordered')
+    return parser
+
+
+def _get_texts(opt):
+    if opt['texts']:
+        with open(opt['texts'], 'r', encoding='utf-8') as f:
+            return [line.rstrip('\n') for line in f]
+    task_opt = opt.copy()
+    task_opt['batchsize'] = 1
+    world = create_task(task_opt, RepeatLabelAgent(task_opt))
+    texts = []
+    while len(texts) < opt['num_examples'] and not world.epoch_done():
+        world.parley()
+        act = world.get_acts()[0]
+        if act.get('text'):
+            texts.append(act['text'])
+        texts.extend(act.get('labels', act.get('eval_labels', [])))
+    return texts[: opt['num_examples']]
+
+
+def _make_dict(opt, cache_size):
+    dict_opt = opt.copy()
+    if not dict_opt.get('dict_file') and dict_opt.get('model_file'):
+        dict_opt['dict_file'] = dict_opt['model_file'] + '.dict'
+    dict_opt['dict_bpe_cache_size'] = cache_size
+    return DictionaryAgent(dict_opt)
+
+
+def _time(fn, texts, batch_size):
+    timer = Timer()
+    vecs = []
+    for start in range(0, len(texts), batch_size):
+        vecs.extend(fn(texts[start : start + batch_size]))
+    return timer.time(), vecs
+
+
+def benchmark_tokenization(opt):
+    texts = _get_texts(opt)
+    bsz = opt['batch_size']
+    cache_size = opt['dict_bpe_cache_size']
+
+    uncached = _make_dict(opt, 0)
+    cached = _make_dict(opt, cache_size)
+    runs = [
+        ('txt2vec', lambda b: [uncached.txt2vec(t) for t in b], bsz),
+        ('batch, cold cache', cached.txt2vec_batch, bsz),
+        ('batch, warm cache', cached.txt2vec_batch, bsz),
+    ]
+    workers = opt['num_workers']
+    if workers > 1:
+        # a pool is started per call, so give each call the whole job
+        runs.append(
+            (
+                'batch, {} workers'.format(workers),
+                lambda b: cached.txt2vec_batch(b, num_workers=workers),
+                len(texts),
+            )
+        )
+
+    rows = []
+    reference = None
+    for name, fn, batch_size in runs:
+        elapsed, vecs = _time(fn, texts, batch_size)
+        if reference is None:
+            reference = vecs
+        elif vecs != reference:
+            raise RuntimeError('{} does not match txt2vec'.format(name))
+        num_tokens = sum(len(v) for v in vecs)
+        rows.append((name, len(texts) / elapsed, num_tokens / elapsed))
+
+    print('[ {} texts, {} tokens ]'.format(len(texts), sum(map(len, reference))))
+    print('{:>20} {:>12} {:>12} {:>8}'.format('mode', 'texts/s', 'tokens/s', 'speedup'))
+    for name, texts_per_sec, tokens_per_sec in rows:
+        print(
+            '{:>20} {:>12.0f} {:>12.0f} {:>7.2f}x'.format(
+                name, texts_per_sec, tokens_per_sec, texts_per_sec / rows[0][1]
+            )
+        )
+    return rows
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    benchmark_tokenization(parser.parse_args(print_args=False))
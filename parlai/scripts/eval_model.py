@@ -179,6 +179,7 @@ def eval_model(opt, print_parser=None):
     )
     print(nice_report(report))
     _save_eval_stats(opt, report)
+    agent.shutdown()
     return report
 
 
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Export a poly-encoder and its fixed candidates to a single TorchScript file.
+
+The context encoder, the codes attention and the scoring function are traced,
+and saved together with the candidate encodings, the candidate texts and the
+dictionary. The export can be served with
+:class:`parlai.utils.scripted_ranker.ScriptedRanker`, which only needs torch.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/export_polyencoder.py \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 \\
+      -fcp data/covid19/answers.txt --export-path /tmp/covid19.pt
+"""
+
+import json
+import os
+
+import torch
+
+from parlai.core.params import ParlaiParser
+from parlai.core.agents import create_agent
+from parlai.utils.misc import Timer
+from parlai.utils.scripted_ranker import ScriptedRanker, SUPPORTED_TOKENIZERS
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Export a poly-encoder to TorchScript')
+    parser.add_argument(
+        '--export-path',
+        type=str,
+        default=None,
+        help='Where to write the export; defaults to the model file with a '
+        '.scripted.pt suffix',
+    )
+    parser.set_defaults(interactive_mode=True, task=None, no_cuda=True)
+    parser.set_params(encode_candidate_vecs=True, eval_candidates='fixed')
+    return parser
+
+
+class _ScoreFixedCandidates(torch.nn.Module):
+    """
+    Score a batch of contexts against fixed candidate encodings.
+    """
+
+    def __init__(self, model, cand_encs):
+        super().__init__()
+        self.model = model
+        self.register_buffer('cand_encs', cand_encs)
+
+    def forward(self, ctxt_tokens):
+        ctxt_rep, ctxt_rep_mask, _ = self.model(ctxt_tokens=ctxt_tokens)
+        cand_rep = self.cand_encs.expand(ctxt_tokens.size(0), -1, -1)
+        return self.model(
+            ctxt_rep=ctxt_rep, ctxt_rep_mask=ctxt_rep_mask, cand_rep=cand_rep
+        )
+
+
+def _dict_config(agent):
+    opt = agent.opt
+    if agent.dict.tokenizer not in SUPPORTED_TOKENIZERS:
+        raise ValueError(
+            'Cannot export the {} tokenizer, only {}'.format(
+                agent.dict.tokenizer, ', '.join(SUPPORTED_TOKENIZERS)
+            )
+        )
+    if agent.dict.max_ngram_size > 1:
+        raise ValueError('Cannot export a dictionary with --dict-max-ngram-size')
+    config = {
+        'tokenizer': agent.dict.tokenizer,
+        'lower': agent.dict.lower,
+        'null_token': agent.dict.null_token,
+        'start_token': agent.dict.start_token,
+        'end_token': agent.dict.end_token,
+        'unk_token': agent.dict.unk_token,
+        'tok2ind': agent.dict.tok2ind,
+        'truncate': agent.text_truncate,
+    }
+    if agent.dict.tokenizer == 'bpe':
+        with open(agent.dict.bpehelper.codecs, 'r', encoding='utf-8') as f:
+            config['bpe_codecs'] = f.read()
+    if opt.get('person_tokens') or opt.get('history_add_global_end_token'):
+        raise ValueError('Cannot export a model that adds tokens to the history')
+    return config
+
+
+def trace_polyencoder(agent):
+    """
+    Return the traced scoring module of a poly-encoder agent.
+    """
+    if agent.model.type != 'codes':
+        raise ValueError('Only --polyencoder-type codes can be exported')
+    if agent.fixed_candidate_encs is None:
+        raise RuntimeError('Exporting requires cached fixed candidate encodings')
+    cand_encs = agent._dequantize_encs(agent.fixed_candidate_encs).float().cpu()
+    module = _ScoreFixedCandidates(agent.model.float().cpu().eval(), cand_encs)
+    # trace with a batch of contexts of different lengths, so padding is covered
+    example = torch.full((2, 8), agent.NULL_IDX, dtype=torch.long)
+    example[:, 0] = agent.START_IDX
+    example[0, 1:7] = agent.dict[agent.dict.unk_token]
+    example[0, 7] = agent.END_IDX
+    example[1, 1] = agent.END_IDX
+    with torch.no_grad():
+        return torch.jit.trace(module, example, check_trace=False)
+
+
+def export_polyencoder(opt):
+    agent = create_agent(opt, requireModelExists=True)
+    path = opt['export_path'] or opt['model_file'] + '.scripted.pt'
+    traced = trace_polyencoder(agent)
+    extra_files = {
+        'dict.json': json.dumps(_dict_config(agent)),
+        'candidates.json': json.dumps(
+            agent.fixed_candidates[: agent.num_fixed_candidates]
+        ),
+    }
+    tmp_path = path + '.tmp'
+    torch.jit.save(traced, tmp_path, _extra_files=extra_files)
+    os.replace(tmp_path, path)
+
+    timer = Timer()
+    ranker = ScriptedRanker(path)
+    print(
+        '[ Exported {} candidates to {} ({:.1f} MB), loaded in {:.2f}s ]'.format(
+            len(ranker.candidates),
+            path,
+            os.path.getsize(path) / (1024 * 1024),
+            timer.time(),
+        )
+    )
+    return path
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    export_polyencoder(parser.parse_args(print_args=False))
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Replay questions against a running chat endpoint and report its behavior under
+load.
+
+Questions are read from ``--questions`` (one per line, or JSON lines with a
+``text`` or ``question`` field) or from the texts of a task. They are sent to
+the HTTP API of ``fastapi_covid.py`` or to the websocket chat service by
+``--concurrency`` clients, either as fast as the replies come back or, with
+``--rate``, at a fixed average arrival rate.
+
+Latencies are measured from the time a request was due, so with ``--rate`` the
+time spent waiting for a free client is included (``client_queue`` stage).
+The HTTP API also reports how long each request spent in the server's queue,
+vectorizing and running the model; those stages are summarized as well.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  uvicorn fastapi_covid:app --port 8000 &
+  python parlai/scripts/load_test.py -t covid19 -dt test \\
+      --target http --concurrency 16 --rate 50
+
+  python parlai/scripts/load_test.py --target websocket \\
+      --url ws://localhost:35496/websocket --questions questions.txt
+"""
+
+import json
+import queue
+import random
+import threading
+import time
+
+import requests
+import websocket
+
+from parlai.core.params import ParlaiParser
+from parlai.core.worlds import create_task
+from parlai.agents.repeat_label.repeat_label import RepeatLabelAgent
+from parlai.utils.misc import Timer
+
+DEFAULT_URLS = {
+    'http': 'http://localhost:8000/',
+    'websocket': 'ws://localhost:35496/websocket',
+}
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, False, 'Load test a chat endpoint')
+    parser.add_argument(
+        '--target',
+        type=str,
+        default='http',
+        choices=sorted(DEFAULT_URLS),
+        help='Which endpoint to load',
+    )
+    parser.add_argument(
+        '--url', type=str, default=None, help='URL of the endpoint to load'
+    )
+    parser.add_argument(
+        '--questions',
+        type=str,
+        default=None,
+        help='File with one question per line, or JSON lines with a text or '
+        'question field; defaults to the texts of the task',
+    )
+    parser.add_argument(
+        '-n', '--num-requests', type=int, default=1000, help='Requests to send'
+    )
+    parser.add_argument(
+        '--warmup',
+        type=int,
+        default=10,
+        help='Requests sent before measuring, to load lazy state',
+    )
+    parser.add_argument(
+        '--concurrency', type=int, default=8, help='Number of concurrent clients'
+    )
+    parser.add_argument(
+        '--rate',
+        type=float,
+        default=0,
+        help='Average requests per second; 0 sends a new request as soon as a '
+        'client is free',
+    )
+    parser.add_argument(
+        '--poisson',
+        type='bool',
+        default=True,
+        help='With --rate, draw exponential gaps between requests instead of '
+        'evenly spaced ones',
+    )
+    parser.add_argument(
+        '--setup-messages',
+        type=str,
+        default='hi,begin',
+        help='Comma separated texts each websocket client sends before the '
+        'questions, waiting for one reply after each',
+    )
+    parser.add_argument(
+        '--request-timeout',
+        type=float,
+        default=30,
+        help='Seconds to wait for a reply before counting an error',
+    )
+    parser.add_argument('--seed', type=int, default=42, help='Random seed')
+    parser.set_defaults(datatype='test:ordered')
+    return parser
+
+
+def load_questions(opt):
+    """
+    Return the questions to replay.
+    """
+    if opt['questions']:
+        questions = []
+        with open(opt['questions'], 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith('{'):
+                    line = json.loads(line)
+                    line = line.get('text', line.get('question', ''))
+                if line:
+                    questions.append(line)
+        return questions
+    task_opt = opt.copy()
+    task_opt['batchsize'] = 1
+    world = create_task(task_opt, RepeatLabelAgent(task_opt))
+    questions = []
+    while not world.epoch_done() and len(questions) < opt['num_requests']:
+        world.parley()
+        text = world.get_acts()[0].get('text')
+        if text:
+            questions.append(text)
+    return questions
+
+
+class HttpClient(object):
+    """
+    Ask questions to the HTTP API of fastapi_covid.py.
+    """
+
+    def __init__(self, opt):
+        self.url = opt['url'] or DEFAULT_URLS['http']
+        self.timeout = opt['request_timeout']
+        self.session = requests.Session()
+
+    def ask(self, text):
+        """
+        Return the server-side timings of the reply to text, in milliseconds.
+        """
+        response = self.session.get(
+            self.url, params={'question': text}, timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json().get('timings', {})
+
+    def close(self):
+        self.session.close()
+
+
+class WebsocketClient(object):
+    """
+    Ask questions through a session of the websocket chat service.
+    """
+
+    def __init__(self, opt):
+        url = opt['url'] or DEFAULT_URLS['websocket']
+        self.ws = websocket.create_connection(url, timeout=opt['request_timeout'])
+        for text in opt['setup_messages'].split(','):
+            if text:
+                self.ask(text)
+
+    def ask(self, text):
+        self.ws.send(json.dumps({'text': text}))
+        json.loads(self.ws.recv())
+        return {}
+
+    def close(self):
+        self.ws.close()
+
+
+CLIENTS = {'http': HttpClient, 'websocket': WebsocketClient}
+
+
+class LoadTest(object):
+    """
+    Send the questions from ``concurrency`` client threads and record the
+    latency, server timings and errors of every request.
+    """
+
+    def __init__(self, opt, questions):
+        self.opt = opt
+        self.questions = questions
+        self.results = []
+        self._lock = threading.Lock()
+        self._requests = queue.Queue()
+
+    def _schedule(self, num_requests, measured):
+        """
+        Queue the requests, at --rate if set.
+        """
+        rate = self.opt['rate']
+        due = time.time()
+        for i in range(num_requests):
+            if rate > 0:
+                if self.opt['poisson']:
+                    due += random.expovariate(rate)
+                else:
+                    due += 1.0 / rate
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                due = None
+            self._requests.put((self.questions[i % len(self.questions)], due, measured))
+
+    def _run_client(self):
+        try:
+            client = CLIENTS[self.opt['target']](self.opt)
+        except Exception as e:
+            self._record(0, {}, 'connect: ' + repr(e))
+            client = None
+        while True:
+            item = self._requests.get()
+            if item is None:
+                break
+            text, due, measured = item
+            if client is None:
+                if measured:
+                    self._record(0, {}, 'not connected')
+                self._requests.task_done()
+                continue
+            started = time.time()
+            if due is None:
+                due = started
+            try:
+                timings = dict(client.ask(text))
+                error = None
+            except Exception as e:
+                timings = {}
+                error = repr(e)
+            timings['client_queue_ms'] = 1000 * (started - due)
+            if measured:
+                self._record(time.time() - due, timings, error)
+            self._requests.task_done()
+        if client is not None:
+            client.close()
+
+    def _record(self, latency, timings, error):
+        with self._lock:
+            self.results.append((latency, timings, error))
+
+    def run(self):
+        """
+        Run the load test and return the elapsed wall time of the measured part.
+        """
+        threads = [
+            threading.Thread(target=self._run_client, daemon=True)
+            for _ in range(self.opt['concurrency'])
+        ]
+        for thread in threads:
+            thread.start()
+        # warm up before the clock starts
+        for _ in range(self.opt['warmup']):
+            self._requests.put((random.choice(self.questions), None, False))
+        self._requests.join()
+        timer = Timer()
+        self._schedule(self.opt['num_requests'], True)
+        for _ in threads:
+            self._requests.put(None)
+        for thread in threads:
+            thread.join()
+        return timer.time()
+
+
+def _percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _summary(values):
+    values = sorted(values)
+    if not values:
+        return None
+    return (
+        sum(values) / len(values),
+        _percentile(values, 50),
+        _percentile(values, 95),
+        _percentile(values, 99),
+    )
+
+
+def load_test(opt):
+    random.seed(opt['seed'])
+    questions = load_questions(opt)
+    if not questions:
+        raise RuntimeError('No questions to send')
+    test = LoadTest(opt, questions)
+    elapsed = test.run()
+
+    ok = [r for r in test.results if r[2] is None]
+    errors = [r[2] for r in test.results if r[2] is not None]
+    report = {
+        'requests': len(test.results),
+        'errors': len(errors),
+        'error_rate': len(errors) / max(1, len(test.results)),
+        'throughput': len(ok) / elapsed,
+        'stages': {},
+    }
+    stages = {'total_ms': [1000 * r[0] for r in ok]}
+    for _, timings, _ in ok:
+        for stage, value in timings.items():
+            stages.setdefault(stage, []).append(value)
+    for stage, values in stages.items():
+        report['stages'][stage[: -len('_ms')]] = _summary(values)
+
+    for error in sorted(set(errors))[:10]:
+        print('[ error: {} ]'.format(error))
+    print(
+        '[ {} requests, {} errors ({:.2%}), {:.1f} replies/s ]'.format(
+            report['requests'],
+            report['errors'],
+            report['error_rate'],
+            report['throughput'],
+        )
+    )
+    print(
+        '{:>14} {:>9} {:>9} {:>9} {:>9}'.format(
+            'stage', 'mean ms', 'p50 ms', 'p95 ms', 'p99 ms'
+        )
+    )
+    for stage, summary in report['stages'].items():
+        if summary is not None:
+            print('{:>14} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(stage, *summary))
+    return report
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    load_test(parser.parse_args(print_args=False))
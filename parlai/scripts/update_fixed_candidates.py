@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Add, remove or modify the fixed candidates of a ranking model.
+
+Only the changed candidates are vectorized and encoded; the candidate file and
+the cached vectors and encodings next to the model file are updated in place.
+Running agents pick up the change with ``reload_fixed_candidates()``.
+
+Files given to ``--add`` and ``--remove`` contain one candidate per line. The
+file given to ``--modify`` contains one ``old<TAB>new`` pair per line.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/update_fixed_candidates.py \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 \\
+      -fcp data/covid19/answers.txt --add /tmp/new_answers.txt
+"""
+
+from parlai.core.params import ParlaiParser
+from parlai.core.agents import create_agent
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Update the fixed candidates of a model')
+    parser.add_argument(
+        '--add', type=str, default=None, help='File of candidates to add'
+    )
+    parser.add_argument(
+        '--remove', type=str, default=None, help='File of candidates to remove'
+    )
+    parser.add_argument(
+        '--modify',
+        type=str,
+        default=None,
+        help='File of tab separated pairs of existing and new candidate text',
+    )
+    parser.set_defaults(interactive_mode=True, task=None)
+    parser.set_params(fixed_candidate_vecs='reuse')
+    return parser
+
+
+def _read_lines(path):
+    if path is None:
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        # stripped like the lines of the fixed candidates file
+        return [line.strip() for line in f if line.strip()]
+
+
+def update_fixed_candidates(opt):
+    add = _read_lines(opt['add'])
+    remove = _read_lines(opt['remove'])
+    modify = {}
+    for line in _read_lines(opt['modify']):
+        if '\t' not in line:
+            raise ValueError('Expected "old<TAB>new" in --modify, got: ' + line)
+        old, new = line.split('\t', 1)
+        modify[old.strip()] = new
+
+    agent = create_agent(opt, requireModelExists=True)
+    before = agent.num_fixed_candidates
+    cands = agent.update_fixed_candidates(add=add, remove=remove, modify=modify)
+    print(
+        '[ Updated {}: {} -> {} candidates ]'.format(
+            agent.fixed_candidates_path, before, len(cands)
+        )
+    )
+    return cands
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    update_fixed_candidates(parser.parse_args(print_args=False))
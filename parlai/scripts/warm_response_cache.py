@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Fill the response cache of a ranking model from a log of past queries.
+
+The log is either a JSON lines file, in which case the query is read from the
+``--query-field`` of every line, or a text file with one query per line.
+Duplicate queries are only answered once.
+
+Examples
+--------
+
+.. code-block:: shell
+
+  python parlai/scripts/warm_response_cache.py \\
+      -mf model/covid19_scraped_ver6/poly_encoder_covid19 \\
+      --response-cache-path /tmp/covid19_responses.db \\
+      --query-log logs/requests.jsonl --query-field question
+"""
+
+import json
+
+from parlai.core.params import ParlaiParser
+from parlai.core.agents import create_agent, create_agent_from_shared
+from parlai.utils.misc import TimeLogger
+
+
+def setup_args(parser=None):
+    if parser is None:
+        parser = ParlaiParser(True, True, 'Warm up the response cache of a model')
+    parser.add_argument(
+        '--query-log', type=str, required=True, help='File of past queries'
+    )
+    parser.add_argument(
+        '--query-field',
+        type=str,
+        default='text',
+        help='Field holding the query, for JSON lines logs',
+    )
+    parser.add_argument('-ltim', '--log-every-n-secs', type=float, default=2)
+    parser.set_defaults(interactive_mode=True, task=None, batchsize=32)
+    return parser
+
+
+def _read_queries(path, field):
+    queries = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                query = json.loads(line)
+            except ValueError:
+                query = line
+            if isinstance(query, dict):
+                query = query.get(field)
+            if isinstance(query, str) and query not in seen:
+                seen.add(query)
+                queries.append(query)
+    return queries
+
+
+def warm_response_cache(opt):
+    if not opt.get('response_cache_path'):
+        raise RuntimeError('Please set --response-cache-path')
+    queries = _read_queries(opt['query_log'], opt['query_field'])
+    agent = create_agent(opt, requireModelExists=True)
+    bsz = opt['batchsize']
+    copies = [create_agent_from_shared(agent.share()) for _ in range(bsz)]
+    log_timer = TimeLogger()
+    print('[ Warming the response cache with {} queries ]'.format(len(queries)))
+    for start in range(0, len(queries), bsz):
+        batch = queries[start : start + bsz]
+        observations = []
+        for copy, query in zip(copies, batch):
+            observations.append(copy.observe({'text': query, 'episode_done': True}))
+        replies = agent.batch_act(observations)
+        for copy, reply in zip(copies, replies):
+            copy.self_observe(reply)
+        if log_timer.time() > opt['log_every_n_secs']:
+            text, _ = log_timer.log(start + len(batch), len(queries))
+            print(text)
+    print(
+        '[ {} entries in {} ]'.format(
+            len(agent.response_cache), opt['response_cache_path']
+        )
+    )
+    return agent.report()
+
+
+if __name__ == '__main__':
+    parser = setup_args()
+    warm_response_cache(parser.parse_args(print_args=False))
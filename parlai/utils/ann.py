@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Approximate maximum inner product search over candidate encodings.
+
+Used to shortlist fixed candidates before running an expensive scoring function
+(e.g. the poly-encoder attention) on the shortlist only.
+"""
+
+import math
+from typing import Optional, Tuple
+
+import torch
+
+
+class IVFIndex(object):
+    """
+    Inverted file index for maximum inner product search.
+
+    The candidate encodings are clustered with k-means into ``n_lists`` cells.
+    A query is only compared against the members of the ``n_probe`` cells whose
+    centroids have the highest inner product with it, so the cost of a search is
+    roughly ``n_lists + n_probe * N / n_lists`` dot products instead of ``N``.
+
+    Everything is kept on CPU and built with plain torch operations.
+
+    :param encs:
+        [N, dim] float tensor of candidate encodings
+    :param n_lists:
+        number of k-means cells. Defaults to ``sqrt(N)``.
+    :param n_probe:
+        number of cells visited per query. Higher is slower but more accurate.
+    :param kmeans_iters:
+        number of Lloyd iterations used to train the centroids
+    :param max_train_points:
+        the centroids are trained on a random sample of at most this many
+        encodings
+    """
+
+    def __init__(
+        self,
+        encs: torch.Tensor,
+        n_lists: Optional[int] = None,
+        n_probe: int = 8,
+        kmeans_iters: int = 10,
+        max_train_points: int = 65536,
+        seed: int = 42,
+    ):
+        encs = encs.detach().float().cpu().contiguous()
+        num_cands = encs.size(0)
+        if n_lists is None or n_lists <= 0:
+            n_lists = int(math.sqrt(num_cands))
+        self.n_lists = max(1, min(n_lists, num_cands))
+        self.n_probe = max(1, min(n_probe, self.n_lists))
+        self.num_cands = num_cands
+
+        generator = torch.Generator().manual_seed(seed)
+        self.centroids = self._kmeans(
+            encs, self.n_lists, kmeans_iters, max_train_points, generator
+        )
+        assignments = self._assign(encs, self.centroids)
+        # store the candidates grouped by cell, so every cell is a contiguous slice
+        order = torch.argsort(assignments)
+        self.ids = order
+        self.encs = encs[order]
+        counts = torch.bincount(assignments, minlength=self.n_lists)
+        self.offsets = torch.cat([counts.new_zeros(1), counts.cumsum(0)])
+
+    @staticmethod
+    def _assign(encs, centroids, chunk=65536):
+        assignments = []
+        for start in range(0, encs.size(0), chunk):
+            block = encs[start : start + chunk]
+            dists = torch.cdist(block, centroids)
+            assignments.append(dists.argmin(1))
+        return torch.cat(assignments)
+
+    def _kmeans(self, encs, k, iters, max_train_points, generator):
+        if encs.size(0) > max_train_points:
+            sample = torch.randperm(encs.size(0), generator=generator)
+            train = encs[sample[:max_train_points]]
+        else:
+            train = encs
+        init = torch.randperm(train.size(0), generator=generator)[:k]
+        centroids = train[init].clone()
+        for _ in range(iters):
+            assignments = self._assign(train, centroids)
+            sums = centroids.new_zeros(centroids.size())
+            sums.index_add_(0, assignments, train)
+            counts = torch.bincount(assignments, minlength=k).unsqueeze(1)
+            # empty cells keep their previous centroid
+            nonempty = counts.squeeze(1) > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty].float()
+        return centroids
+
+    def search(
+        self, queries: torch.Tensor, k: int
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        Return the approximate top-k candidates for each query.
+
+        :param queries:
+            [bsz, dim] float tensor
+        :param k:
+            number of candidates to return per query
+
+        :return: (scores, ids), both [bsz, k]. If fewer than k candidates are
+            found in the probed cells, the remaining ids are filled with the
+            best candidates of the other cells, so the rows are always full.
+        """
+        queries = queries.detach().float().cpu()
+        k = min(k, self.num_cands)
+        cell_scores = queries.mm(self.centroids.t())
+        probes = cell_scores.topk(self.n_probe, dim=1)[1]
+        all_scores = []
+        all_ids = []
+        for query, cells in zip(queries, probes):
+            rows = torch.cat(
+                [
+                    torch.arange(self.offsets[c], self.offsets[c + 1])
+                    for c in cells.tolist()
+                ]
+            )
+            if rows.numel() < k:
+                # not enough candidates in the probed cells, fall back to all
+                rows = torch.arange(self.num_cands)
+            scores = self.encs[rows].mv(query)
+            top_scores, top = scores.topk(k)
+            all_scores.append(top_scores)
+            all_ids.append(self.ids[rows[top]])
+        return torch.stack(all_scores), torch.stack(all_ids)
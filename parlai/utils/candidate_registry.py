@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Candidate files read once per process and shared by all their users.
+
+The teachers with a ``cands_datafile`` used to read the whole candidate file
+into a new list every time they were created. The registry reads each file once,
+interns its candidates with ``sys.intern`` (like the texts and inline candidates
+of ``DialogData``, so a candidate that is also an inline candidate or a label is
+stored once) and hands the same immutable :class:`CandidateSet` to every caller
+until the file changes. Forked processes inherit the sets already read.
+``parlai.utils.misc.load_cands`` still returns a new list with every line.
+
+A :class:`CandidateSet` knows the id of each of its candidates, so membership
+tests are constant time, and remembers which set it extends when the labels of
+an example are added to it. Agents use this to find the vectors of the shared
+candidates once per set instead of once per example.
+"""
+
+import os
+import sys
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+# (abspath, lines_have_ids, cands_are_replies) => (file stamp, CandidateSet)
+_REGISTRY: Dict[Tuple, Tuple] = {}
+_LOCK = threading.Lock()
+
+
+class CandidateSet(tuple):
+    """
+    A tuple of distinct, interned candidates.
+
+    :param cands:
+        the candidates, in order; repeated candidates are only kept once
+    :param base:
+        the CandidateSet whose candidates come first in this one, if it was made
+        with ``extended``
+    :param source:
+        the registry key of the file the candidates were read from, if any; a
+        set read again after its file changed has the same source
+    """
+
+    def __new__(cls, cands: Iterable[str] = (), base=None, source=None):
+        self = super().__new__(cls, dict.fromkeys(sys.intern(c) for c in cands))
+        self.base = base
+        self.source = source
+        self._ids = None
+        return self
+
+    def __reduce__(self):
+        # the ids can be rebuilt, and the base is only needed by the process
+        # which made the set
+        return (CandidateSet, (tuple(self), None, self.source))
+
+    @property
+    def ids(self) -> Dict[str, int]:
+        """
+        The index of every candidate.
+        """
+        if self._ids is None:
+            self._ids = {c: i for i, c in enumerate(self)}
+        return self._ids
+
+    def __contains__(self, cand) -> bool:
+        if self.base is not None:
+            return cand in self.base or cand in self[len(self.base) :]
+        return cand in self.ids
+
+    def index(self, cand, *args) -> int:
+        if self.base is None and not args:
+            try:
+                return self.ids[cand]
+            except (KeyError, TypeError):
+                raise ValueError('{!r} is not a candidate'.format(cand))
+        return super().index(cand, *args)
+
+    def extended(self, cands: Iterable[str]) -> 'CandidateSet':
+        """
+        Return a new set with the candidates of this one, then the given ones.
+
+        Candidates already in this set are not added again.
+        """
+        base = self if self.base is None else self.base
+        cands = [c for c in cands if c not in self]
+        return CandidateSet(tuple(self) + tuple(cands), base=base)
+
+
+def read_candidates(path: str, lines_have_ids=False, cands_are_replies=False):
+    """
+    Read the candidates of a candidate file.
+
+    Lines starting with ids, like fbdialog files, have their ids stripped. If a
+    line contains tabs, the candidates are the replies of the dialog file
+    instead of its lines.
+    """
+    cands = []
+    cnt = 0
+    with open(path) as read:
+        for line in read:
+            line = line.strip().replace('\\n', '\n')
+            if len(line) > 0:
+                cnt = cnt + 1
+                # If lines are numbered we strip them of numbers.
+                if cnt == 1 and line[0:2] == '1 ':
+                    lines_have_ids = True
+                # If tabs then the label_candidates are all the replies.
+                if '\t' in line and not cands_are_replies:
+                    cands_are_replies = True
+                    cands = []
+                if lines_have_ids:
+                    space_idx = line.find(' ')
+                    line = line[space_idx + 1 :]
+                    if cands_are_replies:
+                        sp = line.split('\t')
+                        if len(sp) > 1 and sp[1] != '':
+                            cands.append(sp[1])
+                    else:
+                        cands.append(line)
+                else:
+                    cands.append(line)
+    return cands
+
+
+def get_candidates(
+    path: Optional[str], lines_have_ids=False, cands_are_replies=False
+) -> Optional[CandidateSet]:
+    """
+    Return the shared CandidateSet of a candidate file, reading it if needed.
+
+    The file is read again if its size or modification time changed.
+    """
+    if path is None:
+        return None
+    stat = os.stat(path)
+    stamp = (stat.st_size, stat.st_mtime)
+    key = (os.path.abspath(path), lines_have_ids, cands_are_replies)
+    with _LOCK:
+        entry = _REGISTRY.get(key)
+        if entry is None or entry[0] != stamp:
+            cands = read_candidates(path, lines_have_ids, cands_are_replies)
+            entry = _REGISTRY[key] = (stamp, CandidateSet(cands, source=key))
+    return entry[1]
+
+
+def clear():
+    """
+    Forget all the candidate sets read so far.
+    """
+    with _LOCK:
+        _REGISTRY.clear()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Versioned, memory-mapped storage for fixed candidate vectors and encodings.
+
+A store lives next to the model file and consists of two files:
+
+- ``<path>.npy``: the tensor, saved with numpy so it can be memory-mapped
+- ``<path>.json``: a manifest with the format version, a signature of whatever
+  produced the tensor (dictionary, model weights, ...) and a hash of the text
+  of every candidate, in order
+
+Stores are opened copy-on-write, so every process that loads the same store
+(including forked workers) shares the same physical pages until it modifies
+them. When the candidate file changes, only the candidates whose text is not in
+the store are recomputed; when the signature changes, the whole store is
+rebuilt.
+"""
+
+import hashlib
+import json
+import os
+from typing import Callable, List, Optional
+
+import numpy as np
+import torch
+
+STORE_VERSION = 2
+
+
+def hash_text(text: str) -> str:
+    """
+    Return the hash identifying a candidate in a store.
+    """
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def hash_state_dict(state_dict) -> str:
+    """
+    Return a content hash of a model's weights.
+    """
+    sha = hashlib.sha1()
+    for key, value in state_dict.items():
+        sha.update(key.encode('utf-8'))
+        _hash_value(sha, value)
+    return sha.hexdigest()
+
+
+def _hash_value(sha, value):
+    if isinstance(value, (tuple, list)):
+        # e.g. the packed weights of dynamically quantized layers
+        for v in value:
+            _hash_value(sha, v)
+    elif torch.is_tensor(value):
+        value = value.detach().cpu()
+        sha.update(str(value.dtype).encode('utf-8'))
+        sha.update(str(tuple(value.shape)).encode('utf-8'))
+        if value.is_quantized:
+            value = value.dequantize()
+        if value.dtype == torch.bfloat16:
+            value = value.float()
+        sha.update(value.contiguous().numpy().tobytes())
+    else:
+        sha.update(repr(value).encode('utf-8'))
+
+
+def hash_strings(*strings) -> str:
+    """
+    Combine a sequence of strings into a single signature.
+    """
+    sha = hashlib.sha1()
+    for s in strings:
+        sha.update(str(s).encode('utf-8'))
+        sha.update(b'\0')
+    return sha.hexdigest()
+
+
+class CandidateStore(object):
+    """
+    A tensor of per-candidate rows on disk, with its manifest.
+
+    :param path:
+        path of the store, without extension
+    :param dim:
+        the dimension of the tensor that indexes the candidates
+    """
+
+    def __init__(self, path: str, dim: int = 0):
+        self.path = path
+        self.dim = dim
+        self.data_path = path + '.npy'
+        self.manifest_path = path + '.json'
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.data_path) and os.path.isfile(self.manifest_path)
+
+    def read_manifest(self) -> Optional[dict]:
+        """
+        Return the manifest, or None if the store is missing or outdated.
+        """
+        if not self.exists():
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except ValueError:
+            return None
+        if manifest.get('version') != STORE_VERSION:
+            return None
+        return manifest
+
+    def load(self, manifest: dict) -> Optional[torch.Tensor]:
+        """
+        Memory-map the tensor described by ``manifest``.
+
+        Returns None if the data file does not match the manifest, e.g. because
+        another process replaced the store in the meantime.
+        """
+        if manifest is None:
+            return None
+        array = np.load(self.data_path, mmap_mode='c')
+        # checked after mapping, in case the file was replaced in between
+        if (
+            list(array.shape) != manifest['shape']
+            or self._data_id() != manifest['data_id']
+        ):
+            return None
+        return torch.from_numpy(array)
+
+    def _data_id(self, path=None) -> Optional[List[int]]:
+        # renaming keeps the inode, so this identifies the data file a manifest
+        # was written for
+        try:
+            stat = os.stat(path or self.data_path)
+        except OSError:
+            return None
+        return [stat.st_ino, stat.st_size]
+
+    def save(self, tensor: torch.Tensor, signature: str, hashes: List[str]):
+        """
+        Atomically replace the store with the given tensor.
+        """
+        tensor = tensor.detach().cpu().contiguous()
+        manifest = {
+            'version': STORE_VERSION,
+            'signature': signature,
+            'dim': self.dim,
+            'shape': list(tensor.shape),
+            'dtype': str(tensor.dtype),
+            'hashes': hashes,
+        }
+        # np.save appends .npy to any other suffix, so keep it last. the names
+        # are unique per process, for processes building the same store at once
+        tmp_data = '{}.{}.tmp.npy'.format(self.path, os.getpid())
+        tmp_manifest = '{}.{}.tmp'.format(self.manifest_path, os.getpid())
+        try:
+            np.save(tmp_data, tensor.numpy())
+            manifest['data_id'] = self._data_id(tmp_data)
+            with open(tmp_manifest, 'w', encoding='utf-8') as f:
+                json.dump(manifest, f)
+            os.replace(tmp_data, self.data_path)
+            os.replace(tmp_manifest, self.manifest_path)
+        finally:
+            for tmp in (tmp_data, tmp_manifest):
+                if os.path.isfile(tmp):
+                    os.remove(tmp)
+
+
+def _pad_to(tensor, shape, pad_value):
+    if list(tensor.shape) == list(shape):
+        return tensor
+    padded = tensor.new_full(shape, pad_value)
+    padded[tuple(slice(0, s) for s in tensor.shape)] = tensor
+    return padded
+
+
+def load_or_build(
+    store: CandidateStore,
+    signature: str,
+    hashes: List[str],
+    build_fn: Callable[[List[int]], torch.Tensor],
+    pad_value=0,
+    rebuild: bool = False,
+) -> torch.Tensor:
+    """
+    Return the tensor for the given candidates, reusing the store when possible.
+
+    :param store:
+        the store to read from and update
+    :param signature:
+        identifies everything besides the candidate text that the rows depend on.
+        A store with a different signature is rebuilt from scratch.
+    :param hashes:
+        ``hash_text`` of each candidate, in order
+    :param build_fn:
+        called with a list of candidate indices, returns their rows stacked along
+        ``store.dim``
+    :param pad_value:
+        used when the rows of the store and the new rows have different sizes,
+        e.g. for token vectors of different lengths
+    :param rebuild:
+        ignore the existing store and recompute every row
+
+    :return: a tensor memory-mapped from the (possibly updated) store
+    """
+    dim = store.dim
+    manifest = None if rebuild else store.read_manifest()
+    old = None
+    if manifest is not None and manifest['signature'] == signature:
+        old = store.load(manifest)
+    if old is not None and manifest['hashes'] == hashes:
+        return old
+
+    old_rows = {}
+    if old is not None:
+        old_rows = {h: i for i, h in enumerate(manifest['hashes'])}
+    reused = [i for i, h in enumerate(hashes) if h in old_rows]
+    missing = [i for i, h in enumerate(hashes) if h not in old_rows]
+    print(
+        "[ Updating candidate store {}: {} reused, {} to compute ]".format(
+            store.path, len(reused), len(missing)
+        )
+    )
+
+    parts = []
+    if reused:
+        src = torch.LongTensor([old_rows[hashes[i]] for i in reused])
+        parts.append((reused, old.index_select(dim, src)))
+    if missing:
+        parts.append((missing, build_fn(missing).cpu()))
+    shape = list(parts[0][1].shape)
+    for _, rows in parts[1:]:
+        shape = [max(a, b) for a, b in zip(shape, rows.shape)]
+    shape[dim] = len(hashes)
+    result = parts[0][1].new_full(shape, pad_value)
+    for indices, rows in parts:
+        row_shape = list(shape)
+        row_shape[dim] = len(indices)
+        rows = _pad_to(rows.to(result.dtype), row_shape, pad_value)
+        result.index_copy_(dim, torch.LongTensor(indices), rows)
+
+    store.save(result, signature, hashes)
+    # reopen the saved file, so the rows are shared with other processes
+    mapped = store.load(store.read_manifest())
+    return mapped if mapped is not None else result
@@ -0,0 +1,560 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+On-disk cache of parsed and pre-tokenized dialog data.
+
+Enabled with ``--dialog-cache-dir``. The first time a ``DialogTeacher`` loads a
+datafile, its episodes are written to the cache together with the token ids of
+every distinct text, label and candidate. Later runs read the episodes back
+instead of calling ``setup_data``, and ``DictionaryAgent.txt2vec`` looks the
+token ids up instead of tokenizing the same strings again.
+
+A cache is a directory with:
+
+- ``manifest.json``: the format version, the key the cache was built for, the
+  reward values and, if the tokens were computed, the signature of the
+  dictionary they were computed with
+- ``strings.npy`` and ``string_offsets.npy``: every distinct string, UTF-8
+  encoded and concatenated into a byte array
+- ``entries.npy``: one int32 row per entry, with the columns in ``COLUMNS``
+- ``refs.npy``: the string indices of the labels and candidates of the entries
+- ``tokens.npy`` and ``token_offsets.npy``: the token ids of every string, as a
+  flat int32 array
+
+All arrays are memory-mapped. Token ids are stored before truncation and without
+start and end tokens, so the cache does not depend on the truncation settings of
+the model; a dictionary only uses the tokens if its signature matches.
+
+Streamed data (``-dt train:stream`` etc.) is cached as a :class:`StreamIndex`
+instead, which never holds the whole dataset in memory:
+
+- ``manifest.json``: the format version, the key and the number of episodes and
+  examples
+- ``episodes.jsonl``: one episode per line, as a JSON list of entries
+- ``episode_offsets.npy``: the int64 byte offset of every line, and the size of
+  the file at the end
+"""
+
+import hashlib
+import json
+import os
+import sys
+import weakref
+from array import array
+from typing import List, Optional
+
+import numpy as np
+
+from parlai.utils.dialog_store import (
+    CANDS_BEGIN,
+    CANDS_END,
+    CANDS_STRING,
+    COLUMNS,
+    IMAGE,
+    LABELS_BEGIN,
+    LABELS_END,
+    NEW,
+    NONE,
+    REWARD,
+    TEXT,
+    DialogStore,
+)
+
+CACHE_VERSION = 1
+
+# tokenizers which only depend on the dictionary's options and vocabulary
+TOKENIZERS = ('re', 'split', 'space', 'bpe')
+
+# caches whose tokens may be used by dictionaries, see ``cached_tokens``
+_REGISTRY = weakref.WeakSet()
+_registry_version = 0
+
+
+def hash_file(path: str) -> str:
+    """
+    Return the sha1 of a file's contents.
+    """
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def dict_signature(dictionary) -> Optional[str]:
+    """
+    Return a signature of everything a dictionary's token ids depend on.
+
+    Returns None for tokenizers whose output depends on anything else.
+    """
+    if getattr(dictionary, 'tokenizer', None) not in TOKENIZERS:
+        return None
+    sha = hashlib.sha1()
+    parts = [
+        type(dictionary).__module__,
+        type(dictionary).__qualname__,
+        dictionary.tokenizer,
+        dictionary.lower,
+        dictionary.max_ngram_size,
+        dictionary.unk_token,
+    ]
+    if dictionary.tokenizer == 'bpe':
+        parts.append(hash_file(dictionary.bpehelper.codecs))
+    for part in parts:
+        sha.update('{}\0'.format(part).encode('utf-8'))
+    for token, index in sorted(dictionary.tok2ind.items(), key=lambda x: x[1]):
+        sha.update('{}\t{}\0'.format(index, token).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def dictionary_opt(opt):
+    """
+    Return the options of the dictionary that the model given in opt will use.
+
+    Mirrors how ``create_agent`` finds the options and the dictionary file of a
+    trained model. Returns None if there is no dictionary file yet.
+    """
+    from parlai.core.opt import load_opt_file
+
+    dict_opt = opt.copy()
+    model_file = opt.get('model_file')
+    if model_file and os.path.isfile(model_file + '.opt'):
+        dict_opt = load_opt_file(model_file + '.opt')
+        dict_opt.update(opt.get('override') or {})
+        for k, v in opt.items():
+            dict_opt.setdefault(k, v)
+        if not dict_opt.get('dict_file') or not os.path.isfile(dict_opt['dict_file']):
+            dict_opt['dict_file'] = model_file + '.dict'
+    elif not dict_opt.get('dict_file') and model_file:
+        dict_opt['dict_file'] = model_file + '.dict'
+    if not dict_opt.get('dict_file') or not os.path.isfile(dict_opt['dict_file']):
+        return None
+    return dict_opt
+
+
+def load_dictionary(dict_opt):
+    """
+    Load the dictionary of the model's agent class with the given options.
+    """
+    from parlai.core.dict import DictionaryAgent
+    from parlai.core.loader import load_agent_module
+
+    dict_class = DictionaryAgent
+    if dict_opt.get('model'):
+        model_class = load_agent_module(dict_opt['model'])
+        if hasattr(model_class, 'dictionary_class'):
+            dict_class = model_class.dictionary_class()
+    return dict_class(dict_opt)
+
+
+def file_stamp(path: str) -> List:
+    """
+    Return the absolute path, size and modification time of a file.
+    """
+    stat = os.stat(path)
+    return [os.path.abspath(path), stat.st_size, stat.st_mtime]
+
+
+class DialogCache(object):
+    """
+    The cached episodes and token ids of one datafile.
+
+    :param path:
+        directory of the cache
+    :param key:
+        identifies what the episodes were parsed from; a cache with another key
+        is rebuilt
+    """
+
+    def __init__(self, path: str, key: str):
+        self.path = path
+        self.key = key
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        self.strings = None
+        self.signature = None
+        self._index = None
+        self._tokens = None
+        self._offsets = None
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def read_manifest(self) -> Optional[dict]:
+        """
+        Return the manifest, or None if the cache is missing or outdated.
+        """
+        if not os.path.isfile(self.manifest_path):
+            return None
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except ValueError:
+            return None
+        if manifest.get('version') != CACHE_VERSION or manifest.get('key') != self.key:
+            return None
+        return manifest
+
+    def _save_array(self, name, array):
+        # np.save appends .npy to any other suffix, so keep it last
+        tmp = self._file(name + '.tmp.npy')
+        np.save(tmp, array)
+        os.replace(tmp, self._file(name + '.npy'))
+
+    def _save_manifest(self, manifest):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.manifest_path)
+
+    def load_or_build(self, episodes, opt) -> list:
+        """
+        Return the cached episodes, or parse, cache and return them.
+
+        Episodes read from the cache are returned as a ``DialogStore``.
+
+        :param episodes:
+            iterable over the episodes of the datafile, as read by
+            ``DialogData``. It is not consumed if the cache is up to date.
+        :param opt:
+            options used to load the model's dictionary, if the token ids need
+            to be computed
+        """
+        manifest = self.read_manifest()
+        data = None
+        if manifest is not None:
+            data = self._load_episodes(manifest)
+        if data is None:
+            data = list(episodes)
+            try:
+                manifest = self._save_episodes(data)
+            except _Uncacheable as e:
+                print('[ Not caching dialog data: {} ]'.format(e))
+                return data
+        else:
+            print('[ loaded dialog data from cache {} ]'.format(self.path))
+
+        dict_opt = dictionary_opt(opt)
+        if dict_opt is not None:
+            stamp = file_stamp(dict_opt['dict_file'])
+            if manifest.get('dict_stamp') != stamp:
+                manifest = self._save_tokens(manifest, load_dictionary(dict_opt), stamp)
+        if manifest.get('signature') is not None:
+            self._load_tokens(manifest)
+            register(self)
+        return data
+
+    def _load_strings(self, manifest):
+        blob = np.load(self._file('strings.npy'), mmap_mode='r')
+        offsets = np.load(self._file('string_offsets.npy')).tolist()
+        if len(offsets) != manifest['num_strings'] + 1:
+            return None
+        return [
+            sys.intern(blob[start:end].tobytes().decode('utf-8'))
+            for start, end in zip(offsets, offsets[1:])
+        ]
+
+    def _load_episodes(self, manifest):
+        try:
+            strings = self._load_strings(manifest)
+            entries = np.load(self._file('entries.npy'), mmap_mode='r')
+            refs = np.load(self._file('refs.npy'), mmap_mode='r')
+        except (OSError, ValueError):
+            return None
+        if strings is None or len(entries) != manifest['num_entries']:
+            return None
+        self.strings = strings
+        begins = np.flatnonzero(entries[:, NEW]).astype(np.int64)
+        begins = np.append(begins, len(entries))
+        return DialogStore.from_columns(
+            strings,
+            manifest['rewards'],
+            array('i', np.ascontiguousarray(entries, dtype=np.int32).tobytes()),
+            array('i', np.asarray(refs, dtype=np.int32).tobytes()),
+            array('q', begins.tobytes()),
+        )
+
+    def _save_episodes(self, episodes):
+        strings = {}
+        rewards = []
+        reward_idx = {}
+        refs = []
+        entries = []
+
+        def add_string(s):
+            if type(s) is not str:
+                raise _Uncacheable('{!r} is not a string'.format(s))
+            return strings.setdefault(s, len(strings))
+
+        def add_refs(values):
+            begin = len(refs)
+            refs.extend(add_string(s) for s in values)
+            return begin, len(refs)
+
+        for episode in episodes:
+            for i, entry in enumerate(episode):
+                row = [
+                    int(i == 0),
+                    len(entry),
+                    NONE,
+                    NONE,
+                    NONE,
+                    NONE,
+                    NONE,
+                    NONE,
+                    NONE,
+                ]
+                if len(entry) > 0 and entry[0] is not None:
+                    row[TEXT] = add_string(entry[0])
+                if len(entry) > 1 and entry[1] is not None:
+                    row[LABELS_BEGIN], row[LABELS_END] = add_refs(entry[1])
+                if len(entry) > 2 and entry[2] is not None:
+                    reward = entry[2]
+                    if type(reward) not in (str, int, float, bool):
+                        raise _Uncacheable('reward {!r}'.format(reward))
+                    # 0 and 0.0 are equal but are displayed differently
+                    reward_key = (type(reward), reward)
+                    if reward_key not in reward_idx:
+                        reward_idx[reward_key] = len(rewards)
+                        rewards.append(reward)
+                    row[REWARD] = reward_idx[reward_key]
+                if len(entry) > 3 and entry[3] is not None:
+                    if type(entry[3]) is str:
+                        row[CANDS_BEGIN] = CANDS_STRING
+                        row[CANDS_END] = add_string(entry[3])
+                    else:
+                        row[CANDS_BEGIN], row[CANDS_END] = add_refs(entry[3])
+                if len(entry) > 4 and entry[4] is not None:
+                    row[IMAGE] = add_string(entry[4])
+                entries.append(row)
+
+        encoded = [s.encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+
+        os.makedirs(self.path, exist_ok=True)
+        self._save_array(
+            'entries', np.array(entries, dtype=np.int32).reshape(-1, len(COLUMNS))
+        )
+        self._save_array('refs', np.array(refs, dtype=np.int32))
+        self._save_array('string_offsets', offsets)
+        self._save_array('strings', np.frombuffer(b''.join(encoded), dtype=np.uint8))
+        manifest = {
+            'version': CACHE_VERSION,
+            'key': self.key,
+            'num_entries': len(entries),
+            'num_strings': len(strings),
+            'rewards': rewards,
+            'signature': None,
+            'dict_stamp': None,
+        }
+        self._save_manifest(manifest)
+        self.strings = list(strings)
+        return manifest
+
+    def _save_tokens(self, manifest, dictionary, stamp):
+        signature = dict_signature(dictionary)
+        manifest = dict(manifest, signature=signature, dict_stamp=stamp)
+        if signature is not None:
+            if self.strings is None:
+                self.strings = self._load_strings(manifest)
+            vecs = dictionary.txt2vec_batch(self.strings, np.ndarray)
+            offsets = np.zeros(len(vecs) + 1, dtype=np.int64)
+            np.cumsum([len(v) for v in vecs], out=offsets[1:])
+            tokens = np.concatenate(vecs) if vecs else np.zeros(0)
+            self._save_array('tokens', tokens.astype(np.int32))
+            self._save_array('token_offsets', offsets)
+        self._save_manifest(manifest)
+        return manifest
+
+    def _load_tokens(self, manifest):
+        if self.strings is None:
+            self.strings = self._load_strings(manifest)
+        self._tokens = np.load(self._file('tokens.npy'), mmap_mode='r')
+        self._offsets = np.load(self._file('token_offsets.npy')).tolist()
+        self._index = {s: i for i, s in enumerate(self.strings)}
+        self.signature = manifest['signature']
+
+    def get(self, text: str) -> Optional[List[int]]:
+        """
+        Return the token ids of a string, or None if it is not in the cache.
+        """
+        i = self._index.get(text)
+        if i is None:
+            return None
+        return self._tokens[self._offsets[i] : self._offsets[i + 1]].tolist()
+
+
+class StreamIndex(DialogCache):
+    """
+    The episodes of a streamed datafile, stored so that any of them can be read
+    without reading the others.
+
+    Each episode is one JSON line of ``episodes.jsonl`` and ``episode(i)`` reads
+    it with a single positional read at its offset, so readers can take
+    disjoint or shuffled parts of the data. Reads do not move a shared file
+    position, so threads and forked processes can share the index.
+    """
+
+    def __init__(self, path: str, key: str):
+        super().__init__(path, key)
+        self.num_episodes = None
+        self.num_examples = None
+        self._episode_offsets = None
+        self._fd = None
+
+    def load_or_build(self, episodes, opt=None) -> bool:
+        """
+        Open the index, writing it from episodes first if it is missing.
+
+        :param episodes:
+            iterable over the episodes of the datafile, as read by
+            ``DialogData``. It is not consumed if the index is up to date.
+
+        :return: whether the index can be used.
+        """
+        manifest = self.read_manifest()
+        if manifest is None:
+            try:
+                manifest = self._save_episodes(episodes)
+            except _Uncacheable as e:
+                print('[ Not indexing streamed dialog data: {} ]'.format(e))
+                return False
+        else:
+            print('[ loaded stream index {} ]'.format(self.path))
+        self.num_episodes = manifest['num_episodes']
+        self.num_examples = manifest['num_examples']
+        self._episode_offsets = np.load(
+            self._file('episode_offsets.npy'), mmap_mode='r'
+        )
+        return True
+
+    def _save_episodes(self, episodes):
+        os.makedirs(self.path, exist_ok=True)
+        # several processes may build the same index, the last one wins
+        tmp = self._file('episodes.{}.tmp'.format(os.getpid()))
+        offsets = array('q', [0])
+        num_examples = 0
+        try:
+            with open(tmp, 'wb') as f:
+                for episode in episodes:
+                    line = json.dumps(
+                        [_entry_to_json(entry) for entry in episode],
+                        ensure_ascii=False,
+                    )
+                    line = line.encode('utf-8') + b'\n'
+                    f.write(line)
+                    offsets.append(offsets[-1] + len(line))
+                    num_examples += len(episode)
+            os.replace(tmp, self._file('episodes.jsonl'))
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+        self._save_array('episode_offsets', np.frombuffer(offsets, dtype=np.int64))
+        manifest = {
+            'version': CACHE_VERSION,
+            'key': self.key,
+            'num_episodes': len(offsets) - 1,
+            'num_examples': num_examples,
+        }
+        self._save_manifest(manifest)
+        return manifest
+
+    def episode(self, i: int) -> tuple:
+        """
+        Return the i-th episode, as a tuple of entries.
+        """
+        if self._fd is None:
+            self._fd = os.open(self._file('episodes.jsonl'), os.O_RDONLY)
+        start = int(self._episode_offsets[i])
+        end = int(self._episode_offsets[i + 1])
+        line = os.pread(self._fd, end - start, start)
+        return tuple(_entry_from_json(entry) for entry in json.loads(line))
+
+    def shuffled(self, seed) -> np.ndarray:
+        """
+        Return a random order of the episodes, the same for the same seed.
+        """
+        return np.random.RandomState(seed).permutation(self.num_episodes)
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def _entry_to_json(entry):
+    # tuples come back as lists, so only allow them where strings are expected
+    if len(entry) > 2 and entry[2] is not None:
+        if type(entry[2]) not in (str, int, float, bool):
+            raise _Uncacheable('reward {!r}'.format(entry[2]))
+    for i, value in enumerate(entry):
+        if value is None or i == 2:
+            continue
+        values = value if i in (1, 3) and type(value) is not str else (value,)
+        for s in values:
+            if type(s) is not str:
+                raise _Uncacheable('{!r} is not a string'.format(s))
+    return entry
+
+
+def _strings(values):
+    if values is None:
+        return None
+    if type(values) is str:
+        # candidates given as "same as last time"
+        return sys.intern(values)
+    return tuple(sys.intern(s) for s in values)
+
+
+def _entry_from_json(entry):
+    fields = [None if entry[0] is None else sys.intern(entry[0])]
+    if len(entry) > 1:
+        fields.append(_strings(entry[1]))
+    if len(entry) > 2:
+        fields.append(entry[2])
+    if len(entry) > 3:
+        fields.append(_strings(entry[3]))
+    if len(entry) > 4:
+        fields.append(None if entry[4] is None else sys.intern(entry[4]))
+    return tuple(fields)
+
+
+class _Uncacheable(Exception):
+    pass
+
+
+def register(cache: DialogCache):
+    """
+    Make the tokens of a cache available to dictionaries with its signature.
+    """
+    global _registry_version
+    _REGISTRY.add(cache)
+    _registry_version += 1
+
+
+def cached_tokens(dictionary, text) -> Optional[List[int]]:
+    """
+    Return the cached token ids of text for this dictionary, if any.
+
+    The dictionary's signature is computed again whenever a cache is registered.
+    Dictionaries call ``dictionary._token_caches = ()`` when their vocabulary
+    changes, so they never use tokens computed with an older vocabulary.
+    """
+    if not _REGISTRY or type(text) is not str:
+        return None
+    if getattr(dictionary, '_token_cache_version', None) != _registry_version:
+        signature = dict_signature(dictionary)
+        dictionary._token_caches = tuple(
+            c
+            for c in list(_REGISTRY)
+            if signature is not None and c.signature == signature
+        )
+        dictionary._token_cache_version = _registry_version
+    for cache in dictionary._token_caches:
+        ids = cache.get(text)
+        if ids is not None:
+            return ids
+    return None
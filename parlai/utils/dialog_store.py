@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+In-memory columnar storage of dialog data.
+
+A :class:`DialogStore` holds the episodes of a ``DialogData`` in a few flat
+integer arrays instead of nested tuples. Every distinct string is stored once
+and entries refer to their text, labels and candidates by index; a list of
+labels or candidates that occurs several times, like the fixed candidates
+given with every example, is stored once too. Episodes are read through
+:class:`Episode` views, and their entries are only turned back into tuples
+when they are read.
+
+The columns of an entry are the ones in ``COLUMNS``, which the on-disk cache in
+:mod:`parlai.utils.dialog_cache` uses as well.
+"""
+
+from array import array
+
+COLUMNS = (
+    'new_episode',
+    'num_fields',
+    'text',
+    'labels_begin',
+    'labels_end',
+    'reward',
+    'cands_begin',
+    'cands_end',
+    'image',
+)
+(
+    NEW,
+    NUM_FIELDS,
+    TEXT,
+    LABELS_BEGIN,
+    LABELS_END,
+    REWARD,
+    CANDS_BEGIN,
+    CANDS_END,
+    IMAGE,
+) = range(len(COLUMNS))
+NUM_COLUMNS = len(COLUMNS)
+# a missing value, or candidates given as a single string ("same as last time")
+NONE = -1
+CANDS_STRING = -2
+
+
+class Episode(object):
+    """
+    A read-only view of one episode of a :class:`DialogStore`.
+
+    Behaves like the tuple of entry tuples ``DialogData`` used to hold.
+    """
+
+    __slots__ = ('_store', '_begin', '_end')
+
+    def __init__(self, store, begin, end):
+        self._store = store
+        self._begin = begin
+        self._end = end
+
+    def __len__(self):
+        return self._end - self._begin
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return tuple(self)[i]
+        size = self._end - self._begin
+        if i < 0:
+            i += size
+        if not 0 <= i < size:
+            raise IndexError('entry index out of range')
+        return self._store.entry(self._begin + i)
+
+    def __iter__(self):
+        for i in range(self._begin, self._end):
+            yield self._store.entry(i)
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None  # type: ignore
+
+    def __repr__(self):
+        return 'Episode({!r})'.format(tuple(self))
+
+
+class DialogStore(object):
+    """
+    Columnar, interned storage of dialog episodes.
+
+    Episodes are added with ``append`` as tuples of entries in the format
+    produced by ``DialogData._read_episode``, and read back by index.
+    """
+
+    def __init__(self):
+        self.strings = []
+        self.rewards = []
+        self.entries = array('i')
+        self.refs = array('i')
+        self.episode_begins = array('q', [0])
+        self._string_ids = {}
+        self._reward_ids = {}
+        self._ref_ids = {}
+
+    @classmethod
+    def from_columns(cls, strings, rewards, entries, refs, episode_begins):
+        """
+        Wrap existing columns, e.g. the ones of an on-disk cache.
+
+        :param entries:
+            ``array('i')`` with ``NUM_COLUMNS`` values per entry
+        :param refs:
+            ``array('i')`` of string indices referred to by the entries
+        :param episode_begins:
+            ``array('q')`` with the index of the first entry of each episode,
+            and the number of entries at the end
+        """
+        store = cls()
+        store.strings = strings
+        store.rewards = rewards
+        store.entries = entries
+        store.refs = refs
+        store.episode_begins = episode_begins
+        store.freeze()
+        return store
+
+    def freeze(self):
+        """
+        Free the lookup tables only needed to append episodes.
+        """
+        self._string_ids = None
+        self._reward_ids = None
+        self._ref_ids = None
+
+    def _string(self, s):
+        i = self._string_ids.get(s)
+        if i is None:
+            i = self._string_ids[s] = len(self.strings)
+            self.strings.append(s)
+        return i
+
+    def _reward(self, reward):
+        # 0 and 0.0 are equal but are displayed differently
+        try:
+            key = (type(reward), reward)
+            i = self._reward_ids.get(key)
+        except TypeError:
+            key = i = None
+        if i is None:
+            i = len(self.rewards)
+            self.rewards.append(reward)
+            if key is not None:
+                self._reward_ids[key] = i
+        return i
+
+    def _ref_range(self, values):
+        ids = tuple(self._string(s) for s in values)
+        span = self._ref_ids.get(ids)
+        if span is None:
+            begin = len(self.refs)
+            self.refs.extend(ids)
+            span = self._ref_ids[ids] = (begin, len(self.refs))
+        return span
+
+    def append(self, episode):
+        """
+        Add an episode, given as a sequence of entry tuples.
+        """
+        if self._string_ids is None:
+            raise RuntimeError('Cannot append to a frozen DialogStore')
+        for i, entry in enumerate(episode):
+            row = [int(i == 0), len(entry)] + [NONE] * (NUM_COLUMNS - 2)
+            if len(entry) > 0 and entry[0] is not None:
+                row[TEXT] = self._string(entry[0])
+            if len(entry) > 1 and entry[1] is not None:
+                row[LABELS_BEGIN], row[LABELS_END] = self._ref_range(entry[1])
+            if len(entry) > 2 and entry[2] is not None:
+                row[REWARD] = self._reward(entry[2])
+            if len(entry) > 3 and entry[3] is not None:
+                if type(entry[3]) is str:
+                    row[CANDS_BEGIN] = CANDS_STRING
+                    row[CANDS_END] = self._string(entry[3])
+                else:
+                    row[CANDS_BEGIN], row[CANDS_END] = self._ref_range(entry[3])
+            if len(entry) > 4 and entry[4] is not None:
+                row[IMAGE] = self._string(entry[4])
+            self.entries.extend(row)
+        self.episode_begins.append(len(self.entries) // NUM_COLUMNS)
+
+    def num_examples(self):
+        return len(self.entries) // NUM_COLUMNS
+
+    def entry(self, i):
+        """
+        Return the i-th entry of the store as a tuple.
+        """
+        base = i * NUM_COLUMNS
+        (
+            _,
+            num_fields,
+            text,
+            labels_begin,
+            labels_end,
+            reward,
+            cands_begin,
+            cands_end,
+            image,
+        ) = self.entries[base : base + NUM_COLUMNS]
+        if num_fields == 0:
+            return ()
+        string = self.strings.__getitem__
+        fields = [None if text == NONE else string(text)]
+        if num_fields > 1:
+            if labels_begin == NONE:
+                fields.append(None)
+            else:
+                fields.append(tuple(map(string, self.refs[labels_begin:labels_end])))
+        if num_fields > 2:
+            fields.append(None if reward == NONE else self.rewards[reward])
+        if num_fields > 3:
+            if cands_begin == NONE:
+                fields.append(None)
+            elif cands_begin == CANDS_STRING:
+                fields.append(string(cands_end))
+            else:
+                fields.append(tuple(map(string, self.refs[cands_begin:cands_end])))
+        if num_fields > 4:
+            fields.append(None if image == NONE else string(image))
+        return tuple(fields)
+
+    def __len__(self):
+        return len(self.episode_begins) - 1
+
+    def __getitem__(self, i):
+        size = len(self.episode_begins) - 1
+        if i < 0:
+            i += size
+        if not 0 <= i < size:
+            raise IndexError('episode index out of range')
+        return Episode(self, self.episode_begins[i], self.episode_begins[i + 1])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __eq__(self, other):
+        try:
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        except TypeError:
+            return NotImplemented
+
+    __hash__ = None  # type: ignore
@@ -9,13 +9,16 @@ File for miscellaneous utility functions and constants.
 
 from collections import deque
 import math
+import os
 import random
+import threading
 import time
 from typing import Union, Optional, Set, Any, Dict, List
 import warnings
 import json
 
 from parlai.core.message import Message
+from parlai.utils.candidate_registry import read_candidates
 
 try:
     import torch
@@ -119,35 +122,14 @@ def load_cands(path, lines_have_ids=False, cands_are_replies=False):
 
     Every example will include these as candidates. The true labels for a specific
     example are also added to this set, so that it's possible to get the right answer.
+
+    Returns a new list with every candidate of the file, repeated ones included.
+    Teachers share one de-duplicated set per file instead, see
+    ``parlai.utils.candidate_registry.get_candidates``.
     """
     if path is None:
         return None
-    cands = []
-    cnt = 0
-    with open(path) as read:
-        for line in read:
-            line = line.strip().replace('\\n', '\n')
-            if len(line) > 0:
-                cnt = cnt + 1
-                # If lines are numbered we strip them of numbers.
-                if cnt == 1 and line[0:2] == '1 ':
-                    lines_have_ids = True
-                # If tabs then the label_candidates are all the replies.
-                if '\t' in line and not cands_are_replies:
-                    cands_are_replies = True
-                    cands = []
-                if lines_have_ids:
-                    space_idx = line.find(' ')
-                    line = line[space_idx + 1 :]
-                    if cands_are_replies:
-                        sp = line.split('\t')
-                        if len(sp) > 1 and sp[1] != '':
-                            cands.append(sp[1])
-                    else:
-                        cands.append(line)
-                else:
-                    cands.append(line)
-    return cands
+    return read_candidates(path, lines_have_ids, cands_are_replies)
 
 
 class Predictor(object):
@@ -308,6 +290,120 @@ class TimeLogger:
         return text, log
 
 
+class _NullStage(object):
+    """
+    Stage used while timing is disabled; does nothing.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage(object):
+    __slots__ = ('timer', 'name', 'start', 'child_time')
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        timer = self.timer
+        timer._sync()
+        timer._local.stack.append(self)
+        self.child_time = 0
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        timer = self.timer
+        timer._sync()
+        elapsed = time.perf_counter() - self.start
+        local = timer._local
+        local.stack.pop()
+        if local.stack:
+            local.stack[-1].child_time += elapsed
+        times = local.times
+        times[self.name] = times.get(self.name, 0) + elapsed - self.child_time
+        if timer.events is not None:
+            timer.events.append((self.name, self.start, elapsed, threading.get_ident()))
+        return False
+
+
+class StageTimer(object):
+    """
+    Time named stages of processing, e.g. vectorizing or scoring a batch.
+
+    Use ``with timer.stage(name):`` around each stage. Stages may nest; the time
+    of a stage excludes the stages inside it, so the times of a batch add up to
+    the time spent in all stages. Times accumulate per thread until ``pop``.
+    When disabled, ``stage`` returns a shared no-op context manager.
+
+    :param enabled:
+        whether to time stages at all
+    :param sync_cuda:
+        synchronize CUDA before reading the clock, so that asynchronous kernels
+        are counted in the stage that launched them
+    :param max_events:
+        number of most recent stages kept for ``save_trace``; 0 keeps none
+    """
+
+    _NULL = _NullStage()
+
+    def __init__(self, enabled=True, sync_cuda=False, max_events=0):
+        self.enabled = enabled
+        self.sync_cuda = sync_cuda
+        self.events = deque(maxlen=max_events) if max_events > 0 else None
+        self._local = threading.local()
+
+    def stage(self, name):
+        """
+        Return a context manager timing the stage ``name``.
+        """
+        if not self.enabled:
+            return self._NULL
+        local = self._local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.times = {}
+        return _Stage(self, name)
+
+    def pop(self):
+        """
+        Return the seconds spent in each stage by this thread since the last call.
+        """
+        times = getattr(self._local, 'times', None)
+        if not times:
+            return {}
+        self._local.times = {}
+        return times
+
+    def save_trace(self, path):
+        """
+        Write the recorded stages as a Chrome trace (chrome://tracing).
+        """
+        pid = os.getpid()
+        events = [
+            {
+                'name': name,
+                'ph': 'X',
+                'ts': start * 1e6,
+                'dur': elapsed * 1e6,
+                'pid': pid,
+                'tid': tid,
+            }
+            for name, start, elapsed, tid in list(self.events or ())
+        ]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events}, f)
+
+    def _sync(self):
+        if self.sync_cuda:
+            torch.cuda.synchronize()
+
+
 class AttrDict(dict):
     """
     Helper class to have a dict-like object with dot access.
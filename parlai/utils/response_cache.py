@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Persistent cache of ranked responses, backed by SQLite.
+
+Every entry is stored under a signature identifying the model weights, the
+candidate set and the ranking options it was produced with. Entries with another
+signature are never returned, so replacing the model or the candidates
+invalidates the cache without any manual step.
+
+Entries also belong to a namespace, e.g. a model file, candidate file and
+ranking options. Pruning only drops the stale entries of one namespace, so
+agents with different options can share a file without deleting each other's
+entries.
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class ResponseCache(object):
+    """
+    Map contexts to their ranked candidates and scores.
+
+    The database can be shared by several threads and processes.
+
+    :param path:
+        the SQLite file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            columns = [
+                row[1] for row in self._conn.execute('PRAGMA table_info(responses)')
+            ]
+            if columns and 'namespace' not in columns:
+                # written by an older version, whose entries cannot be pruned
+                self._conn.execute('DROP TABLE responses')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS responses ('
+                'namespace TEXT, signature TEXT, key TEXT, text_candidates TEXT, '
+                'sorted_scores BLOB, PRIMARY KEY (signature, key))'
+            )
+            self._conn.execute(
+                'CREATE INDEX IF NOT EXISTS responses_namespace ON responses '
+                '(namespace, signature)'
+            )
+
+    def get_many(
+        self, signature: str, keys: List[str]
+    ) -> Dict[str, Tuple[List[str], Optional[np.ndarray]]]:
+        """
+        Return the cached (text_candidates, sorted_scores) of the given keys.
+
+        Keys without an entry are left out of the result.
+        """
+        unique = list(set(keys))
+        placeholders = ','.join('?' * len(unique))
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT key, text_candidates, sorted_scores FROM responses '
+                'WHERE signature = ? AND key IN ({})'.format(placeholders),
+                [signature] + unique,
+            ).fetchall()
+        result = {}
+        for key, text_candidates, sorted_scores in rows:
+            if sorted_scores is not None:
+                sorted_scores = np.frombuffer(sorted_scores, dtype=np.float32)
+            result[key] = (json.loads(text_candidates), sorted_scores)
+        return result
+
+    def put_many(
+        self,
+        signature: str,
+        entries: List[Tuple[str, List[str], Optional[np.ndarray]]],
+        namespace: str = '',
+    ):
+        """
+        Store (key, text_candidates, sorted_scores) entries.
+        """
+        rows = []
+        for key, text_candidates, sorted_scores in entries:
+            if sorted_scores is not None:
+                sorted_scores = np.asarray(sorted_scores, dtype=np.float32).tobytes()
+            rows.append(
+                (namespace, signature, key, json.dumps(text_candidates), sorted_scores)
+            )
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)', rows
+            )
+
+    def prune(self, signature: str, namespace: str = ''):
+        """
+        Delete the entries of the namespace not made with the given signature.
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM responses WHERE namespace = ? AND signature != ?',
+                (namespace, signature),
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Lightweight runtime for poly-encoders exported with TorchScript.
+
+An exported model is a single file written by ``torch.jit.save``. Besides the
+traced context encoder and scoring function, it holds the fixed candidate
+encodings as a buffer, and the candidate texts and dictionary as extra files.
+Loading it only requires torch; none of the agent, dictionary or world
+machinery is imported.
+
+See ``parlai/scripts/export_polyencoder.py`` to export a model.
+"""
+
+import json
+import re
+from typing import List, Tuple
+
+import torch
+
+try:
+    from subword_nmt import apply_bpe
+
+    BPE_INSTALLED = True
+except ImportError:
+    BPE_INSTALLED = False
+
+# keep in sync with parlai.core.dict
+RETOK = re.compile(r'\w+|[^\w\s]|\n', re.UNICODE)
+BPE_SPLITTER = re.compile(r'\w+|[^\w\s]', re.UNICODE)
+
+EXTRA_FILES = ('dict.json', 'candidates.json')
+SUPPORTED_TOKENIZERS = ('re', 'split', 'space', 'bpe')
+
+
+class ScriptedTokenizer(object):
+    """
+    Converts text to token ids the same way as the exporting DictionaryAgent.
+
+    :param config:
+        the dictionary as saved by the exporter: the tokenizer name, whether to
+        lowercase, the special tokens, ``tok2ind`` and the BPE codecs if any
+    """
+
+    def __init__(self, config: dict):
+        if config['tokenizer'] not in SUPPORTED_TOKENIZERS:
+            raise ValueError(
+                'Tokenizer {} cannot be exported'.format(config['tokenizer'])
+            )
+        self.tokenizer = config['tokenizer']
+        self.lower = config['lower']
+        self.tok2ind = config['tok2ind']
+        self.unk_idx = self.tok2ind.get(config['unk_token'])
+        self.start_idx = self.tok2ind[config['start_token']]
+        self.end_idx = self.tok2ind[config['end_token']]
+        self.null_idx = self.tok2ind[config['null_token']]
+        self.truncate = config['truncate']
+        self.bpe = None
+        if self.tokenizer == 'bpe':
+            if not BPE_INSTALLED:
+                raise RuntimeError(
+                    "Please run \"pip install 'git+https://github.com/rsennrich"
+                    "/subword-nmt.git#egg=subword-nmt'\""
+                )
+            self.bpe = apply_bpe.BPE(config['bpe_codecs'].splitlines(True))
+
+    def tokenize(self, text: str) -> List[str]:
+        if self.lower:
+            text = text.lower()
+        if self.tokenizer == 're':
+            return RETOK.findall(text)
+        if self.tokenizer == 'space':
+            return text.strip().split(' ')
+        if self.tokenizer == 'split':
+            for punct in '.,;:!?':
+                text = text.replace(punct, ' {} '.format(punct))
+            return text.split()
+        text = text.replace('\n', ' __newln__ ')
+        return self.bpe.segment_tokens(BPE_SPLITTER.findall(text))
+
+    def txt2vec(self, text: str) -> List[int]:
+        """
+        Return the context vector of text, truncated and with start/end tokens.
+        """
+        vec = [self.tok2ind.get(token, self.unk_idx) for token in self.tokenize(text)]
+        if self.truncate is not None and len(vec) > self.truncate:
+            vec = vec[-self.truncate :]
+        return [self.start_idx] + vec + [self.end_idx]
+
+    def batchify(self, texts: List[str]) -> torch.LongTensor:
+        """
+        Return the padded token ids of a batch of texts.
+        """
+        vecs = [self.txt2vec(text) for text in texts]
+        batch = torch.full(
+            (len(vecs), max(len(v) for v in vecs)), self.null_idx, dtype=torch.long
+        )
+        for i, vec in enumerate(vecs):
+            batch[i, : len(vec)] = torch.LongTensor(vec)
+        return batch
+
+
+class ScriptedRanker(object):
+    """
+    Rank the fixed candidates of an exported poly-encoder.
+
+    :param path:
+        the file written by the exporter
+    :param num_threads:
+        if > 0, the number of threads torch uses for intra-op parallelism
+    """
+
+    def __init__(self, path: str, num_threads: int = -1):
+        if num_threads > 0:
+            torch.set_num_threads(num_threads)
+        extra_files = {name: '' for name in EXTRA_FILES}
+        self.module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+        self.module.eval()
+        self.tokenizer = ScriptedTokenizer(json.loads(extra_files['dict.json']))
+        self.candidates = json.loads(extra_files['candidates.json'])
+
+    def score(self, texts: List[str]) -> torch.Tensor:
+        """
+        Return the scores of every fixed candidate, one row per text.
+        """
+        with torch.no_grad():
+            return self.module(self.tokenizer.batchify(texts))
+
+    def rank(self, texts: List[str], k: int = 1) -> List[List[Tuple[str, float]]]:
+        """
+        Return the top-k (candidate, score) pairs of each text.
+        """
+        scores, ranks = self.score(texts).topk(min(k, len(self.candidates)), 1)
+        return [
+            [(self.candidates[r], s) for r, s in zip(row_ranks, row_scores)]
+            for row_ranks, row_scores in zip(ranks.tolist(), scores.tolist())
+        ]
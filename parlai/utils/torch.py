@@ -241,9 +241,11 @@
 Utility methods for dealing with torch code.
 """
 
-from typing import Union, Optional, Tuple, Any, List, Sized, TypeVar
+from typing import Union, Optional, Tuple, Any, List, Sized, TypeVar, Hashable
 import itertools
-from collections import namedtuple
+import threading
+import time
+from collections import namedtuple, OrderedDict
 import parlai.utils.logging as logging
 
 
@@ -523,6 +525,308 @@ def trainable_parameters(model: torch.nn.Module) -> int:
     return sum(p.numel() for p in model.parameters() if p.requires_grad)
 
 
+class TensorCache(object):
+    """
+    Thread-safe LRU cache of tuples of tensors, bounded by memory.
+
+    Entries are evicted in least-recently-used order once the tensors stored
+    exceed ``max_mb`` megabytes, and are considered missing once they are older
+    than ``ttl`` seconds.
+
+    :param max_mb:
+        maximum total size of the cached tensors, in megabytes
+    :param ttl:
+        maximum age of an entry in seconds, or a value <= 0 for no expiry
+    """
+
+    def __init__(self, max_mb: float, ttl: float = -1):
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.num_bytes = 0
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _size(tensors) -> int:
+        return sum(t.element_size() * t.numel() for t in tensors)
+
+    def get(self, key) -> Optional[Tuple[torch.Tensor, ...]]:
+        """
+        Return the tensors stored under key, or None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            tensors, created = entry
+            if self.ttl > 0 and time.time() - created > self.ttl:
+                del self._entries[key]
+                self.num_bytes -= self._size(tensors)
+                return None
+            self._entries.move_to_end(key)
+            return tensors
+
+    def put(self, key, tensors: Tuple[torch.Tensor, ...]):
+        """
+        Store tensors under key, evicting old entries if needed.
+
+        The tensors are cloned so that they do not keep the storage of a larger
+        batch alive.
+        """
+        tensors = tuple(t.detach().clone() for t in tensors)
+        size = self._size(tensors)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.num_bytes -= self._size(self._entries.pop(key)[0])
+            self._entries[key] = (tensors, time.time())
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, (old, _) = self._entries.popitem(last=False)
+                self.num_bytes -= self._size(old)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+
+class QuantizedRows(object):
+    """
+    Int8 copy of a float tensor, with one scale per row of the last dimension.
+
+    Uses a quarter of the memory of the float32 tensor. Indexing returns another
+    QuantizedRows, so that only the selected rows need to be converted back to
+    floats with ``dequantize()``.
+
+    :param tensor:
+        the float tensor to quantize
+    """
+
+    def __init__(self, tensor: Optional[torch.Tensor] = None):
+        if tensor is None:
+            return
+        tensor = tensor.detach().float()
+        scale = tensor.abs().max(dim=-1, keepdim=True)[0] / 127
+        scale = scale.clamp(min=1e-12)
+        self.data = (tensor / scale).round_().clamp_(-127, 127).to(torch.int8)
+        self.scale = scale
+
+    @classmethod
+    def _wrap(cls, data: torch.Tensor, scale: torch.Tensor) -> 'QuantizedRows':
+        rows = cls()
+        rows.data = data
+        rows.scale = scale
+        return rows
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self.data.dtype
+
+    @property
+    def device(self) -> torch.device:
+        return self.data.device
+
+    @property
+    def shape(self) -> torch.Size:
+        return self.data.shape
+
+    def size(self, dim: Optional[int] = None):
+        return self.data.size() if dim is None else self.data.size(dim)
+
+    def dim(self) -> int:
+        return self.data.dim()
+
+    def num_bytes(self) -> int:
+        return (
+            self.data.element_size() * self.data.numel()
+            + self.scale.element_size() * self.scale.numel()
+        )
+
+    def __getitem__(self, key) -> 'QuantizedRows':
+        if isinstance(key, tuple) and len(key) >= self.data.dim():
+            raise IndexError('QuantizedRows can only be indexed by rows')
+        return self._wrap(self.data[key], self.scale[key])
+
+    def to(self, *args, **kwargs) -> 'QuantizedRows':
+        return self._wrap(self.data.to(*args, **kwargs), self.scale.to(*args, **kwargs))
+
+    def share_memory_(self) -> 'QuantizedRows':
+        self.data.share_memory_()
+        self.scale.share_memory_()
+        return self
+
+    def dequantize(self, dtype: torch.dtype = torch.float) -> torch.Tensor:
+        """
+        Return the rows as a float tensor of the given dtype.
+        """
+        return (self.data.float() * self.scale).to(dtype)
+
+
+class InternedVectors(object):
+    """
+    Token vectors stored once per distinct key, in a single flat tensor.
+
+    Vectors are appended to a growing buffer and never moved, so the vector of a
+    key is a view into the buffer. Batches of rows are padded with one gather
+    instead of copying every vector into the output.
+
+    Thread-safe, so it can be shared between the copies of an agent.
+
+    :param dtype:
+        dtype of the stored tokens; rows are always returned as LongTensors,
+        which only copies if this is not ``torch.long``
+    """
+
+    def __init__(self, dtype: torch.dtype = torch.long):
+        self.rows: dict = {}
+        # (offset, length) of every row, to slice without indexing tensors
+        self._spans: List[Tuple[int, int]] = []
+        self._tokens = torch.zeros(1024, dtype=dtype)
+        self._offsets = torch.zeros(256, dtype=torch.long)
+        self._lengths = torch.zeros(256, dtype=torch.long)
+        self._size = 0
+        self._lock = threading.Lock()
+        # name => (keys, rows, vecs) of the sequences given to intern_shared
+        self._shared: dict = {}
+
+    def __len__(self):
+        return len(self.rows)
+
+    @staticmethod
+    def _grow(tensor: torch.Tensor, size: int) -> torch.Tensor:
+        if size <= tensor.size(0):
+            return tensor
+        grown = tensor.new_zeros(max(size, 2 * tensor.size(0)))
+        grown[: tensor.size(0)] = tensor
+        return grown
+
+    def intern(self, keys: List, make_vecs) -> List[int]:
+        """
+        Return the row of every key, vectorizing the keys that are new.
+
+        :param keys:
+            hashable keys, e.g. candidate strings
+        :param make_vecs:
+            called with the list of new keys, returns their vectors
+        """
+        rows = self.rows
+        new_keys = [k for k in dict.fromkeys(keys) if k not in rows]
+        if new_keys:
+            vecs = [torch.as_tensor(v, dtype=torch.long) for v in make_vecs(new_keys)]
+            with self._lock:
+                for key, vec in zip(new_keys, vecs):
+                    if key in rows:
+                        continue
+                    row = len(rows)
+                    self._offsets = self._grow(self._offsets, row + 1)
+                    self._lengths = self._grow(self._lengths, row + 1)
+                    self._tokens = self._grow(self._tokens, self._size + len(vec))
+                    self._tokens[self._size : self._size + len(vec)] = vec
+                    self._offsets[row] = self._size
+                    self._lengths[row] = len(vec)
+                    self._spans.append((self._size, len(vec)))
+                    self._size += len(vec)
+                    rows[key] = row
+        return [rows[k] for k in keys]
+
+    def intern_shared(
+        self, keys, make_vecs, name: Optional[Hashable] = None
+    ) -> Tuple[List[int], List]:
+        """
+        Return the rows and vectors of an immutable sequence of keys.
+
+        Like ``intern``, but the result is remembered for the ``keys`` object,
+        so a sequence that is given again and again, like the candidates of a
+        candidate file, is only looked up once. The returned lists are shared
+        and must not be modified.
+
+        :param name:
+            only the latest sequence of each name is remembered, so a sequence
+            which replaces another one, like a candidate file read again after
+            it changed, frees the old one. Defaults to the id of ``keys``.
+        """
+        if name is None:
+            name = id(keys)
+        found = self._shared.get(name)
+        if found is None or found[0] is not keys:
+            rows = self.intern(keys, make_vecs)
+            found = (keys, rows, [self.vec(row) for row in rows])
+            with self._lock:
+                self._shared[name] = found
+        return found[1], found[2]
+
+    def vec(self, row: int) -> torch.LongTensor:
+        """
+        Return the vector of a row.
+        """
+        offset, length = self._spans[row]
+        return self._tokens[offset : offset + length].long()
+
+    def padded(
+        self, rows: List[List[int]], pad_idx: int = 0, fp16friendly: bool = False
+    ) -> torch.LongTensor:
+        """
+        Return a [len(rows), max rows, max length] tensor of the given rows.
+
+        Gives the same result as ``padded_3d`` on the vectors of the rows.
+        """
+        index = torch.full((len(rows), max(len(r) for r in rows)), -1, dtype=torch.long)
+        for i, row in enumerate(rows):
+            index[i, : len(row)] = torch.as_tensor(row, dtype=torch.long)
+        with self._lock:
+            tokens, offsets, lengths = self._tokens, self._offsets, self._lengths
+        valid = index >= 0
+        index = index.clamp(min=0)
+        lengths = lengths[index] * valid
+        c = int(lengths.max()) if lengths.numel() else 0
+        if fp16friendly and c % FP16_PAD_SIZE != 0:
+            c += FP16_PAD_SIZE - (c % FP16_PAD_SIZE)
+        c = max(c, 1)
+        steps = torch.arange(c)
+        positions = (offsets[index].unsqueeze(-1) + steps).clamp(max=tokens.size(0) - 1)
+        output = tokens[positions].long()
+        output.masked_fill_(steps >= lengths.unsqueeze(-1), pad_idx)
+        return output
+
+
+def quantize_linear_layers(
+    model: torch.nn.Module, within: Tuple[type, ...] = ()
+) -> torch.nn.Module:
+    """
+    Dynamically quantize the weights of Linear layers to int8, for CPU inference.
+
+    Activations are quantized on the fly, so the returned model can be used as
+    is, but it cannot be trained any more.
+
+    :param model:
+        the model to quantize. It is not modified.
+    :param within:
+        if given, only quantize the Linear layers that are direct children of
+        modules of these types.
+
+    :return:
+        the quantized model
+    """
+    if within:
+        names = set()
+        for parent_name, parent in model.named_modules():
+            if isinstance(parent, within):
+                for name, child in parent.named_children():
+                    if isinstance(child, torch.nn.Linear):
+                        names.add(parent_name + '.' + name if parent_name else name)
+        qconfig_spec = names
+    else:
+        qconfig_spec = {torch.nn.Linear}
+    return torch.quantization.quantize_dynamic(
+        model, qconfig_spec=qconfig_spec, dtype=torch.qint8
+    )
+
+
 Chunk = TypeVar('Chunk')
 
 
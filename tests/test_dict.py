@@ -15,6 +15,7 @@ from parlai.core.dict import DictionaryAgent
 from parlai.core.opt import Opt
 
 import parlai.utils.testing as testing_utils
+import numpy as np
 import os
 import shutil
 import unittest
@@ -126,6 +127,41 @@ class TestDictionary(unittest.TestCase):
         assert vec[0] == num_builtin
         assert vec[1] == num_builtin + 1
 
+    def test_txt2vec_batch(self):
+        """
+        Check batched vectorization matches txt2vec, with and without BPE.
+        """
+        texts = [
+            'hello world, hello again',
+            '',
+            'unknown tokens are mapped to __unk__',
+            'The quick brown fox jumps over the lazy dog.\nTwice!',
+        ]
+        with testing_utils.tempdir() as tmpdir:
+            for tokenizer in ['re', 'bpe']:
+                opt = Opt(
+                    {
+                        'dict_tokenizer': tokenizer,
+                        'dict_file': os.path.join(tmpdir, tokenizer + '.dict'),
+                        'dict_maxtokens': 50,
+                    }
+                )
+                dictionary = DictionaryAgent(opt)
+                for text in texts[:1] + texts[3:]:
+                    dictionary.observe({'text': text})
+                    dictionary.act()
+                dictionary.save()
+                # reload, so that the bpe codecs are applied
+                for cache_size in [0, 100]:
+                    opt['dict_bpe_cache_size'] = cache_size
+                    dictionary = DictionaryAgent(opt)
+                    expected = [dictionary.txt2vec(text) for text in texts]
+                    assert dictionary.txt2vec_batch(texts) == expected
+                    assert dictionary.txt2vec_batch(texts, num_workers=2) == expected
+                    vecs = dictionary.txt2vec_batch(texts, vec_type=np.ndarray)
+                    assert [v.tolist() for v in vecs] == expected
+                    assert dictionary.txt2vec_batch([]) == []
+
     def test_set_model_file_without_dict_file(self):
         """
         Check that moving a model without moving the dictfile raises an error.
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import unittest
+
+import torch
+
+from parlai.core.agents import create_agent
+from parlai.core.worlds import create_task
+from parlai.scripts.build_dict import build_dict
+from parlai.scripts.train_model import setup_args
+import parlai.utils.testing as testing_utils
+
+NUM_WORKERS_CHOICES = [2, 3]
+
+
+class TestPreprocessWorkers(unittest.TestCase):
+    """
+    Check that batches prepared by --num-workers match the plain world.
+    """
+
+    def _train(self, num_workers, parleys=520):
+        """
+        Train for a number of batches and return the counts and loss.
+        """
+        with testing_utils.tempdir() as tmpdir:
+            parser = setup_args()
+            parser.set_params(
+                task='integration_tests:multiturn',
+                datatype='train:ordered',
+                model='transformer/ranker',
+                model_file=os.path.join(tmpdir, 'model'),
+                dict_file=os.path.join(tmpdir, 'model.dict'),
+                batchsize=8,
+                n_layers=1,
+                n_heads=1,
+                ffn_size=32,
+                embedding_size=32,
+                learn_positional_embeddings=True,
+                candidates='batch',
+                num_workers=num_workers,
+            )
+            opt = parser.parse_args([], print_args=False)
+            build_dict(opt)
+            torch.manual_seed(0)
+            world = create_task(opt, create_agent(opt))
+            try:
+                for _ in range(parleys):
+                    world.parley()
+                report = world.report()
+                return (
+                    report['exs'].value(),
+                    report['mean_loss'].value(),
+                    world.get_total_exs(),
+                    world.get_total_epochs(),
+                )
+            finally:
+                world.shutdown()
+
+    def test_train(self):
+        """
+        Training loops over the data and counts examples and epochs the same.
+        """
+        base_exs, base_loss, base_total_exs, base_epochs = self._train(0)
+        # the workers loop over the data, here more than twice
+        self.assertGreater(base_epochs, 2)
+        for nw in [1] + NUM_WORKERS_CHOICES:
+            exs, loss, total_exs, epochs = self._train(nw)
+            self.assertEqual(exs, base_exs)
+            self.assertEqual(total_exs, base_total_exs)
+            self.assertEqual(epochs, base_epochs)
+            if nw == 1:
+                # a single worker makes the same batches in the same order
+                self.assertAlmostEqual(loss, base_loss, places=4)
+
+    def test_eval(self):
+        """
+        Evaluation covers each example once and scores the same.
+        """
+        opt = dict(
+            task='integration_tests:multiturn',
+            model='transformer/ranker',
+            batchsize=8,
+            n_layers=1,
+            n_heads=1,
+            ffn_size=32,
+            embedding_size=32,
+            learn_positional_embeddings=True,
+            candidates='batch',
+            eval_candidates='inline',
+        )
+        base_valid, base_test = testing_utils.eval_model(opt)
+        for nw in NUM_WORKERS_CHOICES:
+            opt['num_workers'] = nw
+            valid, test = testing_utils.eval_model(opt)
+            self.assertEqual(valid['exs'], base_valid['exs'])
+            self.assertEqual(test['exs'], base_test['exs'])
+            self.assertEqual(valid['accuracy'], base_valid['accuracy'])
+            self.assertEqual(test['accuracy'], base_test['accuracy'])
+
+
+if __name__ == '__main__':
+    unittest.main()
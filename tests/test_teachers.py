@@ -11,6 +11,12 @@ A module for testing various teacher types in ParlAI
 
 import os
 import unittest
+from parlai.core.agents import create_agent
+from parlai.core.dict import DictionaryAgent
+from parlai.core.params import ParlaiParser
+from parlai.core.message import Message
+from parlai.core.teachers import ChunkTeacher, FbDialogTeacher
+from parlai.core.worlds import create_task
 from parlai.utils import testing as testing_utils
 import regex as re
 
@@ -57,5 +63,188 @@ class TestAbstractImageTeacher(unittest.TestCase):
         self._test_display_output('resnet152')
 
 
+class TestDialogCache(unittest.TestCase):
+    """
+    Test --dialog-cache-dir.
+    """
+
+    def _teacher(self, tmpdir, cache_dir):
+        opt = {
+            'datafile': os.path.join(tmpdir, 'data.txt'),
+            'datatype': 'train:ordered',
+            'datapath': tmpdir,
+            'dict_file': os.path.join(tmpdir, 'dict'),
+            'dialog_cache_dir': cache_dir,
+        }
+        return FbDialogTeacher(opt)
+
+    def test_fbdialog_cache(self):
+        with testing_utils.tempdir() as tmpdir:
+            with open(os.path.join(tmpdir, 'data.txt'), 'w') as f:
+                f.write('1 hello there\tgeneral kenobi|hi\t\tgeneral kenobi|hi|bye\n')
+                f.write('2 how are you?\tfine\n')
+                f.write('1 only context\n')
+                f.write('2 question\tanswer\t1\n')
+            dict_opt = {'dict_file': os.path.join(tmpdir, 'dict')}
+            dictionary = DictionaryAgent(dict_opt)
+            for token in ['hello', 'there', 'general', 'kenobi', 'how', 'you']:
+                dictionary[token] = 1
+            dictionary.save()
+
+            cache_dir = os.path.join(tmpdir, 'cache')
+            uncached = self._teacher(tmpdir, None)
+            built = self._teacher(tmpdir, cache_dir)
+            with testing_utils.capture_output() as output:
+                loaded = self._teacher(tmpdir, cache_dir)
+            self.assertNotIn('loading fbdialog data', output.getvalue())
+            self.assertEqual(loaded.data.data, uncached.data.data)
+            self.assertEqual(built.data.data, uncached.data.data)
+            rewards = [entry[2] for ep in loaded.data.data for entry in ep]
+            self.assertEqual(rewards, [0, 0, 1.0])
+            self.assertIsInstance(rewards[0], int)
+
+            # the dictionary looks up the tokens instead of tokenizing
+            dictionary = DictionaryAgent(dict_opt)
+            expected = dictionary.txt2vec('how are you?')
+            dictionary.tokenize = None
+            self.assertEqual(dictionary.txt2vec('how are you?'), expected)
+            with self.assertRaises(TypeError):
+                dictionary.txt2vec('not in the data')
+
+    def _stream(self, teacher):
+        texts = []
+        while not teacher.epoch_done():
+            texts.append(teacher.act()['text'])
+        return texts
+
+    def test_stream_index(self):
+        with testing_utils.tempdir() as tmpdir:
+            with open(os.path.join(tmpdir, 'data.txt'), 'w') as f:
+                for i in range(10):
+                    f.write('1 text {}\tlabel {}\t\tlabel {}|other\n'.format(i, i, i))
+                    f.write('2 more {}\tmore label {}\n'.format(i, i))
+            opt = {
+                'datafile': os.path.join(tmpdir, 'data.txt'),
+                'datatype': 'valid:stream',
+                'datapath': tmpdir,
+                'dialog_cache_dir': os.path.join(tmpdir, 'cache'),
+            }
+            expected = self._stream(FbDialogTeacher({**opt, 'dialog_cache_dir': None}))
+            self.assertEqual(self._stream(FbDialogTeacher(opt)), expected)
+            with testing_utils.capture_output() as output:
+                teacher = FbDialogTeacher(opt)
+            self.assertNotIn('loading fbdialog data', output.getvalue())
+            self.assertEqual(teacher.num_episodes(), 10)
+            self.assertEqual(teacher.num_examples(), 20)
+
+            # copies of the data read disjoint episodes
+            copies = [FbDialogTeacher(opt, teacher.share()) for _ in range(3)]
+            texts = []
+            while not all(c.epoch_done() for c in copies):
+                for copy in copies:
+                    if not copy.epoch_done():
+                        texts.append(copy.act()['text'])
+            self.assertEqual(sorted(texts), sorted(expected))
+
+            # training streams cycle in a new order every epoch
+            teacher = FbDialogTeacher({**opt, 'datatype': 'train:stream'})
+            first = [teacher.act()['text'] for _ in range(20)]
+            second = [teacher.act()['text'] for _ in range(20)]
+            self.assertEqual(sorted(first), sorted(expected))
+            self.assertEqual(sorted(second), sorted(expected))
+            self.assertNotEqual(first, second)
+
+
+class _NumberChunkTeacher(ChunkTeacher):
+    """
+    Four chunks of ten numbers each.
+    """
+
+    def _get_data_folder(self):
+        return None
+
+    def get_num_samples(self, datatype):
+        return 40, 40
+
+    def get_fold_chunks(self, datatype):
+        return [0, 1, 2, 3]
+
+    def load_from_chunk(self, chunk_idx):
+        return [str(chunk_idx * 10 + i) for i in range(10)]
+
+    def create_message(self, queue_output):
+        return Message({'text': queue_output, 'episode_done': True})
+
+
+class TestChunkTeacher(unittest.TestCase):
+    """
+    Test loading chunks in parallel.
+    """
+
+    def _epoch(self, **kwargs):
+        opt = {'datatype': 'valid:stream', 'numthreads': 1, **kwargs}
+        teacher = _NumberChunkTeacher(opt)
+        texts = []
+        while not teacher.epoch_done():
+            texts.append(teacher.act()['text'])
+        report = teacher.report()
+        teacher.shutdown()
+        return texts, report
+
+    def test_loaders(self):
+        expected = [str(i) for i in range(40)]
+        for loaders in [1, 3]:
+            for processes in [False, True]:
+                texts, report = self._epoch(
+                    chunk_loaders=loaders, chunk_loader_processes=processes
+                )
+                self.assertEqual(sorted(texts, key=int), expected)
+                self.assertIn('chunk_buffer', report)
+                self.assertIn('chunk_stall_ms', report)
+
+
+class TestBucketBatches(unittest.TestCase):
+    """
+    Test --bucket-batches.
+    """
+
+    def _epoch(self, datatype, bucket_batches):
+        parser = ParlaiParser(True, True)
+        opt = parser.parse_args(
+            [
+                '--task',
+                'integration_tests:variable_length',
+                '--model',
+                'repeat_label',
+                '--datatype',
+                datatype,
+                '--batchsize',
+                '8',
+                '--bucket-batches',
+                str(bucket_batches),
+            ],
+            print_args=False,
+        )
+        world = create_task(opt, create_agent(opt))
+        batches = []
+        while not world.epoch_done():
+            world.parley()
+            acts = [w.get_acts()[0] for w in world.worlds]
+            batches.append([len(a['text']) for a in acts if 'text' in a])
+        return batches
+
+    def _padding(self, batches):
+        total = sum(max(b) * len(b) for b in batches if b)
+        return 1 - sum(sum(b) for b in batches) / total
+
+    def test_bucket_batches(self):
+        unbucketed = self._epoch('valid', 0)
+        bucketed = self._epoch('valid', 10)
+        flatten = lambda batches: sorted(x for b in batches for x in b)
+        # same examples, with less padding
+        self.assertEqual(flatten(bucketed), flatten(unbucketed))
+        self.assertLess(self._padding(bucketed), self._padding(unbucketed) / 2)
+
+
 if __name__ == '__main__':
     unittest.main()
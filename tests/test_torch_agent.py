@@ -741,6 +741,29 @@ class TestTorchAgent(unittest.TestCase):
         text = agent.history.get_history_str()
         self.assertEqual(text, 'I am Groot. Groot! I am Groot.')
 
+    def test_history_tensor(self):
+        """
+        Test the history tensor matches the history vec as utterances are evicted.
+        """
+        for kwargs in [
+            dict(history_size=3, text_truncate=8),
+            dict(history_size=2, history_add_global_end_token='end'),
+            dict(history_size=-1, text_truncate=5, delimiter=' Groot! '),
+        ]:
+            agent = get_agent(**kwargs)
+            self.assertIsNone(agent.history.get_history_tensor())
+            for i in range(1, 30):
+                text = ' '.join(['Groot'] * (i % 4))
+                if i % 2:
+                    agent.history.update_history({'text': text})
+                else:
+                    agent.history.add_reply(text)
+                vec = agent.history.get_history_vec()
+                tensor = agent.history.get_history_tensor()
+                self.assertEqual(tensor.tolist(), list(vec))
+            agent.history.reset()
+            self.assertIsNone(agent.history.get_history_tensor())
+
     def test_observe(self):
         """
         Make sure agent stores and returns observation.
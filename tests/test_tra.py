@@ -10,8 +10,18 @@ Test TorchRankerAgent.
 import os
 import unittest
 
+import torch
+
 import parlai.utils.testing as testing_utils
+from parlai.core.agents import create_agent, create_agent_from_shared
+from parlai.core.opt import Opt
 from parlai.tasks.integration_tests.agents import CandidateTeacher
+from parlai.utils.candidate_store import CandidateStore
+
+
+def _with_overrides(opt, **overrides):
+    overrides = {**opt['override'], **overrides}
+    return Opt({**opt, 'override': overrides, **overrides})
 
 
 class _AbstractTRATest(unittest.TestCase):
@@ -41,6 +51,22 @@ class _AbstractTRATest(unittest.TestCase):
         # Accuracy threshold
         return 0.8
 
+    def _trained_ranker(self, tmpdir, cands, **overrides):
+        """
+        Train a small model in tmpdir and return the opt to load it with cands.
+        """
+        args = self._get_args()
+        args['num_epochs'] = 0.5
+        args['model_file'] = os.path.join(tmpdir, 'model')
+        testing_utils.train_model(args)
+        cands_file = os.path.join(tmpdir, 'cands.txt')
+        with open(cands_file, 'w') as f:
+            f.write('\n'.join(cands))
+        opt = Opt({'model_file': args['model_file'], 'override': {}})
+        return _with_overrides(
+            opt, fixed_candidates_path=cands_file, interactive_mode=True, **overrides
+        )
+
     # test train inline cands
     @testing_utils.retry(ntries=3)
     def test_train_inline(self):
@@ -145,6 +171,151 @@ class _AbstractTRATest(unittest.TestCase):
         # correct label
         self.assertEqual(valid['hits@100'], 0)
 
+    def test_update_fixed_candidates(self):
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:20]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = self._trained_ranker(tmpdir, cands[:10], encode_candidate_vecs=True)
+            cands_file = opt['fixed_candidates_path']
+            agent = create_agent(opt, True)
+            copy = create_agent_from_shared(agent.share())
+            self.assertEqual(copy.num_fixed_candidates, 10)
+
+            new = agent.update_fixed_candidates(
+                add=cands[10:12], remove=cands[:1], modify={cands[1]: cands[12]}
+            )
+            self.assertEqual(new, [cands[12]] + cands[2:12])
+            with open(cands_file) as f:
+                self.assertEqual(f.read().splitlines(), new)
+
+            # copies switch to the new set on their next step
+            copy.observe({'text': cands[0], 'episode_done': True})
+            copy.act()
+            self.assertEqual(copy.fixed_candidates, new)
+            self.assertIs(copy.fixed_candidate_encs, agent.fixed_candidate_encs)
+
+            # a fresh agent reuses the stored encodings of the updated set
+            fresh = create_agent(opt, True)
+            self.assertEqual(fresh.fixed_candidates, new)
+            self.assertTrue(
+                fresh.fixed_candidate_encs.float().allclose(
+                    agent.fixed_candidate_encs.float()
+                )
+            )
+
+    def test_rank_metrics(self):
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:5]]
+        scores = torch.FloatTensor([[3, 1, 2, 0], [1, 1, 0, 0], [0, 1, 2, 3]])
+        labels = torch.LongTensor([1, 1, 0])
+        with testing_utils.tempdir() as tmpdir:
+            opt = self._trained_ranker(tmpdir, cands)
+            for rank_top_k, expected in ((-1, [3, 1, 4]), (2, [5, 1, 5])):
+                agent = create_agent(_with_overrides(opt, rank_top_k=rank_top_k), True)
+                agent._get_rank_metrics(scores, labels)
+                ranks = [m.value() for m in agent._local_metrics['rank']]
+                mrrs = [m.value() for m in agent._local_metrics['mrr']]
+                # tied candidates do not count, and with a top k the labels
+                # outside of it are ranked after all candidates
+                self.assertEqual(ranks, expected)
+                for mrr, rank in zip(mrrs, expected):
+                    self.assertAlmostEqual(mrr, 1 / rank, places=5)
+
+    def test_score_chunksize(self):
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:50]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = self._trained_ranker(
+                tmpdir, cands, return_cand_scores=True, rank_top_k=10
+            )
+            replies = {}
+            for chunksize in (-1, 7):
+                agent = create_agent(
+                    _with_overrides(opt, score_chunksize=chunksize), True
+                )
+                copies = [create_agent_from_shared(agent.share()) for _ in range(4)]
+                observations = [
+                    c.observe({'text': text, 'episode_done': True})
+                    for c, text in zip(copies, cands)
+                ]
+                replies[chunksize] = agent.batch_act(observations)
+
+            for full, chunked in zip(replies[-1], replies[7]):
+                self.assertEqual(len(chunked['text_candidates']), 10)
+                self.assertTrue(
+                    full['sorted_scores'].allclose(chunked['sorted_scores'], atol=1e-5)
+                )
+
+            # the scores of all candidates are returned whatever the chunksize
+            agent = create_agent(
+                _with_overrides(
+                    opt, rank_top_k=-1, cap_num_predictions=5, score_chunksize=7
+                ),
+                True,
+            )
+            agent.observe({'text': cands[0], 'episode_done': True})
+            self.assertEqual(len(agent.act()['sorted_scores']), len(cands))
+
+    def test_candidate_file_labels(self):
+        from parlai.utils.candidate_registry import CandidateSet
+
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:12]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = _with_overrides(
+                self._trained_ranker(tmpdir, cands),
+                interactive_mode=False,
+                eval_candidates='inline',
+            )
+            base = CandidateSet(cands[:10])
+            for intern in (False, True):
+                agent = create_agent(_with_overrides(opt, intern_candidate_vecs=intern))
+                obs = agent.observe(
+                    {
+                        'text': cands[0],
+                        'eval_labels': [cands[11]],
+                        'label_candidates': base.extended(cands[10:]),
+                        'episode_done': True,
+                    }
+                )
+                self.assertEqual(len(obs['label_candidates_vecs']), 12)
+                # the labels an example adds are only kept with the flag
+                num_interned = sum(len(v) for v in agent.interned_cands.values())
+                self.assertEqual(num_interned, 12 if intern else 10)
+                self.assertEqual(len(agent.act()['text_candidates']), 12)
+
+    def test_batched_repeat_blocking(self):
+        from parlai.chat_service.utils.batching import (
+            InferenceScheduler,
+            observation_with_history,
+        )
+
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:20]]
+        with testing_utils.tempdir() as tmpdir:
+            agent = create_agent(self._trained_ranker(tmpdir, cands), True)
+            sessions = [create_agent_from_shared(agent.share()) for _ in range(4)]
+            for session, text in zip(sessions, [cands[0], cands[0], cands[2]]):
+                session.observe({'text': text, 'episode_done': False})
+            expected = sessions[0].act()['text_candidates']
+            self.assertNotIn(cands[0], expected)
+
+            # another copy answers the sessions with the same blocking; tied
+            # candidates may come in another order in a batch
+            batch_agent = create_agent_from_shared(agent.share())
+            replies = batch_agent.batch_act(
+                [observation_with_history(s) for s in sessions[1:3]]
+            )
+            self.assertEqual(set(replies[0]['text_candidates']), set(expected))
+            self.assertNotIn(cands[2], replies[1]['text_candidates'])
+            self.assertIn(cands[0], replies[1]['text_candidates'])
+
+            scheduler = InferenceScheduler(agent.share())
+            sessions[3].observe({'text': cands[0], 'episode_done': False})
+            reply = scheduler.act(sessions[3], timeout=60)
+            scheduler.shutdown()
+            self.assertEqual(set(reply['text_candidates']), set(expected))
+
 
 class TestTransformerRanker(_AbstractTRATest):
     def _get_args(self):
@@ -189,6 +360,116 @@ class TestPolyRanker(_AbstractTRATest):
     def _get_threshold(self):
         return 0.6
 
+    def test_export_polyencoder(self):
+        from parlai.scripts.export_polyencoder import export_polyencoder
+        from parlai.utils.scripted_ranker import ScriptedRanker
+
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:30]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = self._trained_ranker(
+                tmpdir,
+                cands,
+                encode_candidate_vecs=True,
+                return_cand_scores=True,
+                rank_top_k=5,
+                repeat_blocking_heuristic=False,
+            )
+            export_path = export_polyencoder(
+                Opt({**opt, 'export_path': os.path.join(tmpdir, 'model.pt')})
+            )
+            ranker = ScriptedRanker(export_path)
+            self.assertEqual(ranker.candidates, cands)
+
+            # contexts of different lengths, so that padding matters
+            texts = [cands[0], cands[1][:3], ' '.join(cands[2:5]), 'unknown words']
+            agent = create_agent(opt, True)
+            copies = [create_agent_from_shared(agent.share()) for _ in texts]
+            observations = [
+                c.observe({'text': text, 'episode_done': True})
+                for c, text in zip(copies, texts)
+            ]
+            replies = agent.batch_act(observations)
+            for reply, ranked in zip(replies, ranker.rank(texts, k=5)):
+                self.assertEqual(reply['text_candidates'], [c for c, _ in ranked])
+                for score, (_, exported) in zip(reply['sorted_scores'], ranked):
+                    self.assertAlmostEqual(score.item(), exported, places=4)
+
+    def test_context_cache_after_training(self):
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:10]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = _with_overrides(
+                self._trained_ranker(tmpdir, cands),
+                interactive_mode=False,
+                datatype='train',
+                candidates='inline',
+                eval_candidates='inline',
+                poly_context_cache_mb=1,
+            )
+            agent = create_agent(opt, True)
+
+            def validate():
+                obs = agent.observe(
+                    {
+                        'text': cands[0],
+                        'eval_labels': [cands[1]],
+                        'label_candidates': cands,
+                        'episode_done': True,
+                    }
+                )
+                agent.act()
+                return agent.context_cache.get(agent._context_cache_key(obs))[0]
+
+            def train():
+                agent.observe(
+                    {
+                        'text': cands[2],
+                        'labels': [cands[3]],
+                        'label_candidates': cands,
+                        'episode_done': True,
+                    }
+                )
+                agent.act()
+
+            train()
+            before = validate()
+            train()
+            after = validate()
+            self.assertFalse(torch.equal(before, after))
+            batch = agent.batchify([agent.observe({'text': cands[0]})])
+            agent.model.eval()
+            fresh = agent.model(**agent._model_context_input(batch))[0][0]
+            self.assertTrue(fresh.allclose(after, atol=1e-5))
+
+    def test_update_fixed_candidates_int8(self):
+        teacher = CandidateTeacher({'datatype': 'train'})
+        cands = [' '.join(x) for x in teacher.train[:12]]
+        with testing_utils.tempdir() as tmpdir:
+            opt = self._trained_ranker(
+                tmpdir, cands[:10], encode_candidate_vecs=True, poly_int8_inference=True
+            )
+            agent = create_agent(opt, True)
+            store = CandidateStore(agent._fixed_candidates_store_path() + '.encs')
+            signature = store.read_manifest()['signature']
+            before = agent.fixed_candidate_encs.clone()
+
+            agent.update_fixed_candidates(add=cands[10:])
+            # the stored encodings are still those of the float model
+            self.assertEqual(store.read_manifest()['signature'], signature)
+            self.assertTrue(torch.equal(agent.fixed_candidate_encs[:, :10], before))
+            float_agent = create_agent(
+                _with_overrides(
+                    opt, poly_int8_inference=False, fixed_candidate_vecs='replace'
+                ),
+                True,
+            )
+            self.assertTrue(
+                float_agent.fixed_candidate_encs.allclose(
+                    agent.fixed_candidate_encs, atol=1e-5
+                )
+            )
+
     def test_eval_fixed_label_not_in_cands(self):
         # test where cands during eval do not contain test label
         args = self._get_args()
@@ -5,9 +5,37 @@
 # LICENSE file in the root directory of this source tree.
 
 from parlai.core.opt import Opt
-from parlai.utils.misc import Timer, round_sigfigs, set_namedtuple_defaults
-from parlai.utils.torch import padded_tensor, argsort
+from parlai.utils.misc import (
+    StageTimer,
+    Timer,
+    load_cands,
+    round_sigfigs,
+    set_namedtuple_defaults,
+)
+from parlai.utils.torch import (
+    padded_tensor,
+    padded_3d,
+    argsort,
+    quantize_linear_layers,
+    InternedVectors,
+    QuantizedRows,
+    TensorCache,
+)
+from parlai.utils.ann import IVFIndex
+from parlai.utils.candidate_store import (
+    CandidateStore,
+    hash_state_dict,
+    hash_text,
+    load_or_build,
+)
+from parlai.utils.candidate_registry import get_candidates
+from parlai.utils.dialog_store import DialogStore
+from parlai.utils.response_cache import ResponseCache
+import parlai.utils.testing as testing_utils
 from copy import deepcopy
+import json
+import os
+import pickle
 import time
 import unittest
 import torch
@@ -69,6 +97,34 @@ class TestUtils(unittest.TestCase):
         assert turtle.time() > 0
         assert turtle.time() < rabbit.time()
 
+    def test_stage_timer(self):
+        timer = StageTimer(max_events=10)
+        with timer.stage('outer'):
+            time.sleep(0.01)
+            with timer.stage('inner'):
+                time.sleep(0.02)
+        with timer.stage('inner'):
+            pass
+        times = timer.pop()
+        assert set(times) == {'outer', 'inner'}
+        # the outer stage excludes the time of the inner one
+        assert times['inner'] > times['outer'] > 0
+        assert timer.pop() == {}
+
+        with testing_utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'trace.json')
+            timer.save_trace(path)
+            with open(path) as f:
+                events = json.load(f)['traceEvents']
+        assert [e['name'] for e in events] == ['inner', 'outer', 'inner']
+        # the trace keeps the full duration of nested stages
+        assert events[1]['dur'] > events[0]['dur']
+
+        disabled = StageTimer(enabled=False)
+        with disabled.stage('outer'):
+            pass
+        assert disabled.pop() == {}
+
     def test_setnamedtupledefaults(self):
         from collections import namedtuple
 
@@ -119,6 +175,264 @@ class TestUtils(unittest.TestCase):
 
         assert np.all(argsort(torch_keys, torch_keys)[0].numpy() == np.arange(1, 6))
 
+    def test_ivf_index(self):
+        torch.manual_seed(0)
+        encs = torch.randn(400, 16)
+        queries = torch.randn(5, 16)
+        exact_scores, exact_ids = queries.mm(encs.t()).topk(10, dim=1)
+
+        # probing every cell is exact
+        index = IVFIndex(encs, n_lists=20, n_probe=20)
+        scores, ids = index.search(queries, 10)
+        assert torch.equal(ids, exact_ids)
+        assert torch.allclose(scores, exact_scores, atol=1e-5)
+
+        # probing fewer cells still returns full rows of valid ids
+        index = IVFIndex(encs, n_lists=20, n_probe=2)
+        scores, ids = index.search(queries, 10)
+        assert ids.shape == (5, 10)
+        assert torch.allclose(scores, (queries.unsqueeze(1) * encs[ids]).sum(2))
+
+    def test_candidate_store(self):
+        built = []
+
+        def build(cands):
+            def build_fn(idx):
+                built.extend(cands[i] for i in idx)
+                return torch.stack([torch.full((1, 3), len(cands[i])) for i in idx], 1)
+
+            return build_fn
+
+        with testing_utils.tempdir() as tmpdir:
+            store = CandidateStore(os.path.join(tmpdir, 'cands.encs'), dim=1)
+            cands = ['a', 'bb', 'ccc']
+            hashes = [hash_text(c) for c in cands]
+            first = load_or_build(store, 'sig', hashes, build(cands))
+            assert first.shape == (1, 3, 3)
+            assert first[0, :, 0].tolist() == [1, 2, 3]
+            assert built == cands
+
+            # unchanged candidates are memory-mapped without recomputation
+            del built[:]
+            again = load_or_build(store, 'sig', hashes, build(cands))
+            assert built == []
+            assert torch.equal(first, again)
+
+            # only new candidates are computed
+            cands = ['dddd', 'a', 'ccc']
+            hashes = [hash_text(c) for c in cands]
+            updated = load_or_build(store, 'sig', hashes, build(cands))
+            assert built == ['dddd']
+            assert updated[0, :, 0].tolist() == [4, 1, 3]
+
+            # a new signature rebuilds everything
+            del built[:]
+            load_or_build(store, 'other', hashes, build(cands))
+            assert built == cands
+
+            # a data file published without its manifest is never used
+            manifest = store.read_manifest()
+            other = CandidateStore(os.path.join(tmpdir, 'other'), dim=1)
+            other.save(torch.zeros(1, 3, 3), 'other', hashes)
+            os.replace(other.data_path, store.data_path)
+            assert store.load(manifest) is None
+            assert not [f for f in os.listdir(tmpdir) if '.tmp' in f]
+
+    def test_tensor_cache(self):
+        entry = (torch.zeros(256),)  # 1kb
+        cache = TensorCache(max_mb=3 / 1024)
+        for key in 'abc':
+            cache.put(key, entry)
+        assert len(cache) == 3
+        assert cache.num_bytes == 3 * 1024
+        # touching 'a' makes 'b' the least recently used entry
+        assert cache.get('a') is not None
+        cache.put('d', entry)
+        assert cache.get('b') is None
+        assert all(cache.get(k) is not None for k in 'acd')
+        # entries larger than the cache are not stored
+        cache.put('e', (torch.zeros(2048),))
+        assert cache.get('e') is None
+        assert cache.num_bytes == 3 * 1024
+
+        cache = TensorCache(max_mb=1, ttl=0.05)
+        cache.put('a', entry)
+        assert cache.get('a') is not None
+        time.sleep(0.1)
+        assert cache.get('a') is None
+        assert cache.num_bytes == 0
+
+    def test_quantized_rows(self):
+        torch.manual_seed(0)
+        encs = torch.randn(1, 20, 16)
+        rows = QuantizedRows(encs)
+        assert rows.dtype == torch.int8
+        assert rows.size() == encs.size()
+        assert rows.num_bytes() < encs.numel() * 4 / 3
+        # each row is scaled separately, so the error is relative to the row
+        err = (rows.dequantize() - encs).abs().max(-1)[0]
+        assert (err <= encs.abs().max(-1)[0] / 127).all()
+        # slices and row selections only dequantize the selected rows
+        assert torch.equal(rows[:, 5:8].dequantize(), rows.dequantize()[:, 5:8])
+        idx = torch.LongTensor([[3, 1], [0, 19]])
+        assert torch.equal(rows[0][idx].dequantize(), rows.dequantize()[0][idx])
+
+    def test_interned_vectors(self):
+        vecs = {'a': [1, 2, 3], 'b': [4], 'c': [5, 6, 7, 8, 9]}
+        calls = []
+
+        def make_vecs(keys):
+            calls.append(keys)
+            return [vecs[k] for k in keys]
+
+        interned = InternedVectors()
+        rows = [interned.intern(['a', 'b', 'a'], make_vecs)]
+        rows.append(interned.intern(['c', 'b'], make_vecs))
+        # every key is vectorized once
+        assert calls == [['a', 'b'], ['c']]
+        assert len(interned) == 3
+        assert rows[0][0] == rows[0][2]
+        assert interned.vec(rows[1][0]).tolist() == vecs['c']
+        # ragged rows are padded like padded_3d
+        keys = [['a', 'b', 'a'], ['c', 'b']]
+        for fp16friendly in (False, True):
+            expected = padded_3d(
+                [[torch.LongTensor(vecs[k]) for k in ks] for ks in keys],
+                pad_idx=0,
+                fp16friendly=fp16friendly,
+            )
+            assert torch.equal(
+                interned.padded(rows, pad_idx=0, fp16friendly=fp16friendly), expected
+            )
+        # the rows of a shared sequence are only looked up once
+        keys = ('c', 'a')
+        rows, shared_vecs = interned.intern_shared(keys, make_vecs)
+        assert interned.intern_shared(keys, make_vecs)[0] is rows
+        assert rows == interned.intern(list(keys), make_vecs)
+        assert [v.tolist() for v in shared_vecs] == [vecs['c'], vecs['a']]
+        assert len(calls) == 2
+
+    def test_candidate_registry(self):
+        with testing_utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'cands.txt')
+            with open(path, 'w') as f:
+                f.write('1 hi there\n2 fine\n3 hi there\n')
+            cands = get_candidates(path)
+            assert cands == ('hi there', 'fine')
+            assert get_candidates(path) is cands
+            # load_cands still returns every line in a new list
+            assert load_cands(path) == ['hi there', 'fine', 'hi there']
+            assert load_cands(path) is not load_cands(path)
+            assert 'fine' in cands and 'nope' not in cands
+            assert cands.index('fine') == 1
+            extended = cands.extended(['fine', 'bye'])
+            assert extended == ('hi there', 'fine', 'bye')
+            assert extended.base is cands
+            assert 'bye' in extended and 'bye' not in cands
+            assert pickle.loads(pickle.dumps(extended)) == extended
+            # changed files are read again
+            interned = InternedVectors()
+
+            def make_vecs(keys):
+                return [[len(k)] for k in keys]
+
+            interned.intern_shared(cands, make_vecs, cands.source)
+            with open(path, 'a') as f:
+                f.write('4 bye\n')
+            reread = get_candidates(path)
+            assert reread == ('hi there', 'fine', 'bye')
+            assert reread.source == cands.source
+            assert pickle.loads(pickle.dumps(reread)).source == cands.source
+            # the vectors of the replaced set are not kept
+            rows, _ = interned.intern_shared(reread, make_vecs, reread.source)
+            assert rows == [0, 1, 2]
+            assert len(interned._shared) == 1
+            assert all(found[0] is reread for found in interned._shared.values())
+
+    def test_dialog_store(self):
+        cands = ('yes', 'no', 'maybe')
+        episodes = [
+            (('hi', ('yes',), None, cands), ('and?', ('no',), 1, 'same as last time')),
+            (('only text',),),
+            (('x', ('maybe',), 0.0, cands, 'img.jpg'),),
+            ((),),
+        ]
+        store = DialogStore()
+        for episode in episodes:
+            store.append(episode)
+        store.freeze()
+        assert store == episodes
+        assert len(store) == 4
+        assert store.num_examples() == 5
+        assert store[-2][0] == episodes[2][0]
+        assert isinstance(store[2][0][2], float)
+        # the same candidates are only stored once
+        assert len(store.refs) == len(cands) + 3
+        with self.assertRaises(IndexError):
+            store[4]
+        with self.assertRaises(RuntimeError):
+            store.append(episodes[0])
+
+    def test_quantize_linear_layers(self):
+        class Model(torch.nn.Module):
+            def __init__(self):
+                super().__init__()
+                self.block = torch.nn.Sequential(torch.nn.Linear(8, 8))
+                self.out = torch.nn.Linear(8, 4)
+
+            def forward(self, x):
+                return self.out(self.block(x))
+
+        torch.manual_seed(0)
+        model = Model()
+        x = torch.randn(3, 8)
+        quantized = quantize_linear_layers(model, within=(torch.nn.Sequential,))
+        # only direct children of the matching modules are quantized
+        assert type(quantized.block[0]) is not torch.nn.Linear
+        assert type(quantized.out) is torch.nn.Linear
+        assert type(model.block[0]) is torch.nn.Linear
+        assert (quantized(x) - model(x)).abs().max() < 0.1
+        # quantized weights can still be hashed for the candidate stores
+        assert hash_state_dict(quantized.state_dict()) == hash_state_dict(
+            quantized.state_dict()
+        )
+        assert hash_state_dict(quantized.state_dict()) != hash_state_dict(
+            model.state_dict()
+        )
+
+    def test_response_cache(self):
+        with testing_utils.tempdir() as tmpdir:
+            path = os.path.join(tmpdir, 'responses.db')
+            cache = ResponseCache(path)
+            cache.put_many(
+                'sig', [('a', ['x', 'y'], np.array([2.0, 1.0])), ('b', ['y'], None)]
+            )
+            found = cache.get_many('sig', ['a', 'b', 'c'])
+            assert set(found) == {'a', 'b'}
+            assert found['a'][0] == ['x', 'y']
+            assert found['a'][1].tolist() == [2.0, 1.0]
+            assert found['b'] == (['y'], None)
+            # entries of another model or candidate set are never returned
+            assert cache.get_many('other', ['a']) == {}
+            cache.close()
+
+            # the cache persists, and pruning drops stale signatures
+            cache = ResponseCache(path)
+            cache.put_many('other', [('a', ['z'], None)])
+            assert len(cache) == 3
+            cache.prune('other')
+            assert len(cache) == 1
+            assert cache.get_many('other', ['a'])['a'][0] == ['z']
+
+            # but only those of the same namespace
+            cache.put_many('ns1', [('a', ['x'], None)], namespace='one')
+            cache.put_many('ns2', [('a', ['y'], None)], namespace='two')
+            cache.prune('ns1-new', namespace='one')
+            assert cache.get_many('ns1', ['a']) == {}
+            assert cache.get_many('ns2', ['a'])['a'][0] == ['y']
+            assert len(cache) == 2
+            cache.close()
+
     def test_opt(self):
         opt = {'x': 0}
         opt = Opt(opt)
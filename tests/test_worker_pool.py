@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Copyright (c) Facebook, Inc. and its affiliates.
+# This source code is licensed under the MIT license found in the
+# LICENSE file in the root directory of this source tree.
+"""
+Test serving chat sessions from forked worker processes.
+"""
+
+import os
+import signal
+import threading
+import time
+import unittest
+
+from parlai.chat_service.utils.worker_pool import InferenceWorkerPool
+from parlai.core.agents import Agent
+from parlai.core.message import Message
+
+
+class _History(object):
+    def __init__(self):
+        self.history_raw_strings = []
+
+
+class _HistoryAgent(Agent):
+    """
+    Replies with the history it is given, or hangs on 'hang'.
+    """
+
+    def __init__(self, opt, shared=None):
+        super().__init__(opt, shared)
+        self.id = 'history'
+        self.history = _History()
+
+    def observe(self, observation):
+        self.observation = Message(observation)
+        self.history.history_raw_strings.append(self.observation['text'])
+        return self.observation
+
+    def self_observe(self, reply):
+        self.history.history_raw_strings.append(reply['text'])
+
+    def batch_act(self, observations):
+        if any(obs['text'] == 'hang' for obs in observations):
+            time.sleep(60)
+        return [
+            {
+                'id': self.getID(),
+                'text': '|'.join(
+                    obs.get('history_raw_strings', self.history.history_raw_strings)
+                ),
+                'episode_done': False,
+            }
+            for obs in observations
+        ]
+
+
+class TestInferenceWorkerPool(unittest.TestCase):
+    def _pool(self, **kwargs):
+        pool = InferenceWorkerPool(_HistoryAgent({}).share(), **kwargs)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_concurrent_sessions(self):
+        pool = self._pool(num_workers=2, max_batchsize=4, max_wait=0.05)
+        agents = [pool.create_agent() for _ in range(6)]
+        self.assertEqual(sorted(a.worker for a in agents), [0, 0, 0, 1, 1, 1])
+        replies = {}
+
+        def chat(agent):
+            replies[agent.session_id] = []
+            for turn in range(3):
+                agent.observe({'text': str(turn), 'episode_done': False})
+                replies[agent.session_id].append(agent.act(timeout=30)['text'])
+
+        threads = [threading.Thread(target=chat, args=(a,)) for a in agents]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # every session sees its own history, whatever the batches were
+        for agent in agents:
+            self.assertEqual(replies[agent.session_id], ['0', '0|0|1', '0|0|1|0|0|1|2'])
+        self.assertEqual(pool.report()['exs'], 18)
+
+    def test_dead_worker(self):
+        pool = self._pool(num_workers=2)
+        hung, busy = pool.create_agent(), pool.create_agent()
+        self.assertNotEqual(hung.worker, busy.worker)
+        hung.observe({'text': 'hang', 'episode_done': False})
+        pending = pool._submit(hung.worker, hung.session_id, hung.observation)
+
+        # the other worker keeps replying while the first one dies
+        stop = threading.Event()
+
+        def chat():
+            while not stop.is_set():
+                busy.observe({'text': 'hi', 'episode_done': True})
+                busy.act(timeout=30)
+
+        thread = threading.Thread(target=chat)
+        thread.start()
+        try:
+            time.sleep(0.2)
+            os.kill(pool._workers[hung.worker].pid, signal.SIGKILL)
+            with self.assertRaises(RuntimeError):
+                pending.result(timeout=10)
+            # new requests to the dead worker fail at once
+            hung.observe({'text': 'hi', 'episode_done': False})
+            with self.assertRaises(RuntimeError):
+                hung.act(timeout=10)
+            # new sessions go to the live worker
+            self.assertEqual(pool.create_agent().worker, busy.worker)
+        finally:
+            stop.set()
+            thread.join()
+        self.assertEqual(pool.report()['alive'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()